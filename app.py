@@ -38,10 +38,17 @@ st.set_page_config(page_title="AI 测试用例生成系统", layout="wide")
 # 导入后端模块
 from backend.database import Database
 from backend.knowledge_base import KnowledgeBase
+from backend.kb_shards import KnowledgeBaseShards, DEFAULT_NAMESPACE
 from backend.testcase_generator import TestCaseGenerator
 from backend.document_processor import DocumentProcessor
 from backend.ai_client import AIClient
 from backend.qa_logger import QALogger
+from backend.ingest_queue import IngestQueue, STATUS_LABELS, FINISHED_STATUSES
+from backend.kb_watcher import KnowledgeBaseWatcher
+from backend.parse_cache import configure_parse_cache
+
+# 文档解析结果按内容哈希缓存，上传、预览、入库和重建索引共用
+configure_parse_cache(os.path.join(DATA_DIR, "parse_cache"))
 
 # 工具函数
 def save_uploaded_file(uploaded_file, upload_dir=os.path.join(DATA_DIR, "uploads")):
@@ -52,6 +59,30 @@ def save_uploaded_file(uploaded_file, upload_dir=os.path.join(DATA_DIR, "uploads
         f.write(uploaded_file.getbuffer())
     return file_path
 
+@st.cache_resource
+def get_ingest_queue():
+    """进程内共享的知识库后台入库队列，所有会话提交到同一个队列"""
+    kb_dir = os.path.join(DATA_DIR, "knowledge_base")
+    knowledge_base = KnowledgeBaseShards(kb_dir=kb_dir, db_path=DB_PATH, metric="cosine")
+    queue = IngestQueue(knowledge_base, db_path=DB_PATH, database=Database(db_path=DB_PATH))
+    queue.start()
+    return queue
+
+@st.cache_resource
+def get_kb_watcher():
+    """
+    进程内共享的知识库目录监视线程，与入库队列使用同一个知识库实例；KB_WATCH_INTERVAL=0 时不自动扫描
+
+    入库任务还没有成功完成的上传文件不由监视线程同步
+    """
+    interval = float(os.environ.get("KB_WATCH_INTERVAL", "60"))
+    ingest_queue = get_ingest_queue()
+    watcher = KnowledgeBaseWatcher(ingest_queue.knowledge_base, interval=interval or 60,
+                                   skip_files=ingest_queue.unfinished_files)
+    if interval > 0:
+        watcher.start()
+    return watcher
+
 # 初始化会话状态
 if 'initialized' not in st.session_state:
     try:
@@ -60,7 +91,9 @@ if 'initialized' not in st.session_state:
         
         # 知识库使用自定义路径
         kb_dir = os.path.join(DATA_DIR, "knowledge_base")
-        st.session_state.kb = KnowledgeBase(kb_dir=kb_dir, db_path=DB_PATH)
+        # 按产品线分区的知识库，默认分区即原有的知识库目录；搜索默认覆盖所有分区
+        # 新建或重建的索引使用归一化内积（余弦相似度），已有的L2索引在重建前保持不变
+        st.session_state.kb = KnowledgeBaseShards(kb_dir=kb_dir, db_path=DB_PATH, metric="cosine")
         
         # 测试用例生成器使用自定义输出目录
         output_dir = os.path.join(DATA_DIR, "outputs")
@@ -114,9 +147,20 @@ if page == "生成测试用例":
         st.session_state.current_test_cases = ""
     if 'current_test_validation' not in st.session_state:
         st.session_state.current_test_validation = ""
+    if 'doc_sections' not in st.session_state:
+        st.session_state.doc_sections = []
     
     # 文件上传
-    uploaded_file = st.file_uploader("上传 Word 或 PDF 需求文档", type=["docx", "pdf"])
+    uploaded_file = st.file_uploader("上传需求文档（Word、PDF、Markdown、HTML或文本）",
+                                     type=["docx", "pdf", "md", "html", "htm", "txt"])
+    
+    # 多模块的大型需求文档可按标题拆成模块，各模块独立完成三个步骤并行处理，最后合并
+    parallel_col1, parallel_col2 = st.columns([2, 1])
+    with parallel_col1:
+        process_by_section = st.checkbox("按模块并行处理（适合包含多个功能模块的大型需求文档）", key="process_by_section")
+    with parallel_col2:
+        section_workers = st.number_input("并行模块数", min_value=1, max_value=8, value=4, key="section_workers",
+                                          disabled=not process_by_section)
     
     if uploaded_file and st.session_state.generation_step == 0:
         if st.button("开始生成流程", key="start_generation"):
@@ -125,6 +169,9 @@ if page == "生成测试用例":
                 file_path = save_uploaded_file(uploaded_file)
                 st.info(f"文件已保存到: {file_path}")
                 st.session_state.doc_text = st.session_state.document_processor.read_file(file_path)
+                st.session_state.doc_sections = (
+                    st.session_state.document_processor.read_sections(file_path) if process_by_section else []
+                )
                 st.session_state.file_path = file_path
                 st.session_state.original_filename = uploaded_file.name
                 st.session_state.generation_step = 1
@@ -136,6 +183,32 @@ if page == "生成测试用例":
     if st.session_state.generation_step >= 1:
         st.header("第一步：需求文档分析")
         
+        if st.session_state.current_summary == "" and len(st.session_state.doc_sections) > 1:
+            sections = st.session_state.doc_sections
+            st.info(f"文档已按标题拆分为 {len(sections)} 个模块：" + "、".join(section["title"] for section in sections))
+            section_progress = st.progress(0.0, text="正在按模块并行生成...")
+            
+            def on_section_done(done, total, result):
+                status = "失败" if result.get("error") else "完成"
+                section_progress.progress(done / total, text=f"{result['title']} {status}（{done}/{total}）")
+            
+            try:
+                section_result = st.session_state.ai_client.process_sections_parallel(
+                    sections, max_workers=int(section_workers), progress_callback=on_section_done
+                )
+            except Exception as section_error:
+                st.error(f"按模块处理失败: {str(section_error)}")
+                st.stop()
+            # 合并结果直接填入三个步骤，仍可逐步编辑；重新生成时按整篇文档处理
+            st.session_state.current_summary = section_result["summary"]
+            st.session_state.current_requirement_analysis = section_result["test_points"]
+            st.session_state.current_analysis_report = section_result["analysis_report"]
+            st.session_state.current_test_cases = section_result["test_cases"]
+            st.session_state.current_test_validation = section_result["test_validation"]
+            st.session_state.doc_sections = []
+            st.session_state.generation_step = 3
+            st.rerun()
+        
         if st.session_state.current_summary == "":
             with st.spinner("正在进行全面的需求文档分析..."):
                 try:
@@ -326,7 +399,7 @@ if page == "生成测试用例":
         if st.button("重新开始新流程", type="secondary", key="reset_workflow"):
             for key in ['generation_step', 'doc_text', 'current_summary', 'current_requirement_analysis', 
                        'current_analysis_report', 'current_test_cases', 'current_test_validation', 
-                       'file_path', 'original_filename']:
+                       'file_path', 'original_filename', 'doc_sections']:
                 if key in st.session_state:
                     del st.session_state[key]
             st.success("流程已重置，可以开始新的生成了！")
@@ -424,8 +497,109 @@ elif page == "历史记录":
 
 # 知识库管理和知识库内容页面保持不变
 elif page == "知识库管理":
-    # ... (知识库管理页面代码保持不变，使用之前完整的代码)
-    pass
+    st.title("知识库管理")
+    ingest_queue = get_ingest_queue()
+    kb_shards = st.session_state.kb
+    
+    # 选择或新建分区（产品线），上传和维护只影响所选分区的索引
+    namespace_col1, namespace_col2 = st.columns([2, 2])
+    with namespace_col1:
+        namespace = st.selectbox("知识库分区", kb_shards.namespaces(), key="kb_namespace")
+    with namespace_col2:
+        new_namespace = st.text_input("新建分区", key="kb_new_namespace", placeholder="输入产品线名称")
+        if new_namespace and st.button("创建分区", key="create_namespace"):
+            try:
+                kb_shards.create_namespace(new_namespace.strip())
+                st.success(f"已创建分区: {new_namespace.strip()}")
+                st.rerun()
+            except ValueError as namespace_error:
+                st.error(str(namespace_error))
+    kb = kb_shards.get(namespace)
+    
+    # 上传后只登记入库任务，解析和嵌入在后台完成，页面不会卡住
+    kb_uploads = st.file_uploader(
+        "上传知识库文件",
+        type=[ext.lstrip('.') for ext in KnowledgeBase.SUPPORTED_EXTENSIONS],
+        accept_multiple_files=True,
+        key="kb_uploader"
+    )
+    if kb_uploads and st.button("提交入库", type="primary", key="submit_ingest"):
+        for kb_upload in kb_uploads:
+            try:
+                kb_file_path = save_uploaded_file(kb_upload, upload_dir=kb.KB_FILES_DIR)
+                job_id = ingest_queue.submit(kb_file_path, kb_upload.name, namespace=namespace)
+                st.success(f"已提交入库任务 #{job_id}: {kb_upload.name}")
+            except Exception as upload_error:
+                st.error(f"提交 {kb_upload.name} 失败: {str(upload_error)}")
+    
+    # 入库任务状态
+    st.subheader("入库任务")
+    col1, col2 = st.columns([1, 5])
+    with col1:
+        if st.button("刷新状态", key="refresh_jobs"):
+            st.rerun()
+    
+    jobs = ingest_queue.list_jobs(limit=50)
+    if not jobs:
+        st.info("暂无入库任务")
+    for job in jobs:
+        job_col1, job_col2, job_col3 = st.columns([3, 3, 1])
+        with job_col1:
+            st.write(f"**#{job['id']} {job['filename']}**（{job.get('namespace') or DEFAULT_NAMESPACE}）")
+            st.caption(f"提交时间: {job['created_at']}，尝试次数: {job['attempts']}/{job['max_attempts']}")
+        with job_col2:
+            st.write(f"{STATUS_LABELS.get(job['status'], job['status'])} - {job['message'] or ''}")
+            if job['error'] and job['status'] != 'succeeded':
+                st.caption(f"错误: {job['error']}")
+        with job_col3:
+            if job['status'] not in FINISHED_STATUSES:
+                if st.button("取消", key=f"cancel_job_{job['id']}"):
+                    ingest_queue.cancel(job['id'])
+                    st.rerun()
+            elif job['status'] != 'succeeded':
+                if st.button("重试", key=f"retry_job_{job['id']}"):
+                    ingest_queue.retry(job['id'])
+                    st.rerun()
+    
+    if ingest_queue.has_active_jobs():
+        st.caption("有任务正在处理，完成后即可在搜索中使用新内容")
+    
+    # 索引状态与维护
+    st.subheader(f"索引状态（{namespace}）")
+    index_status = kb.get_index_status()
+    st.write(f"文档块数量: {index_status.get('document_count', 0)}，"
+             f"文件数量: {index_status.get('file_count', 0)}，"
+             f"索引版本: {index_status.get('index_version') or '无'}")
+    db_stats = st.session_state.db.get_pool_stats()
+    st.caption(f"数据库连接: {db_stats['connections']}，日志模式: {db_stats['journal_mode']}，"
+               f"锁等待 {db_stats['lock_waits']} 次（共 {db_stats['lock_wait_seconds']} 秒），"
+               f"重试后仍失败 {db_stats['lock_failures']} 次")
+    # 直接放入文件目录或从目录删除的文件由监视线程定期同步，也可以立即扫描
+    kb_watcher = get_kb_watcher()
+    maintain_col1, maintain_col2 = st.columns([1, 1])
+    with maintain_col1:
+        if st.button("扫描文件目录", key="sync_files"):
+            with st.spinner("正在同步文件目录..."):
+                sync_result = kb_shards.sync_files(namespace, settle_seconds=0,
+                                                   skip_files=ingest_queue.unfinished_files(namespace))
+            if sync_result.get("error"):
+                st.error(f"同步失败: {sync_result['error']}")
+            elif sync_result["added"] or sync_result["changed"] or sync_result["removed"] or sync_result["failed"]:
+                st.success(f"同步完成：新增 {len(sync_result['added'])}，修改 {len(sync_result['changed'])}，"
+                           f"删除 {len(sync_result['removed'])}，写入 {sync_result['chunks']} 个文档块")
+                for failed_name, failed_error in sync_result["failed"].items():
+                    st.warning(f"{failed_name} 处理失败: {failed_error}")
+            else:
+                st.info("文件目录没有变化")
+    with maintain_col2:
+        if st.button("重建索引", key="rebuild_index"):
+            with st.spinner("正在重建知识库索引..."):
+                if kb.rebuild_index():
+                    st.success("知识库索引重建完成")
+                else:
+                    st.error("重建索引失败")
+    if kb_watcher.last_scan_at:
+        st.caption(f"目录上次自动扫描: {time.strftime('%H:%M:%S', time.localtime(kb_watcher.last_scan_at))}")
 
 elif page == "知识库内容":
     # ... (知识库内容页面代码保持不变，使用之前完整的代码)
@@ -1,10 +1,13 @@
 import openai
-from typing import List, Dict, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Dict, Tuple, Optional
 import re
+import time
 import traceback
 import datetime
 import jieba  # 需要安装: pip install jieba
 import os
+from .testcase_generator import merge_module_tables
 
 class AIClient:
     def __init__(self, model_name="deepseek-coder-v2", base_url="http://localhost:11434/v1", knowledge_base=None):
@@ -283,18 +286,8 @@ class AIClient:
                 question = self._build_question_for_test_point(test_point)
                 
                 # 搜索知识库获取相关信息
-                knowledge_results = []
-                if self.knowledge_base:
-                    try:
-                        # 搜索相关知识
-                        search_results = self.knowledge_base.search_with_score(question, k=3)
-                        for content, metadata, score in search_results:
-                            similarity = self.knowledge_base.get_similarity_percentage(score)
-                            if similarity > 30:  # 相似度阈值
-                                metadata['similarity'] = similarity
-                                knowledge_results.append((content, metadata))
-                    except Exception as e:
-                        print(f"知识库搜索失败: {str(e)}")
+                # 搜索相关知识，相似度阈值在索引内完成过滤
+                knowledge_results = self.select_knowledge_references(question, k=3, min_similarity=0.3)
                 
                 # 记录增强信息
                 test_point['question'] = question
@@ -541,6 +534,82 @@ class AIClient:
         # 调用新版本的方法，忽略decision_table参数
         return self.generate_test_cases_from_test_points(test_points)
     
+    # 按模块并行处理
+    def process_sections_parallel(self, sections: List[Dict], max_workers: int = 4,
+                                  progress_callback: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+        """
+        各模块独立完成三个步骤（需求分析 -> 测试点 -> 测试用例），模块之间并行，完成后合并
+        
+        Args:
+            sections: DocumentProcessor.read_sections 的结果 [{"title", "text"}]
+            max_workers: 同时处理的模块数
+            progress_callback: 每完成一个模块调用一次 (已完成数, 总数, 该模块的结果)
+            
+        Returns:
+            {"summary", "test_points", "analysis_report", "test_cases", "test_validation": 合并后的文本,
+             "sections": [各模块结果，含 title、seconds 和出错时的 error]}
+        """
+        results = [None] * len(sections)
+        completed = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sections) or 1)),
+                                thread_name_prefix="section") as executor:
+            futures = {executor.submit(self._process_section, section): i for i, section in enumerate(sections)}
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                completed += 1
+                print(f"模块处理完成 ({completed}/{len(sections)}): {results[i]['title']}，"
+                      f"耗时 {results[i]['seconds']:.1f} 秒")
+                if progress_callback:
+                    progress_callback(completed, len(sections), results[i])
+        return self._merge_section_results(results)
+    
+    def _process_section(self, section: Dict) -> Dict:
+        """单个模块依次执行三个步骤，出错时记录错误，不影响其他模块"""
+        start_time = time.time()
+        result = {"title": section["title"], "summary": "", "test_points": "", "analysis_report": "",
+                  "test_cases": "", "test_validation": ""}
+        try:
+            result["summary"] = self.enhanced_generate_summary_step(section["text"])
+            result["test_points"], result["analysis_report"] = self.enhanced_generate_test_points_step(result["summary"])
+            result["test_cases"], result["test_validation"] = self.generate_test_cases_from_test_points(result["test_points"])
+        except Exception as e:
+            print(f"模块 {section['title']} 处理失败: {str(e)}")
+            traceback.print_exc()
+            result["error"] = str(e)
+        result["seconds"] = time.time() - start_time
+        return result
+    
+    @staticmethod
+    def _merge_section_results(results: List[Dict]) -> Dict:
+        """
+        按模块顺序合并各步骤的结果，测试用例ID在全文中重新连续编号
+
+        各模块的测试用例表合并为一张表（一行表头，模块名放在所属模块列），可直接生成Excel。
+        """
+        merged = {"sections": results}
+        for key in ("summary", "test_points", "analysis_report", "test_validation"):
+            merged[key] = "\n\n".join(
+                f"# 模块：{result['title']}\n\n" + (result[key] or f"（处理失败：{result.get('error', '无结果')}）")
+                for result in results
+            )
+        
+        next_id = 1
+        modules = []
+        for result in results:
+            mapping = {}
+            
+            def renumber(match):
+                if match.group(0) not in mapping:
+                    mapping[match.group(0)] = f"TC_{next_id + len(mapping):03d}"
+                return mapping[match.group(0)]
+            
+            test_cases = result["test_cases"] or f"（处理失败：{result.get('error', '无结果')}）"
+            modules.append((result["title"], re.sub(r'TC_\d+', renumber, test_cases)))
+            next_id += len(mapping)
+        merged["test_cases"] = merge_module_tables(modules)
+        return merged
+    
     # 知识库相关方法
     def _enhanced_knowledge_search(self, decision_table: str, test_points: str) -> str:
         """增强的知识库搜索，专门针对测试设计"""
@@ -617,17 +686,55 @@ class AIClient:
         
         return list(set(keywords))
     
-    def answer_with_knowledge(self, question: str, context_texts: List[str]) -> str:
+    def select_knowledge_references(self, question: str, k: int = 5, min_similarity: float = 0.3,
+                                    metadata_filter: Optional[Dict] = None) -> List[Tuple[str, Dict]]:
+        """
+        为问题挑选知识库参考内容
+        
+        Args:
+            question: 用户问题
+            k: 最多返回的参考数量
+            min_similarity: 相似度阈值(0-1)
+            metadata_filter: 元数据过滤条件，如 {"source": "用例库.xlsx", "type": "excel_data"}，
+                只在满足条件的文档块中检索，仍然返回完整的前k个
+            
+        Returns:
+            [(内容, 元数据)]，元数据中的 similarity 为相似度百分比
+        """
+        if not self.knowledge_base:
+            return []
+        references = []
+        try:
+            search_results = self.knowledge_base.search_by_threshold(
+                question, min_similarity=min_similarity, k=k, metadata_filter=metadata_filter
+            )
+            for content, metadata, similarity in search_results:
+                metadata['similarity'] = round(similarity * 100, 2)
+                references.append((content, metadata))
+        except Exception as e:
+            print(f"知识库搜索失败: {str(e)}")
+        return references
+    
+    def answer_with_knowledge(self, question: str, context_texts: Optional[List[str]] = None,
+                              metadata_filter: Optional[Dict] = None, k: int = 5) -> str:
         """
         基于选定的知识库内容回答问题
         
         Args:
             question: 用户问题
-            context_texts: 选定的相关知识文本列表
+            context_texts: 选定的相关知识文本列表；为None时按 metadata_filter 从知识库中挑选
+            metadata_filter: 自动挑选参考内容时的元数据过滤条件（来源文件、工作表、文档块类型等）
+            k: 自动挑选的参考数量
             
         Returns:
             AI生成的答案
         """
+        if context_texts is None:
+            context_texts = [
+                f"来源: {metadata.get('source', '未知来源')}\n{content}"
+                for content, metadata in self.select_knowledge_references(question, k=k, metadata_filter=metadata_filter)
+            ]
+        
         # 构建系统提示
         system_content = """你是一位专业的测试架构师和知识库分析师。请基于用户选定的知识库内容，回答问题并给出专业建议。
 
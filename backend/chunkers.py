@@ -0,0 +1,285 @@
+# backend/chunkers.py
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# 句末标点：中文句号、感叹号、问号（含英文形式）和分号，英文句号只在单词后断句，不拆开"1. "这类编号
+_SENTENCE_END = re.compile(r'(?<=[。！？!?；;])|(?<=[A-Za-z]\.)(?=\s)')
+_BLANK_LINES = re.compile(r'\n\s*\n')
+
+# 标题：Markdown标题、第X章/节/条、数字编号（1. / 1.1 / 1.1.1）、中文编号（一、 / （一））
+_HEADING_PATTERN = re.compile(
+    r'^\s*(?:'
+    r'#{1,6}\s+\S.*'
+    r'|第[一二三四五六七八九十百零\d]+[章节条部分篇]\s*.*'
+    r'|\d+(?:\.\d+){0,3}[\.、]?\s+\S.{0,40}'
+    r'|[一二三四五六七八九十]+、\s*\S.{0,40}'
+    r'|[（(][一二三四五六七八九十]+[）)]\s*\S.{0,40}'
+    r')$'
+)
+
+# 近似BERT分词：每个汉字一个token，连续的字母/数字算一个词，其他符号各算一个
+_TOKEN_PATTERN = re.compile(r'[一-龥]|[A-Za-z]+|\d+|[^\sA-Za-z\d一-龥]')
+
+Chunk = Tuple[str, Dict]
+
+
+def split_sentences(text: str) -> List[str]:
+    """按中文句末标点和换行断句，保留标点；每行最后一句带换行符，合并时保留原有分行"""
+    sentences = []
+    for line in text.split("\n"):
+        parts = [part.strip() for part in _SENTENCE_END.split(line) if part and part.strip()]
+        if parts:
+            parts[-1] += "\n"
+            sentences.extend(parts)
+    return sentences
+
+
+def approximate_token_count(text: str) -> int:
+    """与中文BERT分词数量接近的快速估计"""
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def _join(units: List[str], joiner: str) -> str:
+    """拼接句子，英文句子之间补回断句时去掉的空格"""
+    if joiner:
+        return joiner.join(units).strip()
+    text = units[0]
+    for unit in units[1:]:
+        if text[-1:] in ".!?;" and unit[:1].isascii():
+            text += " "
+        text += unit
+    return text.strip()
+
+
+def _pack(units: List[str], size: int, overlap: int, length: Callable[[str], int],
+          joiner: str = "") -> List[str]:
+    """
+    把句子等单元顺序合并成不超过 size 的块
+
+    相邻块之间重叠末尾若干个完整单元（总长不超过 overlap）；
+    单个单元超过 size 时按长度硬切。
+    """
+    chunks = []
+    current: List[str] = []
+    current_length = 0
+
+    for unit in units:
+        unit_length = length(unit)
+        if unit_length > size:
+            if current:
+                chunks.append(_join(current, joiner))
+                current, current_length = [], 0
+            chunks.extend(_hard_split(unit, size, length))
+            continue
+
+        if current and current_length + unit_length > size:
+            chunks.append(_join(current, joiner))
+            # 保留末尾的完整单元作为下一块的开头
+            carried: List[str] = []
+            carried_length = 0
+            for previous in reversed(current):
+                previous_length = length(previous)
+                if carried_length + previous_length > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_length += previous_length
+            if carried_length + unit_length > size:
+                carried, carried_length = [], 0
+            current, current_length = carried, carried_length
+
+        current.append(unit)
+        current_length += unit_length
+
+    if current:
+        chunks.append(_join(current, joiner))
+    return chunks
+
+
+def _hard_split(text: str, size: int, length: Callable[[str], int]) -> List[str]:
+    """超长句子按长度切开，长度函数为token计数时按token边界切分"""
+    if length is len:
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    pieces, current, count = [], [], 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        if count >= size:
+            pieces.append(text[current[0]:match.start()])
+            current, count = [], 0
+        if not current:
+            current.append(match.start())
+        count += 1
+    if current:
+        pieces.append(text[current[0]:])
+    return pieces
+
+
+class RecursiveChunker:
+    """原有的递归字符切分（按段落、换行、空格逐级切分）"""
+
+    name = "recursive"
+
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len
+        )
+
+    def split(self, text: str) -> List[Chunk]:
+        return [(chunk, {}) for chunk in self._splitter.split_text(text)]
+
+
+class SentenceChunker:
+    """按 。！？ 等句末标点断句，再把完整句子合并到 chunk_size 字以内，不会把句子切断"""
+
+    name = "sentence"
+
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def split(self, text: str) -> List[Chunk]:
+        chunks = []
+        # 空行分隔的段落之间不合并重叠内容
+        for paragraph in _BLANK_LINES.split(text):
+            sentences = split_sentences(paragraph)
+            if sentences:
+                chunks.extend(_pack(sentences, self.chunk_size, self.chunk_overlap, len))
+        # 段落很短时把相邻段落合并，避免产生大量碎块
+        return [(chunk, {}) for chunk in _pack(chunks, self.chunk_size, 0, len, joiner="\n")]
+
+
+class HeadingChunker:
+    """
+    按标题切分章节，章节内再按句子合并
+
+    每个文档块以所属章节的标题路径开头，并记录在元数据 section 中，
+    需求文档中"1.2 登录"这类短章节检索时能带上上下文。
+    """
+
+    name = "heading"
+
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._sentence_chunker = SentenceChunker(chunk_size, chunk_overlap)
+
+    @staticmethod
+    def _is_heading(line: str) -> bool:
+        """标题行较短且不以句末标点结尾，避免把编号的步骤说明当成标题"""
+        stripped = line.strip()
+        return (0 < len(stripped) <= 60 and stripped[-1] not in "。；;，,：:！？!?"
+                and bool(_HEADING_PATTERN.match(line)))
+
+    @staticmethod
+    def _heading_level(line: str) -> int:
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            return len(stripped) - len(stripped.lstrip("#"))
+        if re.match(r'第.+?[章部分篇]', stripped):
+            return 1
+        if re.match(r'第.+?[节]', stripped):
+            return 2
+        match = re.match(r'(\d+(?:\.\d+)*)', stripped)
+        if match:
+            return match.group(1).count(".") + 1
+        if re.match(r'[一二三四五六七八九十]+、', stripped):
+            return 2
+        return 3
+
+    def _sections(self, text: str) -> List[Tuple[List[str], str]]:
+        """返回 [(标题路径, 章节正文)]"""
+        return [(section["path"], section["text"]) for section in split_heading_sections(text)]
+
+    def split(self, text: str) -> List[Chunk]:
+        chunks = []
+        for headings, body in self._sections(text):
+            section = " > ".join(headings)
+            prefix = f"{section}\n" if section else ""
+            budget = max(self.chunk_size - len(prefix), self.chunk_size // 2)
+            chunker = SentenceChunker(budget, self.chunk_overlap) if budget != self.chunk_size else self._sentence_chunker
+            for chunk, _ in chunker.split(body):
+                chunks.append((prefix + chunk, {"section": section} if section else {}))
+        return chunks
+
+
+def split_heading_sections(text: str) -> List[Dict]:
+    """
+    按标题行划分章节，标题识别规则同 HeadingChunker
+
+    Returns:
+        [{"title": 标题, "level": 级别, "path": [上级标题..., 标题], "text": 章节正文}]，
+        只包含正文不为空的章节，第一个标题之前的内容作为标题为空的章节
+    """
+    sections = []
+    path: List[Tuple[int, str]] = []
+    body: List[str] = []
+
+    def flush():
+        if any(line.strip() for line in body):
+            sections.append({
+                "title": path[-1][1] if path else "",
+                "level": path[-1][0] if path else 0,
+                "path": [title for _, title in path],
+                "text": "\n".join(body),
+            })
+
+    for line in text.split("\n"):
+        if HeadingChunker._is_heading(line):
+            flush()
+            body = []
+            level = HeadingChunker._heading_level(line)
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, line.strip().lstrip("#").strip()))
+        else:
+            body.append(line)
+    flush()
+    return sections
+
+
+class TokenChunker:
+    """
+    按token数量合并完整句子
+
+    text2vec 等BERT模型只编码前 max_seq_length 个token，超出部分被截断，
+    按字符切分的块可能有一半内容没有进入向量。按token长度切分可以让每块都被完整编码。
+    tokenizer 可传入模型分词器的 tokenize 方法，默认使用近似估计。
+    """
+
+    name = "token"
+
+    def __init__(self, max_tokens: int = 256, overlap_tokens: int = 32,
+                 tokenizer: Optional[Callable[[str], List[str]]] = None):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self._length = (lambda text: len(tokenizer(text))) if tokenizer else approximate_token_count
+
+    def split(self, text: str) -> List[Chunk]:
+        chunks = []
+        for paragraph in _BLANK_LINES.split(text):
+            sentences = split_sentences(paragraph)
+            if sentences:
+                chunks.extend(_pack(sentences, self.max_tokens, self.overlap_tokens, self._length))
+        return [(chunk, {"tokens": self._length(chunk)})
+                for chunk in _pack(chunks, self.max_tokens, 0, self._length, joiner="\n")]
+
+
+CHUNKERS = {
+    RecursiveChunker.name: RecursiveChunker,
+    SentenceChunker.name: SentenceChunker,
+    HeadingChunker.name: HeadingChunker,
+    TokenChunker.name: TokenChunker,
+}
+
+
+def get_chunker(chunker="recursive", **kwargs):
+    """按名称创建切分器，传入切分器实例时原样返回"""
+    if not isinstance(chunker, str):
+        return chunker
+    if chunker not in CHUNKERS:
+        raise ValueError(f"不支持的切分方式: {chunker}，可选: {', '.join(CHUNKERS)}")
+    return CHUNKERS[chunker](**kwargs)
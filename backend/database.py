@@ -1,44 +1,224 @@
 # backend/database.py
-import sqlite3
 import os
-import threading
 import traceback
 from pathlib import Path
 from typing import List
 from typing import List, Tuple, Dict, Union
-thread_local = threading.local()
+
+from .sqlite_pool import get_connection_manager
+
+# 测试用例生成记录表，由 add_record / get_records 读写
+RECORDS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        original_filename TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        output_filename TEXT,
+        output_path TEXT,
+        summary TEXT,
+        requirement_analysis TEXT,
+        decision_table TEXT,
+        test_cases TEXT,
+        test_validation TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+# 知识库文件表
+KNOWLEDGE_FILES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS knowledge_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        file_path TEXT NOT NULL UNIQUE,
+        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+# 知识库文档块表，由 SQLiteDocstore 按向量ID（docstore_id）读写
+VECTOR_DOCUMENTS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS vector_documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        docstore_id TEXT NOT NULL UNIQUE,
+        namespace TEXT NOT NULL DEFAULT 'default',
+        build_id TEXT,
+        file_id INTEGER,
+        source TEXT,
+        content TEXT NOT NULL,
+        metadata TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_vector_documents_namespace_build
+        ON vector_documents (namespace, build_id);
+    CREATE INDEX IF NOT EXISTS idx_vector_documents_source ON vector_documents (source);
+'''
+
+# 知识库后台入库任务表，由 IngestQueue 读写
+INGEST_JOBS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS ingest_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        namespace TEXT NOT NULL DEFAULT 'default',
+        status TEXT NOT NULL DEFAULT 'pending',
+        progress INTEGER NOT NULL DEFAULT 0,
+        message TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        available_at REAL NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        updated_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status, available_at);
+'''
+
+# 列表排序和关联查询使用的索引
+LISTING_INDEXES_SCHEMA = '''
+    CREATE INDEX IF NOT EXISTS idx_records_created_at ON records (created_at);
+    CREATE INDEX IF NOT EXISTS idx_knowledge_files_uploaded_at ON knowledge_files (uploaded_at);
+    CREATE INDEX IF NOT EXISTS idx_knowledge_files_filename ON knowledge_files (filename);
+    CREATE INDEX IF NOT EXISTS idx_vector_documents_file_id ON vector_documents (file_id);
+'''
+
+
+def _execute_schema(conn, schema: str):
+    """逐条执行建表语句（executescript 会先提交当前事务，迁移需要在同一事务中完成）"""
+    for statement in schema.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _table_columns(conn, table: str) -> List[str]:
+    """表的列名，表不存在时返回空列表"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _add_missing_columns(conn, table: str, columns: List[Tuple[str, str]]):
+    """为早期创建的表补上缺少的列"""
+    existing = set(_table_columns(conn, table))
+    for name, declaration in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+
+
+def _migrate_vector_documents(conn):
+    """
+    创建文档块表；早期版本的表 (id, file_id, content, metadata) 没有向量ID和分区列，
+    改名后按新结构重建并复制原有的行（归入 legacy 构建，不被任何索引版本引用，重建索引时清理）
+    """
+    columns = _table_columns(conn, "vector_documents")
+    if columns and "docstore_id" not in columns:
+        conn.execute("ALTER TABLE vector_documents RENAME TO vector_documents_legacy")
+        _execute_schema(conn, VECTOR_DOCUMENTS_SCHEMA)
+        conn.execute('''
+            INSERT INTO vector_documents (docstore_id, namespace, build_id, file_id, source, content, metadata)
+            SELECT 'legacy-' || vd.id, 'default', 'legacy', vd.file_id, kf.filename, vd.content, vd.metadata
+            FROM vector_documents_legacy vd LEFT JOIN knowledge_files kf ON vd.file_id = kf.id
+            ORDER BY vd.id
+        ''')
+        conn.execute("DROP TABLE vector_documents_legacy")
+        print("已将旧结构的文档块表迁移到新结构")
+    else:
+        _execute_schema(conn, VECTOR_DOCUMENTS_SCHEMA)
+
+
+def _migrate_base_tables(conn):
+    _execute_schema(conn, RECORDS_SCHEMA + KNOWLEDGE_FILES_SCHEMA + INGEST_JOBS_SCHEMA)
+    # 早期的记录表没有新流程的字段，早期的任务表没有分区列
+    _add_missing_columns(conn, "records", [
+        (name, "TEXT") for name in ("output_filename", "output_path", "summary", "requirement_analysis",
+                                    "decision_table", "test_cases", "test_validation")
+    ])
+    _add_missing_columns(conn, "ingest_jobs", [("namespace", "TEXT NOT NULL DEFAULT 'default'")])
+
+
+def _migrate_listing_indexes(conn):
+    _execute_schema(conn, LISTING_INDEXES_SCHEMA)
+    conn.execute("ANALYZE")
+
+
+def _migrate_retired_chunks(conn):
+    # 增量更新中被移除或替换的文档块记录退役时的索引版本，旧版本目录清理后才删除
+    _add_missing_columns(conn, "vector_documents", [("retired_version", "TEXT")])
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_vector_documents_retired ON vector_documents (namespace, retired_version)"
+    )
+
+
+def _migrate_ingest_job_results(conn):
+    # 任务记录领取它的进程（主机:进程号:启动标识）和本次入库的统计（JSON）
+    _execute_schema(conn, INGEST_JOBS_SCHEMA)
+    _add_missing_columns(conn, "ingest_jobs", [("owner", "TEXT"), ("stats", "TEXT")])
+
+
+# 数据库结构迁移 (版本号, 说明, 迁移函数)，当前版本记录在 PRAGMA user_version 中；
+# 已发布的迁移不再修改，结构变化时在末尾追加新版本
+SCHEMA_MIGRATIONS = [
+    (1, "创建记录、知识库文件和入库任务表", _migrate_base_tables),
+    (2, "创建文档块表，旧结构的表按新结构重建", _migrate_vector_documents),
+    (3, "为记录和知识库文件的排序及文档块关联添加索引", _migrate_listing_indexes),
+    (4, "记录文档块退役的索引版本", _migrate_retired_chunks),
+    (5, "记录入库任务的执行进程和入库统计", _migrate_ingest_job_results),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def migrate_schema(db_path) -> int:
+    """
+    把数据库升级到最新结构，返回升级后的版本号
+
+    在一个写事务（BEGIN IMMEDIATE）中依次执行未完成的迁移并更新 user_version，
+    多个进程同时启动时只有一个执行迁移，其他进程在获得锁后看到已是最新版本。
+    """
+    manager = get_connection_manager(db_path)
+    thread_conn = manager.connection()
+    version = thread_conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        if version > SCHEMA_VERSION:
+            print(f"数据库结构版本 {version} 高于程序支持的版本 {SCHEMA_VERSION}，请升级程序: {db_path}")
+        return version
+    if thread_conn.in_transaction:
+        # 本线程持有未提交的事务时迁移连接拿不到写锁，也不能替调用方提交
+        raise RuntimeError(f"当前线程的数据库连接有未完成的事务，无法升级数据库结构: {db_path}")
+    # 迁移使用独立的连接，不提交也不回滚调用方在线程连接上的事务
+    with manager.dedicated_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for target, description, migrate in SCHEMA_MIGRATIONS:
+                if target > version:
+                    migrate(conn)
+                    print(f"数据库结构已升级到版本 {target}: {description}")
+            version = max(version, SCHEMA_VERSION)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return version
+
 
 class Database:
     def __init__(self, db_path="E:/sm-ai/data/testcase.db"):
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # 按数据库文件共享的连接（每个线程一个，WAL模式，锁等待超时后重试）
+        self._pool = get_connection_manager(self.db_path)
         self._create_tables()
     
     def _get_connection(self):
-        if not hasattr(thread_local, "connection"):
-            thread_local.connection = sqlite3.connect(self.db_path)
-            thread_local.connection.row_factory = sqlite3.Row
-        return thread_local.connection
+        return self._pool.connection()
+
+    def get_pool_stats(self) -> Dict:
+        """本数据库文件的连接数和锁等待统计"""
+        return self._pool.stats()
     
     def _create_tables(self):
-        """创建或更新数据库表结构"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        # 创建记录表（如果不存在）
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS knowledge_files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                filename TEXT NOT NULL,
-                file_path TEXT NOT NULL UNIQUE,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        
-        
-        # 定义要添加的列
-        
+        """创建或升级数据库表结构（见 SCHEMA_MIGRATIONS）"""
+        self.schema_version = migrate_schema(self.db_path)
     
     def add_record(self, original_filename, file_path, output_filename, output_path, 
                    summary=None, requirement_analysis=None, decision_table=None, 
@@ -88,6 +268,11 @@ class Database:
                 INSERT INTO knowledge_files (filename, file_path)
                 VALUES (?, ?)
             ''', (filename, file_path))
+            # 先入库的文档块补上文件关联
+            cursor.execute(
+                "UPDATE vector_documents SET file_id = ? WHERE source = ? AND file_id IS NULL",
+                (cursor.lastrowid, filename)
+            )
             conn.commit()
             print(f"成功添加知识文件记录: {filename} -> {file_path}")
             return True
@@ -187,18 +372,6 @@ class Database:
         
         
 
-    def get_vector_documents(self) -> List[Dict]:
-        """获取所有向量文档及关联文件信息"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT vd.id, vd.content, vd.metadata, 
-                kf.filename, kf.file_path, kf.uploaded_at
-            FROM vector_documents vd
-            JOIN knowledge_files kf ON vd.file_id = kf.id
-            ORDER BY kf.uploaded_at DESC
-        ''')
-        return [dict(row) for row in cursor.fetchall()]
     # 在Database类中添加删除方法
     def delete_knowledge_file(self, file_id: int):
         """删除知识库文件记录"""
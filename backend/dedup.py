@@ -0,0 +1,127 @@
+# backend/dedup.py
+import hashlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+FINGERPRINT_BITS = 64
+BANDS = 8  # 64位指纹分成8段，海明距离不超过7时至少有一段完全相同
+
+
+def normalize_text(text: str) -> str:
+    """去掉空白并统一小写，排版差异不影响判重"""
+    return "".join(text.split()).lower()
+
+
+def shingles(text: str, size: int = 3) -> Set[str]:
+    """字符n-gram集合，文本短于n时整体作为一个元素"""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def content_digest(text: str) -> str:
+    """规范化文本的摘要，用于完全重复判断"""
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def simhash(grams: Iterable[str]) -> int:
+    """64位SimHash，对每个n-gram取稳定哈希后按位投票"""
+    grams = list(grams)
+    if not grams:
+        return 0
+    digests = b"".join(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest() for gram in grams)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(grams), FINGERPRINT_BITS)
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(grams)
+    return int.from_bytes(np.packbits((votes > 0).astype(np.uint8)).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    """
+    近似重复文档块索引
+
+    保存每个文档块的内容摘要和SimHash指纹：摘要相同为完全重复；
+    指纹按段建立倒排，海明距离不超过 max_distance 的文档块作为近似重复的候选，
+    候选再由调用方用n-gram Jaccard相似度确认，避免只差几个字的不同内容被合并。
+    每个文档块只占两个整数/字符串，随索引版本一起保存。
+    """
+
+    def __init__(self, max_distance: int = 6):
+        self.max_distance = min(max_distance, BANDS - 1)
+        self.digests: Dict[str, str] = {}  # 内容摘要 -> 文档ID
+        self.fingerprints: Dict[str, int] = {}  # 文档ID -> 指纹
+        self.bands: List[Dict[int, List[str]]] = [defaultdict(list) for _ in range(BANDS)]
+
+    def __len__(self):
+        return len(self.digests)
+
+    @staticmethod
+    def _band_keys(fingerprint: int) -> List[int]:
+        width = FINGERPRINT_BITS // BANDS
+        mask = (1 << width) - 1
+        return [(fingerprint >> (i * width)) & mask for i in range(BANDS)]
+
+    def add(self, doc_id: str, digest: str, fingerprint: Optional[int]):
+        """登记文档块；fingerprint 为None时只参与完全重复判断"""
+        self.digests.setdefault(digest, doc_id)
+        if fingerprint is None:
+            return
+        self.fingerprints[doc_id] = fingerprint
+        for band, key in zip(self.bands, self._band_keys(fingerprint)):
+            band[key].append(doc_id)
+
+    def find_exact(self, digest: str) -> Optional[str]:
+        return self.digests.get(digest)
+
+    def candidates(self, fingerprint: int) -> List[Tuple[str, int]]:
+        """返回海明距离在阈值内的 (文档ID, 距离)，按距离从小到大排列"""
+        seen = set()
+        results = []
+        for band, key in zip(self.bands, self._band_keys(fingerprint)):
+            for doc_id in band.get(key, ()):
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                distance = hamming_distance(fingerprint, self.fingerprints[doc_id])
+                if distance <= self.max_distance:
+                    results.append((doc_id, distance))
+        return sorted(results, key=lambda item: item[1])
+
+    def remove(self, doc_id: str):
+        self.remove_many([doc_id])
+
+    def remove_many(self, doc_ids: Iterable[str]):
+        """删除多个文档块，摘要表只扫描一次"""
+        doc_ids = set(doc_ids)
+        for doc_id in doc_ids:
+            fingerprint = self.fingerprints.pop(doc_id, None)
+            if fingerprint is None:
+                continue
+            for band, key in zip(self.bands, self._band_keys(fingerprint)):
+                ids = band.get(key)
+                if ids and doc_id in ids:
+                    ids.remove(doc_id)
+                    if not ids:
+                        del band[key]
+        for digest in [d for d, i in self.digests.items() if i in doc_ids]:
+            del self.digests[digest]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["bands"] = [dict(band) for band in self.bands]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.bands = [defaultdict(list, band) for band in state["bands"]]
@@ -0,0 +1,240 @@
+# backend/docstore.py
+import json
+import sqlite3
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+from .database import migrate_schema
+from .sqlite_pool import get_connection_manager
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    保存在SQLite中的文档块存储，替代整体pickle的InMemoryDocstore
+
+    文档块按向量ID（docstore_id）存放在 vector_documents 表中，搜索时只读取
+    命中的top-k行。pickle时只保存命名空间和构建号，不包含任何文档内容，
+    加载后需要调用 bind() 指定数据库路径。
+    """
+
+    def __init__(self, db_path: Optional[str] = None, namespace: str = "default",
+                 build_id: Optional[str] = None):
+        self.namespace = namespace
+        self.build_id = build_id or uuid.uuid4().hex
+        self.db_path = None
+        self._pool = None
+        self._schema_ready = False
+        if db_path:
+            self.bind(db_path)
+
+    def __getstate__(self):
+        return {"namespace": self.namespace, "build_id": self.build_id}
+
+    def __setstate__(self, state):
+        self.__init__(namespace=state["namespace"], build_id=state["build_id"])
+
+    def bind(self, db_path: str):
+        """绑定数据库路径（反序列化后调用）"""
+        db_path = str(db_path)
+        if self.db_path == db_path and self._schema_ready:
+            return
+        self.db_path = db_path
+        self._pool = get_connection_manager(db_path)
+        migrate_schema(db_path)
+        self._schema_ready = True
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._pool is None:
+            raise RuntimeError("SQLiteDocstore 尚未绑定数据库路径")
+        return self._pool.connection()
+
+    @staticmethod
+    def _row_to_document(docstore_id: str, content: str, metadata: str) -> Document:
+        return Document(id=docstore_id, page_content=content,
+                        metadata=json.loads(metadata) if metadata else {})
+
+    def search(self, search: str) -> Union[str, Document]:
+        """按向量ID读取单个文档块"""
+        cursor = self._get_connection().execute(
+            "SELECT docstore_id, content, metadata FROM vector_documents WHERE docstore_id = ?",
+            (search,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return self._row_to_document(*row)
+
+    def search_many(self, ids: Iterable[str]) -> Dict[str, Document]:
+        """一次读取多个文档块，返回 {向量ID: 文档}"""
+        ids = list(ids)
+        results = {}
+        conn = self._get_connection()
+        # SQLite默认最多999个绑定参数
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            cursor = conn.execute(
+                f"SELECT docstore_id, content, metadata FROM vector_documents "
+                f"WHERE docstore_id IN ({placeholders})",
+                batch
+            )
+            for row in cursor.fetchall():
+                results[row[0]] = self._row_to_document(*row)
+        return results
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        """增量写入文档块，只插入新的行"""
+        if not texts:
+            return
+        self.add_rows([
+            (docstore_id, doc.metadata.get("source"), doc.page_content,
+             json.dumps(doc.metadata, ensure_ascii=False, default=str))
+            for docstore_id, doc in texts.items()
+        ])
+
+    def add_rows(self, rows: Iterable[Tuple[str, Optional[str], str, str]]) -> None:
+        """按原始行写入文档块：(向量ID, 来源, 内容, 元数据JSON)，导入快照时不需要反序列化元数据"""
+        conn = self._get_connection()
+        file_ids = {}
+        values = []
+        for docstore_id, source, content, metadata in rows:
+            if source not in file_ids:
+                file_ids[source] = self._lookup_file_id(conn, source)
+            values.append((docstore_id, self.namespace, self.build_id, file_ids[source], source, content, metadata))
+        if not values:
+            return
+        conn.executemany('''
+            INSERT OR REPLACE INTO vector_documents
+                (docstore_id, namespace, build_id, file_id, source, content, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', values)
+        conn.commit()
+
+    @staticmethod
+    def _lookup_file_id(conn: sqlite3.Connection, source: Optional[str]) -> Optional[int]:
+        """根据文件名关联 knowledge_files 记录，表不存在时返回None"""
+        if not source:
+            return None
+        try:
+            row = conn.execute(
+                "SELECT id FROM knowledge_files WHERE filename = ? ORDER BY id DESC LIMIT 1",
+                (source,)
+            ).fetchone()
+            return row[0] if row else None
+        except sqlite3.OperationalError:
+            return None
+
+    def retire(self, ids: List[str], version: str) -> None:
+        """标记已不在当前索引版本中的文档块，旧版本目录清理后由 purge_retired 删除"""
+        conn = self._get_connection()
+        for start in range(0, len(ids), 500):
+            batch = list(ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            conn.execute(
+                f"UPDATE vector_documents SET retired_version = ? "
+                f"WHERE docstore_id IN ({placeholders}) AND retired_version IS NULL",
+                [version, *batch]
+            )
+        conn.commit()
+
+    def purge_retired(self, oldest_version: str) -> int:
+        """
+        删除在 oldest_version 或更早版本中退役的文档块，返回删除的行数
+
+        在版本V退役的文档块只被V之前的版本引用，oldest_version 是仍保留的最早版本时这些版本都已清理。
+        """
+        conn = self._get_connection()
+        cursor = conn.execute(
+            "DELETE FROM vector_documents WHERE namespace = ? AND retired_version <= ?",
+            (self.namespace, oldest_version)
+        )
+        conn.commit()
+        return cursor.rowcount
+
+    def filter_ids(self, metadata_filter: Dict) -> Optional[List[str]]:
+        """
+        返回本命名空间中元数据满足过滤条件的向量ID，条件含义同 matches_metadata_filter
+
+        在SQLite中用 json_extract 过滤，不需要读出文档内容；
+        条件值不是字符串/数字/布尔、键名含双引号或数据库不支持JSON函数时返回None，由调用方退回逐条过滤。
+        """
+        clauses = ["namespace = ?"]
+        params: List = [self.namespace]
+        for key, expected in metadata_filter.items():
+            values = expected if isinstance(expected, list) else [expected]
+            if not values:
+                return []
+            if not all(isinstance(value, (str, int, float)) for value in values) or '"' in str(key):
+                return None
+            placeholders = ",".join("?" * len(values))
+            if key == "source":
+                # 合并了重复内容的文档块按 sources 中的任一来源匹配
+                clauses.append(
+                    f"(CASE WHEN json_array_length(metadata, '$.sources') > 0 "
+                    f"THEN EXISTS (SELECT 1 FROM json_each(metadata, '$.sources') WHERE value IN ({placeholders})) "
+                    f"ELSE source IN ({placeholders}) END)"
+                )
+                params.extend(values)
+                params.extend(values)
+            else:
+                clauses.append(f"json_extract(metadata, ?) IN ({placeholders})")
+                params.append(f'$."{key}"')
+                params.extend(values)
+        try:
+            cursor = self._get_connection().execute(
+                f"SELECT docstore_id FROM vector_documents WHERE {' AND '.join(clauses)}", params
+            )
+            return [row[0] for row in cursor.fetchall()]
+        except sqlite3.OperationalError as e:
+            print(f"元数据过滤查询失败，改为逐条过滤: {str(e)}")
+            return None
+
+    def iter_rows(self, batch_size: int = 5000) -> Iterator[List[Tuple[str, Optional[str], str, str]]]:
+        """按批读出当前构建的全部文档块 (向量ID, 来源, 内容, 元数据JSON)，用于导出快照"""
+        cursor = self._get_connection().execute(
+            "SELECT docstore_id, source, content, metadata FROM vector_documents "
+            "WHERE namespace = ? AND build_id = ? AND retired_version IS NULL ORDER BY id",
+            (self.namespace, self.build_id)
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [tuple(row) for row in rows]
+
+    def list_sources(self) -> List[str]:
+        """当前构建中出现过的来源文件（含合并到其他文档块的重复来源）"""
+        cursor = self._get_connection().execute('''
+            SELECT source FROM vector_documents
+            WHERE namespace = ? AND build_id = ? AND retired_version IS NULL AND source IS NOT NULL
+            UNION
+            SELECT json_each.value FROM vector_documents, json_each(vector_documents.metadata, '$.sources')
+            WHERE namespace = ? AND build_id = ? AND retired_version IS NULL
+        ''', (self.namespace, self.build_id, self.namespace, self.build_id))
+        return [row[0] for row in cursor.fetchall() if row[0]]
+
+    def delete(self, ids: List) -> None:
+        conn = self._get_connection()
+        for start in range(0, len(ids), 500):
+            batch = list(ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            conn.execute(f"DELETE FROM vector_documents WHERE docstore_id IN ({placeholders})", batch)
+        conn.commit()
+
+    def prune(self, keep_build_ids: Iterable[str]) -> int:
+        """删除本命名空间中不属于指定构建的文档块，返回删除的行数"""
+        keep = list(dict.fromkeys([self.build_id, *keep_build_ids]))
+        placeholders = ",".join("?" * len(keep))
+        conn = self._get_connection()
+        cursor = conn.execute(
+            f"DELETE FROM vector_documents WHERE namespace = ? AND build_id NOT IN ({placeholders})",
+            [self.namespace, *keep]
+        )
+        conn.commit()
+        return cursor.rowcount
+
+    def __repr__(self):
+        return f"SQLiteDocstore(db_path={self.db_path!r}, namespace={self.namespace!r})"
@@ -1,101 +1,301 @@
-from typing import Union
-import docx
+from typing import Any, Callable, Dict, Union, Iterator, List, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from datetime import datetime
+from functools import lru_cache
+from itertools import groupby
 from PyPDF2 import PdfReader
 import os
-import pandas as pd
+
+from .docx_reader import blocks_to_text, iter_docx_blocks, iter_sections, split_sections
+from .parse_cache import get_parse_cache
+
+PDF_PARALLEL_MIN_PAGES = 40  # 页数少于该值时在当前进程中逐页提取，多进程的启动开销不划算
+PDF_PAGES_PER_TASK = 20  # 多进程提取时每个任务处理的页数
+PDF_WORKERS = min(4, os.cpu_count() or 1)
+# get_file_preview 的默认上限
+PREVIEW_MAX_CHARS = 5000
+PREVIEW_MAX_ROWS = 50  # Excel每个工作表
+PREVIEW_MAX_PAGES = 5  # PDF前几页
+PREVIEW_MAX_BYTES = 256 * 1024  # 文本文件
+PREVIEW_CACHE_SIZE = 128
+# read_sections 划分模块的大小范围（字符数）
+SECTION_MAX_CHARS = 12000
+SECTION_MIN_CHARS = 800
+
+
+def _page_text(page) -> str:
+    """提取单页文本，扫描页返回None或解析出错时按空页处理"""
+    try:
+        return page.extract_text() or ""
+    except Exception as e:
+        print(f"PDF页面文本提取失败: {str(e)}")
+        return ""
+
+
+def _extract_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    """在子进程中提取第 start 到 end-1 页（从0开始）的文本"""
+    reader = PdfReader(file_path)
+    return [_page_text(reader.pages[i]) for i in range(start, end)]
+
+
+def _iter_cached_list(file_path: str, parser: str, parse: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+    """
+    逐项产出列表类型的解析结果（PDF的页、Word的块）
+
+    内容未变化的文件直接从解析缓存逐项读取；未命中时边解析边写入缓存，完整解析一遍后才生效，
+    两种情况都不会把整个文档的解析结果同时放在内存中。缓存损坏时重新解析并覆盖缓存，已产出的项不再重复产出。
+    """
+    cache = get_parse_cache()
+    cached = cache.iter_list(file_path, parser) if cache else None
+    done = 0
+    if cached is not None:
+        try:
+            for item in cached:
+                done += 1
+                yield item
+            return
+        except Exception as e:
+            print(f"解析缓存损坏，从第 {done + 1} 项重新解析: {str(e)}")
+    writer = cache.list_writer(file_path, parser) if cache else None
+    completed = False
+    try:
+        for i, item in enumerate(parse()):
+            if writer:
+                writer.append(item)
+            if i >= done:
+                yield item
+        completed = True
+    finally:
+        # 中途停止读取或出错时不保存不完整的结果
+        if writer and completed:
+            writer.commit()
+        elif writer:
+            writer.discard()
+
+
 class DocumentProcessor:
     @staticmethod
     def read_word(file_path: str) -> str:
-        doc = docx.Document(file_path)
-        return "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
+        """Word文档全文：标题带Markdown标题标记，表格渲染为Markdown，按文档顺序排列"""
+        return blocks_to_text(DocumentProcessor.iter_word_blocks(file_path))
+
+    @staticmethod
+    def iter_word_blocks(file_path: str) -> Iterator[Dict]:
+        """
+        按文档顺序流式产出Word文档的标题、段落和表格（见 docx_reader.iter_docx_blocks）
+
+        内容未变化的文件直接从解析缓存逐块读取，未命中时边解析边写入缓存（同 iter_pdf_pages）。
+        """
+        return _iter_cached_list(file_path, "docx", lambda: iter_docx_blocks(file_path))
+
+    @staticmethod
+    def read_word_blocks(file_path: str) -> List[Dict]:
+        """Word文档的标题、段落和表格列表，见 iter_word_blocks"""
+        return list(DocumentProcessor.iter_word_blocks(file_path))
+
+    @staticmethod
+    def iter_word_sections(file_path: str) -> Iterator[Dict]:
+        """逐个产出按标题划分的章节 {"title", "level", "path", "text"}，只保留当前章节的内容"""
+        return iter_sections(DocumentProcessor.iter_word_blocks(file_path))
+
+    @staticmethod
+    def read_word_sections(file_path: str) -> List[Dict]:
+        """按标题划分的章节 [{"title", "level", "path", "text"}]"""
+        return split_sections(DocumentProcessor.iter_word_blocks(file_path))
     
     @staticmethod
-    def read_pdf(file_path: str) -> str:
-        with open(file_path, 'rb') as file:
-            reader = PdfReader(file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+    def read_pdf(file_path: str, workers: int = None) -> str:
+        return "\n".join(text for _, text in DocumentProcessor.iter_pdf_pages(file_path, workers=workers))
+
+    @staticmethod
+    def iter_pdf_pages(file_path: str, workers: int = None,
+                       pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[Tuple[int, str]]:
+        """
+        逐页产出PDF文本 (页码(从1开始), 文本)
+
+        页数较多且 workers > 1 时按页段分给多个进程提取，结果仍按页码顺序产出；
+        同时在途的页段不超过 workers 的两倍，不会一次解析全部页面。
+        多进程不可用时退回当前进程逐页提取。
+        内容未变化的文件直接从解析缓存逐页读取；未命中时边提取边写入缓存，完整提取一遍后才生效，
+        两种情况都不会把整个文档的文本同时放在内存中。
+        """
+        pages = _iter_cached_list(file_path, "pdf", lambda: (
+            text for _, text in DocumentProcessor._iter_pdf_pages_uncached(file_path, workers, pages_per_task)
+        ))
+        try:
+            for page_number, text in enumerate(pages, 1):
+                yield page_number, text
+        finally:
+            pages.close()
+
+    @staticmethod
+    def _iter_pdf_pages_uncached(file_path: str, workers: int = None,
+                                 pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[Tuple[int, str]]:
+        """逐页提取PDF文本（不经过缓存）"""
+        workers = PDF_WORKERS if workers is None else max(1, workers)
+        reader = PdfReader(file_path)
+        total = len(reader.pages)
+        next_page = 0
+        if workers > 1 and total >= PDF_PARALLEL_MIN_PAGES:
+            ranges = iter([(start, min(start + pages_per_task, total))
+                           for start in range(0, total, pages_per_task)])
+            executor = None
+            try:
+                # spawn 启动的子进程不继承父进程的线程和锁（Web服务、入库线程），各平台行为一致
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                pending = deque()
+                for start, end in ranges:
+                    pending.append((start, executor.submit(_extract_pdf_pages, file_path, start, end)))
+                    if len(pending) >= workers * 2:
+                        break
+                while pending:
+                    start, future = pending.popleft()
+                    texts = future.result()
+                    following = next(ranges, None)
+                    if following:
+                        pending.append((following[0], executor.submit(_extract_pdf_pages, file_path, *following)))
+                    for offset, text in enumerate(texts):
+                        next_page = start + offset + 1
+                        yield next_page, text
+            except Exception as e:
+                print(f"多进程提取PDF失败，改为逐页提取: {str(e)}")
+            finally:
+                if executor is not None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+        for index in range(next_page, total):
+            yield index + 1, _page_text(reader.pages[index])
     
     @staticmethod
     def read_file(file_path: str) -> str:
-        if file_path.endswith('.docx'):
-            return DocumentProcessor.read_word(file_path)
-        elif file_path.endswith('.pdf'):
-            return DocumentProcessor.read_pdf(file_path)
-        else:
+        """按扩展名选择解析器（见 extractors）读取全文"""
+        from .extractors import get_extractor
+        extractor = get_extractor(file_path)
+        if extractor is None:
             raise ValueError("Unsupported file format")
-    # 添加新方法
+        return extractor.read_text(file_path)
 
+    @staticmethod
+    def read_sections(file_path: str, max_chars: int = SECTION_MAX_CHARS,
+                      min_chars: int = SECTION_MIN_CHARS) -> List[Dict]:
+        """
+        按标题把需求文档划分为可以独立处理的模块 [{"title": 模块标题, "text": 模块内容}]
 
+        Word文档使用段落样式中的标题，其他格式按标题行识别（规则同 HeadingChunker）；
+        没有标题的文档整体作为一个模块。
+        """
+        from .extractors import get_extractor
+        extractor = get_extractor(file_path)
+        if extractor is None:
+            raise ValueError("Unsupported file format")
+        return group_sections(extractor.sections(file_path), max_chars=max_chars, min_chars=min_chars)
+
+    @staticmethod
+    def get_file_preview(file_path: str, max_chars: int = PREVIEW_MAX_CHARS, max_rows: int = PREVIEW_MAX_ROWS,
+                         max_pages: int = PREVIEW_MAX_PAGES, max_bytes: int = PREVIEW_MAX_BYTES) -> str:
+        """
+        获取文件的安全预览，只读取需要的部分
 
+        文本文件最多读取 max_bytes 字节，Excel每个工作表最多读取 max_rows 行，
+        PDF最多提取前 max_pages 页，结果最多 max_chars 个字符；
+        同一文件（修改时间和大小不变）相同参数的预览直接返回缓存。
+        """
+        try:
+            # 检查文件是否存在
+            if not os.path.exists(file_path):
+                return "文件不存在"
+            stat = os.stat(file_path)
+            return _cached_preview(os.path.abspath(file_path), stat.st_mtime, stat.st_size,
+                                   max_chars, max_rows, max_pages, max_bytes)
+        except Exception as e:
+            return f"预览错误: {str(e)}"
 
     @staticmethod
-    def get_file_preview(file_path: str) -> str:
-            """获取文件的安全预览，最多显示指定字符数"""
-            try:
-                # 检查文件是否存在
-                if not os.path.exists(file_path):
-                    return "文件不存在"
-                
-                # 根据文件类型处理
-                ext = os.path.splitext(file_path)[1].lower()
-                
-                # 处理文本文件
-                text_extensions = ['.txt', '.csv', '.log', '.ini', '.cfg', '.py', '.js', '.html', '.css', '.json', '.xml']
-                if ext in text_extensions:
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            
-                            return f.read()
-                    except UnicodeDecodeError:
-                        # 如果UTF-8解码失败，尝试其他编码
-                        try:
-                            with open(file_path, 'r', encoding='latin-1') as f:
-                                
-                                return f.read()
-                        except:
-                            return "<无法解码的文本内容>"
-                
-                # 处理Excel文件
-                elif ext in ['.xlsx', '.xls']:
-                    try:
-                        df = pd.read_excel(file_path)
-                        return df.to_string()
-                    except Exception as e:
-                        return f"<Excel文件预览失败: {str(e)}"
-                
-                # 处理Word文档
-                elif ext == '.docx':
-                    try:
-                        doc = docx.Document(file_path)
-                        return "\n".join([para.text for para in doc.paragraphs])
-                    except Exception as e:
-                        return f"<Word文档预览失败: {str(e)}"
-                
-                # 处理PDF文档
-                elif ext == '.pdf':
-                    try:
-                        with open(file_path, 'rb') as file:
-                            reader = PdfReader(file)
-                            text = ""
-                            for page in reader.pages:
-                                page_text = page.extract_text()
-                                if page_text: 
-                                    text += page_text + "\n"
-                            return text
-                    except Exception as e:
-                        return f"<PDF文档预览失败: {str(e)}"
-                
-                # 其他文件类型
-                else:
-                    try:
-                # 尝试作为二进制文件读取
-                        with open(file_path, 'rb') as f:
-                            return f"<二进制文件预览> 大小: {os.path.getsize(file_path)} 字节"
-                    except:
-                        return f"<{ext.upper()[1:]} 文件 - 预览不可用>"
-                    
-            except Exception as e:
-                return f"预览错误: {str(e)}"
\ No newline at end of file
+    def get_file_metadata(file_path: str) -> Dict:
+        """
+        文件的基本信息，不读取全文
+
+        Returns:
+            {"name", "ext", "size", "modified"}，PDF另有 page_count，
+            Excel另有 sheets: [{"name", "rows"}]（.xlsx 的行数取自工作表尺寸记录，含表头；
+            没有尺寸记录的文件和 .xls 为None）
+        """
+        stat = os.stat(file_path)
+        return dict(_cached_metadata(os.path.abspath(file_path), stat.st_mtime, stat.st_size))
+
+
+def group_sections(sections: List[Dict], max_chars: int = SECTION_MAX_CHARS,
+                   min_chars: int = SECTION_MIN_CHARS) -> List[Dict]:
+    """
+    把章节 [{"title", "level", "path", "text"}] 合并为模块 [{"title", "text"}]
+
+    按一级标题分组，超过 max_chars 且有下级标题的模块按下一级标题拆开；
+    不足 min_chars 的相邻模块合并，合并后不超过 max_chars。
+    """
+    def render(section):
+        heading = "#" * min(section["level"] or 1, 6) + " " + section["title"] if section["title"] else ""
+        return "\n".join(part for part in (heading, section["text"].strip()) if part)
+
+    def split(items, depth):
+        units = []
+        for key, group in groupby(items, key=lambda section: tuple(section["path"][:depth + 1])):
+            group = list(group)
+            text = "\n\n".join(render(section) for section in group)
+            if len(text) > max_chars and any(len(section["path"]) > depth + 1 for section in group):
+                units.extend(split(group, depth + 1))
+                continue
+            if key and group[0]["path"] != list(key):
+                # 只有标题没有正文的上级章节不在列表中，补上标题作为模块的开头
+                text = "#" * (depth + 1) + " " + key[-1] + "\n" + text
+            units.append({"title": key[-1] if key else "", "text": text})
+        return units
+
+    modules = []
+    for unit in split([section for section in sections if section["title"] or section["text"].strip()], 0):
+        previous = modules[-1] if modules else None
+        if previous and (len(previous["text"]) < min_chars or len(unit["text"]) < min_chars) \
+                and len(previous["text"]) + len(unit["text"]) <= max_chars:
+            previous["title"] = "、".join(title for title in (previous["title"], unit["title"]) if title)
+            previous["text"] += "\n\n" + unit["text"]
+        else:
+            modules.append(dict(unit))
+    for module in modules:
+        module["title"] = module["title"] or "文档概述"
+    return modules
+
+
+@lru_cache(maxsize=PREVIEW_CACHE_SIZE)
+def _cached_preview(file_path: str, mtime: float, size: int, max_chars: int, max_rows: int,
+                    max_pages: int, max_bytes: int) -> str:
+    """按 (路径, 修改时间, 大小, 预览参数) 缓存预览，文件变化后自动失效"""
+    from .extractors import get_extractor
+    extractor = get_extractor(file_path, preview=True)
+    if extractor is None:
+        return f"<二进制文件预览> 大小: {size} 字节"
+    try:
+        return extractor.preview(file_path, size, max_chars, max_rows, max_pages, max_bytes)
+    except UnicodeDecodeError:
+        return "<无法解码的文本内容>"
+    except Exception as e:
+        return f"<{extractor.label}文件预览失败: {str(e)}>"
+
+
+@lru_cache(maxsize=PREVIEW_CACHE_SIZE)
+def _cached_metadata(file_path: str, mtime: float, size: int) -> Tuple[Tuple[str, Any], ...]:
+    from .extractors import get_extractor
+    ext = os.path.splitext(file_path)[1].lower()
+    metadata = {
+        "name": os.path.basename(file_path),
+        "ext": ext,
+        "size": size,
+        "modified": datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    extractor = get_extractor(file_path, preview=True)
+    if extractor is not None:
+        try:
+            metadata.update(extractor.metadata(file_path))
+        except Exception as e:
+            metadata["error"] = str(e)
+    # lru_cache 返回共享对象，转为元组避免调用方修改缓存内容
+    return tuple(metadata.items())
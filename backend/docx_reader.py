@@ -0,0 +1,194 @@
+# backend/docx_reader.py
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterable, Iterator, List, Optional
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_P, _TBL, _TR, _TC = W + "p", W + "tbl", W + "tr", W + "tc"
+_BODY, _SDT, _SDT_CONTENT = W + "body", W + "sdt", W + "sdtContent"
+_HEADING_STYLE_NAME = re.compile(r'^(?:heading|标题)\s*(\d)$', re.IGNORECASE)
+
+Block = Dict  # {"type": "heading" | "paragraph" | "table", "text": 文本, "level": 标题级别（仅标题）}
+
+
+def _val(element: Optional[ET.Element]) -> Optional[str]:
+    return element.get(W + "val") if element is not None else None
+
+
+def _heading_levels(archive: zipfile.ZipFile) -> Dict[str, int]:
+    """从 styles.xml 读取段落样式对应的标题级别（样式名为 heading N / 标题 N，或设置了大纲级别）"""
+    try:
+        root = ET.fromstring(archive.read("word/styles.xml"))
+    except KeyError:
+        return {}
+    styles = {}
+    for style in root.iter(W + "style"):
+        if style.get(W + "type") != "paragraph":
+            continue
+        name = (_val(style.find(W + "name")) or "").strip()
+        outline = _val(style.find(f"{W}pPr/{W}outlineLvl"))
+        styles[style.get(W + "styleId")] = (name, outline, _val(style.find(W + "basedOn")))
+
+    def level_of(style_id: str, depth: int = 0) -> Optional[int]:
+        if style_id not in styles or depth > 10:
+            return None
+        name, outline, based_on = styles[style_id]
+        match = _HEADING_STYLE_NAME.match(name)
+        if match:
+            return int(match.group(1))
+        if name.lower() == "title":
+            return 1
+        if outline is not None and outline.isdigit() and int(outline) < 9:
+            return int(outline) + 1
+        return level_of(based_on, depth + 1) if based_on else None
+
+    return {style_id: level for style_id in styles if (level := level_of(style_id)) is not None}
+
+
+def _paragraph_text(paragraph: ET.Element) -> str:
+    parts = []
+    for element in paragraph.iter():
+        if element.tag == W + "t":
+            parts.append(element.text or "")
+        elif element.tag == W + "tab":
+            parts.append("\t")
+        elif element.tag in (W + "br", W + "cr"):
+            parts.append("\n")
+    return "".join(parts)
+
+
+def _children(element: ET.Element, tag: str) -> Iterator[ET.Element]:
+    """直接子元素，穿过内容控件（w:sdt）的包装"""
+    for child in element:
+        if child.tag == tag:
+            yield child
+        elif child.tag == _SDT:
+            content = child.find(_SDT_CONTENT)
+            if content is not None:
+                yield from _children(content, tag)
+
+
+def _cell_text(cell: ET.Element) -> str:
+    """单元格内的段落（含嵌套表格）合并为一行，转义竖线"""
+    lines = [_paragraph_text(p).strip() for p in cell.iter(_P)]
+    return "<br>".join(line for line in lines if line).replace("|", "\\|").replace("\n", " ")
+
+
+def table_to_markdown(table: ET.Element) -> str:
+    """表格转为Markdown，第一行作为表头；横向合并的单元格补空列保持列对齐"""
+    rows = []
+    for row in _children(table, _TR):
+        cells = []
+        for cell in _children(row, _TC):
+            cells.append(_cell_text(cell))
+            span = _val(cell.find(f"{W}tcPr/{W}gridSpan"))
+            if span and span.isdigit():
+                cells.extend([""] * (int(span) - 1))
+        if any(cells):
+            rows.append(cells)
+    if not rows:
+        return ""
+    width = max(len(row) for row in rows)
+    lines = []
+    for i, row in enumerate(rows):
+        lines.append("| " + " | ".join(row + [""] * (width - len(row))) + " |")
+        if i == 0:
+            lines.append("|" + " --- |" * width)
+    return "\n".join(lines)
+
+
+def iter_docx_blocks(file_path: str) -> Iterator[Block]:
+    """
+    按文档顺序流式产出 .docx 的标题、段落和表格
+
+    直接用 zipfile 读取 word/document.xml 并以 iterparse 增量解析，
+    每处理完一个正文顶层元素就从树中删除，内存占用只与最大的单个段落或表格有关。
+    标题级别来自段落样式（styles.xml）或段落的大纲级别；表格渲染为Markdown。
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        levels = _heading_levels(archive)
+        with archive.open("word/document.xml") as source:
+            stack: List[ET.Element] = []
+            body = None
+            for event, element in ET.iterparse(source, events=("start", "end")):
+                if event == "start":
+                    stack.append(element)
+                    if element.tag == _BODY:
+                        body = element
+                    continue
+                stack.pop()
+                if element.tag not in (_P, _TBL):
+                    continue
+                # 只处理正文中的段落和最外层表格，表格内和文本框内的段落随所在元素一起处理
+                inside = {parent.tag for parent in stack}
+                if _P in inside or _TBL in inside:
+                    continue
+                if element.tag == _P:
+                    text = _paragraph_text(element).strip()
+                    if text:
+                        style = _val(element.find(f"{W}pPr/{W}pStyle"))
+                        outline = _val(element.find(f"{W}pPr/{W}outlineLvl"))
+                        level = levels.get(style)
+                        if outline is not None and outline.isdigit() and int(outline) < 9:
+                            level = int(outline) + 1
+                        if level:
+                            yield {"type": "heading", "text": text, "level": level}
+                        else:
+                            yield {"type": "paragraph", "text": text}
+                    element.clear()
+                else:
+                    markdown = table_to_markdown(element)
+                    if markdown:
+                        yield {"type": "table", "text": markdown}
+                    element.clear()
+                if stack and stack[-1] is body:
+                    body.remove(element)
+
+
+def blocks_to_text(blocks: Iterable[Block]) -> str:
+    """渲染为文本：标题加Markdown标题标记（HeadingChunker 据此切分章节），表格之间空行分隔"""
+    lines = []
+    for block in blocks:
+        if block["type"] == "heading":
+            lines.append("#" * min(block["level"], 6) + " " + block["text"])
+        elif block["type"] == "table":
+            lines.append("\n" + block["text"] + "\n")
+        else:
+            lines.append(block["text"])
+    return "\n".join(lines)
+
+
+def iter_sections(blocks: Iterable[Block]) -> Iterator[Dict]:
+    """
+    按标题划分章节，逐个产出，只保留当前章节的块（可直接消费 iter_docx_blocks）
+
+    Yields:
+        {"title": 标题, "level": 级别, "path": [上级标题..., 标题], "text": 正文(含表格)}，
+        第一个标题之前的内容作为标题为空的章节
+    """
+    path: List[Block] = []
+    current = {"title": "", "level": 0, "path": [], "blocks": []}
+    for block in blocks:
+        if block["type"] == "heading":
+            if current["title"] or current["blocks"]:
+                yield _render_section(current)
+            while path and path[-1]["level"] >= block["level"]:
+                path.pop()
+            path.append(block)
+            current = {"title": block["text"], "level": block["level"],
+                       "path": [heading["text"] for heading in path], "blocks": []}
+        else:
+            current["blocks"].append(block)
+    if current["title"] or current["blocks"]:
+        yield _render_section(current)
+
+
+def _render_section(section: Dict) -> Dict:
+    return {"title": section["title"], "level": section["level"], "path": section["path"],
+            "text": blocks_to_text(section["blocks"]).strip()}
+
+
+def split_sections(blocks: Iterable[Block]) -> List[Dict]:
+    """按标题划分章节，见 iter_sections"""
+    return list(iter_sections(blocks))
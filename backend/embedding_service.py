@@ -0,0 +1,174 @@
+# backend/embedding_service.py
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 推理后端："torch" 为sentence-transformers默认实现；"onnx" 使用onnxruntime（需要安装 optimum[onnxruntime]），
+# 可通过 onnx_file_name 指定int8量化模型文件，例如 "onnx/model_qint8_avx512_vnni.onnx"
+BACKENDS = ("torch", "onnx")
+
+# 进程内共享的嵌入服务：(模型名称, 后端, ONNX文件) -> EmbeddingService
+_services_lock = threading.Lock()
+_services: Dict[Tuple[str, str, Optional[str]], "EmbeddingService"] = {}
+
+
+def _load_model(model_name: str, backend: str, onnx_file_name: Optional[str] = None):
+    """加载sentence-transformers模型，ONNX后端不可用时退回torch"""
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "onnx":
+        attempts = []
+        if onnx_file_name:
+            attempts.append({"file_name": onnx_file_name})
+        attempts.append({})
+        for model_kwargs in attempts:
+            try:
+                model = SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs)
+                print(f"嵌入模型使用ONNX后端: {model_kwargs.get('file_name', 'model.onnx')}")
+                return model, "onnx"
+            except Exception as e:
+                print(f"ONNX后端加载失败（{model_kwargs.get('file_name', '默认模型')}）: {str(e)}")
+        print("改为使用torch后端")
+
+    return SentenceTransformer(model_name), "torch"
+
+
+class EmbeddingService(Embeddings):
+    """
+    进程内共享的嵌入模型服务
+
+    同一进程的所有会话共用一个模型实例，模型在第一次使用时才加载。
+    查询向量通过后台线程动态批处理：并发到达的多个查询在很短的等待窗口内
+    合并成一次 encode 调用，减少逐条推理的开销；文档向量按批直接计算。
+    模型调用串行执行，避免多个会话同时推理时CPU线程相互争抢。
+    """
+
+    def __init__(self, model_name: str, backend: str = "torch", onnx_file_name: Optional[str] = None,
+                 batch_size: int = 32, max_batch_size: int = 32, max_wait_ms: float = 5.0, model=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"不支持的嵌入后端: {backend}，可选: {', '.join(BACKENDS)}")
+        self.model_name = model_name
+        self.requested_backend = backend
+        self.backend = backend  # 实际使用的后端，ONNX加载失败时变为torch
+        self.onnx_file_name = onnx_file_name
+        self.batch_size = batch_size  # 文档入库时每次encode的条数
+        self.max_batch_size = max(1, max_batch_size)  # 一次合并的最大查询数
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0  # 等待更多查询加入批次的时间
+        self._model = model  # 可直接传入实现了 encode 的模型（如基准测试的哈希编码器），此时不再加载
+        self._model_lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.stats = {"queries": 0, "query_batches": 0, "documents": 0, "encode_seconds": 0.0}
+
+    def _get_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    start_time = time.time()
+                    self._model, self.backend = _load_model(self.model_name, self.requested_backend,
+                                                            self.onnx_file_name)
+                    print(f"加载嵌入模型 {self.model_name}（{self.backend}），耗时 {time.time() - start_time:.2f} 秒")
+        return self._model
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        model = self._get_model()
+        # 与 HuggingFaceEmbeddings 保持一致，换行替换为空格
+        texts = [text.replace("\n", " ") for text in texts]
+        with self._model_lock:
+            start_time = time.time()
+            vectors = model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                   show_progress_bar=False)
+            self.stats["encode_seconds"] += time.time() - start_time
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        self.stats["documents"] += len(texts)
+        return self._encode(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._batch_loop, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _batch_loop(self):
+        """后台线程：收集一个等待窗口内的查询，合并后一次计算"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.time()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self._encode(texts)
+                self.stats["queries"] += len(batch)
+                self.stats["query_batches"] += 1
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector.tolist())
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    @property
+    def cache_key(self) -> str:
+        """区分模型和后端，不同后端的向量不能共用缓存"""
+        key = f"{self.model_name}:{self.requested_backend}"
+        if self.requested_backend == "onnx" and self.onnx_file_name:
+            key += f":{self.onnx_file_name}"
+        return key
+
+    def get_stats(self) -> Dict:
+        """批处理统计：平均每批查询数反映并发合并的效果"""
+        stats = dict(self.stats)
+        stats["encode_seconds"] = round(stats["encode_seconds"], 3)
+        stats["backend"] = self.backend if self._model is not None else None
+        stats["avg_query_batch"] = (
+            round(stats["queries"] / stats["query_batches"], 2) if stats["query_batches"] else 0.0
+        )
+        return stats
+
+
+def get_embedding_service(model_name: str, backend: Optional[str] = None,
+                          onnx_file_name: Optional[str] = None) -> EmbeddingService:
+    """
+    获取进程内共享的嵌入服务
+
+    未指定后端时读取环境变量 KB_EMBEDDING_BACKEND（默认torch），
+    ONNX模型文件读取 KB_EMBEDDING_ONNX_FILE。
+    """
+    backend = backend or os.environ.get("KB_EMBEDDING_BACKEND", "torch")
+    if backend == "onnx":
+        onnx_file_name = onnx_file_name or os.environ.get("KB_EMBEDDING_ONNX_FILE") or None
+    else:
+        onnx_file_name = None
+
+    key = (model_name, backend, onnx_file_name)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = EmbeddingService(model_name, backend=backend, onnx_file_name=onnx_file_name)
+            _services[key] = service
+        return service
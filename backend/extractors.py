@@ -0,0 +1,477 @@
+# backend/extractors.py
+import codecs
+import os
+import re
+from html.parser import HTMLParser
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from PyPDF2 import PdfReader
+
+from .chunkers import split_heading_sections
+from .docx_reader import blocks_to_text, iter_docx_blocks
+from .document_processor import DocumentProcessor, _page_text
+from .parse_cache import get_parse_cache
+
+SEGMENT_CHARS = 200000  # 文本和HTML超过该长度时在段落边界处分段产出
+EXCEL_SEGMENT_ROWS = 500  # Excel渲染为文本时每段的行数
+_CHARSET_PATTERN = re.compile(rb'charset=["\']?([\w\-]+)', re.IGNORECASE)
+
+Segment = Tuple[str, Dict]  # (文本, 附加到文档块的元数据，如 {"page": 3})
+
+
+def normalize_excel_header(header: Iterable) -> List[str]:
+    """与pandas读取时一致：空列名记为 Unnamed: n，重复列名追加 .1、.2 后缀"""
+    columns = []
+    seen: Dict[str, int] = {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None or str(name).strip() == "" else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def truncate_preview(text: str, max_chars: int, note: str = "") -> str:
+    if len(text) > max_chars:
+        return text[:max_chars] + f"\n...（预览已截断{note}）"
+    return text + (f"\n...（{note.lstrip('，')}）" if note else "")
+
+
+def detect_encoding(file_path: str, sniff_bytes: int = 64 * 1024) -> str:
+    """根据文件开头判断文本编码：UTF-8（含BOM），HTML按声明的charset，否则按GB18030（兼容GBK）"""
+    with open(file_path, 'rb') as f:
+        data = f.read(sniff_bytes)
+    if data.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(data, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    match = _CHARSET_PATTERN.search(data)
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode('ascii')).name
+        except (LookupError, UnicodeDecodeError):
+            pass
+    return 'gb18030'
+
+
+class Extractor:
+    """
+    某一类文件的解析器
+
+    iter_segments 按文档顺序流式产出 (文本, 元数据)，知识库逐段切分入库，
+    需求文档读取、章节划分和预览也使用同一个解析器，每种格式只在这里实现一次。
+    structured 为True的解析器（Excel）另外提供 iter_sheets，由知识库按行格式化测试用例。
+    ingest 为False的解析器只用于预览，不接受入库。
+    """
+
+    name = "base"
+    label = "文件"  # 提示信息中的格式名称
+    extensions: Tuple[str, ...] = ()
+    structured = False
+    ingest = True
+
+    def __init__(self, extensions: Iterable[str] = None, ingest: bool = None):
+        if extensions is not None:
+            self.extensions = tuple(extensions)
+        if ingest is not None:
+            self.ingest = ingest
+
+    def iter_segments(self, file_path: str) -> Iterator[Segment]:
+        raise NotImplementedError
+
+    def read_text(self, file_path: str) -> str:
+        return "\n".join(text for text, _ in self.iter_segments(file_path))
+
+    def sections(self, file_path: str) -> List[Dict]:
+        """按标题划分的章节 [{"title", "level", "path", "text"}]"""
+        return split_heading_sections(self.read_text(file_path))
+
+    def preview(self, file_path: str, size: int, max_chars: int, max_rows: int, max_pages: int,
+                max_bytes: int) -> str:
+        return truncate_preview(self.read_text(file_path), max_chars)
+
+    def metadata(self, file_path: str) -> Dict:
+        """get_file_metadata 中该格式特有的信息"""
+        return {}
+
+
+class TextExtractor(Extractor):
+    """纯文本、CSV和Markdown（Markdown的 # 标题由 HeadingChunker 识别）"""
+
+    name = "text"
+    label = "文本"
+    extensions = ('.txt', '.csv', '.md')
+
+    def iter_segments(self, file_path: str) -> Iterator[Segment]:
+        with open(file_path, 'r', encoding=detect_encoding(file_path), errors='replace') as f:
+            lines, length = [], 0
+            for line in f:
+                if length >= SEGMENT_CHARS and not line.strip():
+                    yield "".join(lines), {}
+                    lines, length = [], 0
+                    continue
+                lines.append(line)
+                length += len(line)
+            if lines:
+                yield "".join(lines), {}
+
+    def preview(self, file_path, size, max_chars, max_rows, max_pages, max_bytes):
+        with open(file_path, 'rb') as f:
+            data = f.read(max_bytes)
+        note = f"，文件共 {size} 字节" if size > len(data) else ""
+        try:
+            # 截断处可能切在多字节字符中间，增量解码器会留下不完整的尾部
+            text = codecs.getincrementaldecoder('utf-8-sig')().decode(data, final=size <= len(data))
+        except UnicodeDecodeError:
+            text = codecs.getincrementaldecoder('gb18030')(errors='replace').decode(data, final=size <= len(data))
+        return truncate_preview(text, max_chars, note)
+
+
+_HTML_SKIP_TAGS = {"script", "style", "noscript", "template", "svg"}
+_HTML_HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+_HTML_BLOCK_TAGS = {"p", "div", "li", "ul", "ol", "dl", "dt", "dd", "section", "article", "header", "footer",
+                    "nav", "aside", "main", "blockquote", "figure", "figcaption", "form", "hr", "title", "table"}
+
+
+class _HtmlTextParser(HTMLParser):
+    """把HTML转为文本行：h1-h6 加Markdown标题标记，表格每行渲染为 | 单元格 | ，跳过脚本和样式"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines: List[str] = []  # 已完成的文本行，由调用方取走
+        self._parts: List[str] = []
+        self._skip = 0
+        self._pre = 0
+        self._heading = 0
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _HTML_SKIP_TAGS:
+            self._skip += 1
+        elif self._skip:
+            return
+        elif tag in ("td", "th"):
+            self._end_cell()
+            if self._row is None:
+                self._flush()
+                self._row = []
+            self._cell = []
+        elif tag == "tr":
+            self._end_row()
+            self._flush()
+            self._row = []
+        elif tag == "br":
+            if self._cell is not None:
+                self._cell.append(" ")
+            elif self._pre:
+                self._parts.append("\n")
+            else:
+                self._flush()
+        elif tag in _HTML_HEADINGS:
+            self._flush()
+            self._heading = int(tag[1])
+        elif tag == "pre":
+            self._flush()
+            self._pre += 1
+        elif tag in _HTML_BLOCK_TAGS and self._cell is None:
+            self._flush()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in _HTML_SKIP_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in _HTML_SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif self._skip:
+            return
+        elif tag in ("td", "th"):
+            self._end_cell()
+        elif tag in ("tr", "table"):
+            self._end_row()
+        elif tag in _HTML_HEADINGS:
+            self._flush()
+            self._heading = 0
+        elif tag == "pre":
+            self._flush()
+            self._pre = max(0, self._pre - 1)
+        elif tag in _HTML_BLOCK_TAGS and self._cell is None:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        (self._cell if self._cell is not None else self._parts).append(data)
+
+    def close(self):
+        super().close()
+        self._end_row()
+        self._flush()
+
+    def _end_cell(self):
+        if self._cell is not None:
+            self._row.append(" ".join("".join(self._cell).split()).replace("|", "\\|"))
+            self._cell = None
+
+    def _end_row(self):
+        self._end_cell()
+        if self._row is not None:
+            if any(self._row):
+                self.lines.append("| " + " | ".join(self._row) + " |")
+            self._row = None
+
+    def _flush(self):
+        text = "".join(self._parts)
+        self._parts = []
+        if self._pre:
+            self.lines.extend(line.rstrip() for line in text.strip("\n").split("\n") if line.strip())
+            return
+        text = " ".join(text.split())
+        if text:
+            self.lines.append("#" * self._heading + " " + text if self._heading else text)
+
+
+class HtmlExtractor(Extractor):
+    """HTML页面（如导出的Confluence需求文档），分块读取并增量解析"""
+
+    name = "html"
+    label = "HTML"
+    extensions = ('.html', '.htm')
+
+    @staticmethod
+    def _iter_lines(file_path: str, max_chars: int = None) -> Iterator[str]:
+        parser = _HtmlTextParser()
+        read = 0
+        with open(file_path, 'r', encoding=detect_encoding(file_path), errors='replace') as f:
+            for block in iter(lambda: f.read(64 * 1024), ""):
+                parser.feed(block)
+                yield from parser.lines
+                parser.lines = []
+                read += len(block)
+                if max_chars is not None and read >= max_chars:
+                    break
+        parser.close()
+        yield from parser.lines
+
+    def iter_segments(self, file_path: str) -> Iterator[Segment]:
+        lines, length = [], 0
+        for line in self._iter_lines(file_path):
+            # 超过分段长度后在下一个标题处分段
+            if length >= SEGMENT_CHARS and line.startswith("#"):
+                yield "\n".join(lines), {}
+                lines, length = [], 0
+            lines.append(line)
+            length += len(line) + 1
+        if lines:
+            yield "\n".join(lines), {}
+
+    def preview(self, file_path, size, max_chars, max_rows, max_pages, max_bytes):
+        lines, length = [], 0
+        for line in self._iter_lines(file_path, max_chars=max_bytes):
+            lines.append(line)
+            length += len(line) + 1
+            if length > max_chars:
+                break
+        note = "" if length > max_chars or size <= max_bytes else f"，文件共 {size} 字节"
+        return truncate_preview("\n".join(lines), max_chars, note)
+
+
+class PdfExtractor(Extractor):
+    """PDF逐页提取（多进程和解析缓存见 DocumentProcessor.iter_pdf_pages），文档块带页码"""
+
+    name = "pdf"
+    label = "PDF"
+    extensions = ('.pdf',)
+
+    def iter_segments(self, file_path: str) -> Iterator[Segment]:
+        for page_number, text in DocumentProcessor.iter_pdf_pages(file_path):
+            yield text, {"page": page_number}
+
+    def preview(self, file_path, size, max_chars, max_rows, max_pages, max_bytes):
+        cache = get_parse_cache()
+        cached = cache.iter_list(file_path, "pdf") if cache else None
+        pages = None
+        if cached is not None:
+            # 逐页读取缓存，只保留前几页
+            try:
+                pages, total = [], 0
+                for text in cached:
+                    if total < max_pages:
+                        pages.append(text)
+                    total += 1
+            except Exception as e:
+                print(f"解析缓存损坏，直接读取PDF: {str(e)}")
+                pages = None
+        if pages is None:
+            reader = PdfReader(file_path)
+            total = len(reader.pages)
+            pages = [_page_text(reader.pages[i]) for i in range(min(total, max_pages))]
+        parts, length = [], 0
+        for text in pages[:max_pages]:
+            if text:
+                parts.append(text)
+                length += len(text)
+                if length >= max_chars:
+                    break
+        note = f"，共 {total} 页，显示前 {min(total, max_pages)} 页" if total > max_pages else ""
+        return truncate_preview("\n".join(parts), max_chars, note)
+
+    def metadata(self, file_path: str) -> Dict:
+        return {"page_count": len(PdfReader(file_path).pages)}
+
+
+class DocxExtractor(Extractor):
+    """Word文档：标题、段落和表格按文档顺序渲染（见 docx_reader），解析结果进入解析缓存"""
+
+    name = "docx"
+    label = "Word"
+    extensions = ('.docx',)
+
+    def iter_segments(self, file_path: str) -> Iterator[Segment]:
+        # 逐章节产出，章节正文前带上完整的标题路径，HeadingChunker 仍能看到标题层级
+        for section in DocumentProcessor.iter_word_sections(file_path):
+            if section["text"]:
+                headings = [f"{'#' * min(level, 6)} {title}" for level, title in enumerate(section["path"], 1)]
+                yield "\n".join(headings + [section["text"]]), {}
+
+    def sections(self, file_path: str) -> List[Dict]:
+        return DocumentProcessor.read_word_sections(file_path)
+
+    def preview(self, file_path, size, max_chars, max_rows, max_pages, max_bytes):
+        cache = get_parse_cache()
+        cached = cache.iter_list(file_path, "docx") if cache else None
+        try:
+            blocks = self._leading_blocks(cached if cached is not None else iter_docx_blocks(file_path), max_chars)
+        except Exception as e:
+            if cached is None:
+                raise
+            print(f"解析缓存损坏，直接读取Word文档: {str(e)}")
+            blocks = self._leading_blocks(iter_docx_blocks(file_path), max_chars)
+        return truncate_preview(blocks_to_text(blocks), max_chars)
+
+    @staticmethod
+    def _leading_blocks(blocks: Iterator[Dict], max_chars: int) -> List[Dict]:
+        """只读取到足够预览的位置"""
+        leading, length = [], 0
+        for block in blocks:
+            leading.append(block)
+            length += len(block["text"]) + 1
+            if length > max_chars:
+                break
+        return leading
+
+
+class ExcelExtractor(Extractor):
+    """Excel工作表，.xlsx 以只读模式流式读取；入库时由知识库按行提取测试用例字段"""
+
+    name = "excel"
+    label = "Excel"
+    extensions = ('.xlsx', '.xls')
+    structured = True
+
+    @staticmethod
+    def iter_sheets(file_path: str) -> Iterator[Tuple[str, List[str], Iterator[tuple]]]:
+        """逐个工作表产出 (工作表名, 表头, 数据行迭代器)"""
+        if os.path.splitext(file_path)[1].lower() == '.xlsx':
+            from openpyxl import load_workbook
+            workbook = load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                for worksheet in workbook.worksheets:
+                    rows = worksheet.iter_rows(values_only=True)
+                    header = next(rows, None)
+                    if header is None:
+                        continue
+                    yield worksheet.title, normalize_excel_header(header), rows
+            finally:
+                workbook.close()
+        else:
+            # .xls 没有流式读取器，整表读取后按行产出
+            for sheet_name, df in pd.read_excel(file_path, sheet_name=None).items():
+                yield sheet_name, [str(col) for col in df.columns], df.itertuples(index=False, name=None)
+
+    def iter_segments(self, file_path: str) -> Iterator[Segment]:
+        for sheet_name, columns, rows in self.iter_sheets(file_path):
+            width = len(columns)
+            while True:
+                batch = list(islice(rows, EXCEL_SEGMENT_ROWS))
+                if not batch:
+                    break
+                df = pd.DataFrame([tuple(row[:width]) + (None,) * (width - len(row)) for row in batch],
+                                  columns=columns).dropna(how="all")
+                if not df.empty:
+                    text = df.astype(object).where(df.notna(), "").to_string(index=False)
+                    yield f"工作表: {sheet_name}\n{text}", {"sheet": sheet_name}
+
+    def preview(self, file_path, size, max_chars, max_rows, max_pages, max_bytes):
+        def format_sheet(name, df, total):
+            shown = f"（共 {total} 行，显示前 {len(df)} 行）" if total and total > len(df) else ""
+            return f"工作表: {name}{shown}\n{df.to_string()}"
+
+        parts, length = [], 0
+        if os.path.splitext(file_path)[1].lower() == '.xlsx':
+            from openpyxl import load_workbook
+            workbook = load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                for worksheet in workbook.worksheets:
+                    rows = list(islice(worksheet.iter_rows(values_only=True), max_rows + 1))
+                    if not rows:
+                        continue
+                    df = pd.DataFrame(rows[1:], columns=[str(col) for col in rows[0]])
+                    parts.append(format_sheet(worksheet.title, df, (worksheet.max_row or len(rows)) - 1))
+                    length += len(parts[-1])
+                    if length >= max_chars:
+                        break
+            finally:
+                workbook.close()
+        else:
+            # .xls 没有流式读取器，只限制构造的行数
+            for sheet_name, df in pd.read_excel(file_path, sheet_name=None, nrows=max_rows).items():
+                parts.append(format_sheet(sheet_name, df, None))
+        return truncate_preview("\n\n".join(parts), max_chars)
+
+    def metadata(self, file_path: str) -> Dict:
+        if os.path.splitext(file_path)[1].lower() == '.xlsx':
+            from openpyxl import load_workbook
+            workbook = load_workbook(file_path, read_only=True)
+            try:
+                return {"sheets": [{"name": ws.title, "rows": ws.max_row} for ws in workbook.worksheets]}
+            finally:
+                workbook.close()
+        with pd.ExcelFile(file_path) as workbook:
+            return {"sheets": [{"name": name, "rows": None} for name in workbook.sheet_names]}
+
+
+_EXTRACTORS: Dict[str, Extractor] = {}
+
+
+def register_extractor(extractor: Extractor):
+    """按扩展名登记解析器，已有的扩展名被替换"""
+    for ext in extractor.extensions:
+        _EXTRACTORS[ext.lower()] = extractor
+
+
+def get_extractor(file_path: str, preview: bool = False) -> Optional[Extractor]:
+    """文件对应的解析器，不支持入库的格式返回None；preview 为True时也返回只用于预览的解析器"""
+    extractor = _EXTRACTORS.get(os.path.splitext(file_path)[1].lower())
+    if extractor is None or (not extractor.ingest and not preview):
+        return None
+    return extractor
+
+
+def supported_extensions() -> Tuple[str, ...]:
+    """可以入库的扩展名"""
+    return tuple(ext for ext, extractor in _EXTRACTORS.items() if extractor.ingest)
+
+
+for _extractor in (ExcelExtractor(), TextExtractor(), DocxExtractor(), PdfExtractor(), HtmlExtractor(),
+                   TextExtractor(('.log', '.ini', '.cfg', '.py', '.js', '.css', '.json', '.xml'), ingest=False)):
+    register_extractor(_extractor)
@@ -0,0 +1,320 @@
+# backend/index_store.py
+import json
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import faiss
+
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "v_"
+STAGING_PREFIX = ".staging_"
+EXTRA_SUFFIX = ".extra.pkl"
+MANIFEST_FILE = "manifest.json"
+WRITE_LOCK_FILE = ".write.lock"
+
+# 进程内共享的索引：(索引目录, 版本号) -> (index, docstore, index_to_docstore_id, extras)
+_shared_lock = threading.Lock()
+_shared_indexes: Dict[Tuple[str, str], Tuple] = {}
+
+# 进程内按索引目录区分的写锁，同一线程可重入
+_writer_locks_lock = threading.Lock()
+_writer_locks: Dict[str, threading.RLock] = {}
+_writer_local = threading.local()
+
+
+def _lock_file(f):
+    """对已打开的锁文件加跨进程独占锁（阻塞等待）"""
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK 重试约10秒后仍失败会抛出异常，继续等待
+                continue
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock_file(f):
+    if os.name == "nt":
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _mmap_flags() -> int:
+    """返回当前faiss版本支持的只读内存映射读取标志"""
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) or getattr(faiss, "IO_FLAG_MMAP", 0)
+    return flags | getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+
+
+class IndexStore:
+    """
+    版本化的FAISS索引存储
+
+    目录结构：
+        faiss_index/CURRENT          当前生效的版本号
+        faiss_index/v_<版本号>/      index.faiss + index.pkl + manifest.json + <名称>.extra.pkl
+    旧格式直接放在 faiss_index/ 根目录下的索引视为版本 ""。
+    extras 是随索引一起保存的附加结构（如关键词倒排表），按名称读写；
+    其中 "manifest" 以JSON保存索引的元数据（文档块数量等）。
+
+    同一进程内的所有会话共享同一份只读索引；index.faiss 以内存映射方式打开，
+    多个工作进程读取同一版本时共享操作系统页缓存。新版本先写入临时目录，
+    再通过重命名目录和替换 CURRENT 文件原子发布。
+
+    写入方需持有 writer_lock()：进程内用线程锁、进程间用锁文件串行化，
+    并在锁内基于最新发布的版本修改，避免并发上传互相覆盖。读取方不加锁。
+    """
+
+    def __init__(self, index_path: str, keep_versions: int = 2):
+        self.index_path = os.path.normpath(index_path)
+        self.keep_versions = max(1, keep_versions)
+        os.makedirs(self.index_path, exist_ok=True)
+
+    @property
+    def current_file(self) -> str:
+        return os.path.join(self.index_path, CURRENT_FILE)
+
+    def version_dir(self, version: str) -> str:
+        """获取版本对应的目录，空版本号表示旧格式的根目录"""
+        if not version:
+            return self.index_path
+        return os.path.join(self.index_path, VERSION_PREFIX + version)
+
+    @contextmanager
+    def writer_lock(self):
+        """
+        索引写锁，同一时刻只有一个写入方（跨线程、跨进程）
+
+        同一线程内可重入，嵌套获取时只在最外层加锁文件。
+        """
+        with _writer_locks_lock:
+            lock = _writer_locks.setdefault(self.index_path, threading.RLock())
+        depths = getattr(_writer_local, "depths", None)
+        if depths is None:
+            depths = _writer_local.depths = {}
+
+        with lock:
+            depth = depths.get(self.index_path, 0)
+            if depth:
+                depths[self.index_path] = depth + 1
+                try:
+                    yield
+                finally:
+                    depths[self.index_path] = depth
+                return
+
+            start_time = time.time()
+            with open(os.path.join(self.index_path, WRITE_LOCK_FILE), 'a+b') as f:
+                _lock_file(f)
+                waited = time.time() - start_time
+                if waited > 1:
+                    print(f"等待索引写锁 {waited:.1f} 秒")
+                depths[self.index_path] = 1
+                try:
+                    yield
+                finally:
+                    depths[self.index_path] = 0
+                    _unlock_file(f)
+
+    def current_version(self) -> Optional[str]:
+        """读取当前生效的版本号，没有任何索引时返回None"""
+        try:
+            with open(self.current_file, 'r', encoding='utf-8') as f:
+                version = f.read().strip()
+            if version and os.path.exists(os.path.join(self.version_dir(version), "index.faiss")):
+                return version
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取索引版本失败: {str(e)}")
+
+        if os.path.exists(os.path.join(self.index_path, "index.faiss")):
+            return ""
+        return None
+
+    def current_stamp(self) -> float:
+        """CURRENT文件的修改时间，用于低成本地检测是否有新版本发布"""
+        try:
+            return os.stat(self.current_file).st_mtime
+        except OSError:
+            return 0.0
+
+    def oldest_version(self) -> Optional[str]:
+        """磁盘上仍保留的最早版本号（不含旧格式的根目录索引），没有版本目录时返回None"""
+        try:
+            versions = [name[len(VERSION_PREFIX):] for name in os.listdir(self.index_path)
+                        if name.startswith(VERSION_PREFIX)]
+        except OSError:
+            return None
+        return min(versions) if versions else None
+
+    def read_version(self, version: str, mmap: bool = True) -> Tuple:
+        """从磁盘读取指定版本，mmap=True 时以只读内存映射方式打开向量索引"""
+        folder = self.version_dir(version)
+        index_file = os.path.join(folder, "index.faiss")
+
+        index = None
+        if mmap:
+            try:
+                index = faiss.read_index(index_file, _mmap_flags())
+            except RuntimeError as e:
+                # 部分索引类型不支持内存映射，退回到完整加载
+                print(f"索引不支持内存映射，改为完整加载: {str(e)}")
+        if index is None:
+            index = faiss.read_index(index_file)
+
+        with open(os.path.join(folder, "index.pkl"), 'rb') as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+
+        extras = {}
+        manifest_file = os.path.join(folder, MANIFEST_FILE)
+        if os.path.exists(manifest_file):
+            try:
+                with open(manifest_file, 'r', encoding='utf-8') as f:
+                    extras["manifest"] = json.load(f)
+            except Exception as e:
+                print(f"读取索引清单失败: {str(e)}")
+        for name in os.listdir(folder):
+            if name.endswith(EXTRA_SUFFIX):
+                try:
+                    with open(os.path.join(folder, name), 'rb') as f:
+                        extras[name[:-len(EXTRA_SUFFIX)]] = pickle.load(f)
+                except Exception as e:
+                    print(f"读取索引附加数据 {name} 失败: {str(e)}")
+
+        return index, docstore, index_to_docstore_id, extras
+
+    def load_shared(self, mmap: bool = True) -> Tuple[Optional[str], Optional[Tuple]]:
+        """
+        获取当前版本的共享只读索引
+
+        Returns:
+            (版本号, (index, docstore, index_to_docstore_id, extras))，没有索引时返回 (None, None)
+        """
+        version = self.current_version()
+        if version is None:
+            return None, None
+
+        key = (self.index_path, version)
+        with _shared_lock:
+            parts = _shared_indexes.get(key)
+            if parts is None:
+                start_time = time.time()
+                parts = self.read_version(version, mmap=mmap)
+                self._replace_shared(key, parts)
+                print(f"加载共享索引版本 {version or '(旧格式)'}，耗时 {time.time() - start_time:.2f} 秒")
+        return version, parts
+
+    def share(self, version: str, parts: Tuple):
+        """把刚发布版本的内存副本登记为共享索引，其他会话无需再次从磁盘加载"""
+        with _shared_lock:
+            self._replace_shared((self.index_path, version), parts)
+
+    def _replace_shared(self, key: Tuple[str, str], parts: Tuple):
+        """登记共享索引并移除同一目录下的旧版本（调用方需持有锁）"""
+        for old_key in [k for k in _shared_indexes if k[0] == key[0] and k != key]:
+            del _shared_indexes[old_key]
+        _shared_indexes[key] = parts
+
+    def create_staging_dir(self) -> Tuple[str, str]:
+        """创建新版本的临时目录，返回 (版本号, 临时目录)"""
+        now = time.time()
+        version = f"{time.strftime('%Y%m%d%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}_{uuid.uuid4().hex[:8]}"
+        staging_dir = os.path.join(self.index_path, STAGING_PREFIX + version)
+        os.makedirs(staging_dir)
+        return version, staging_dir
+
+    def save_version(self, vectorstore, extras: Optional[Dict[str, object]] = None) -> str:
+        """把向量库及附加数据写成一个新版本并原子发布，返回版本号"""
+        version, staging_dir = self.create_staging_dir()
+        try:
+            vectorstore.save_local(staging_dir)
+            for name, value in (extras or {}).items():
+                if value is None:
+                    continue
+                if name == "manifest":
+                    with open(os.path.join(staging_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+                        json.dump(dict(value, version=version), f, ensure_ascii=False, indent=2)
+                    continue
+                with open(os.path.join(staging_dir, name + EXTRA_SUFFIX), 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.publish(version, staging_dir)
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        return version
+
+    def publish(self, version: str, staging_dir: str):
+        """把临时目录发布为当前版本"""
+        os.replace(staging_dir, self.version_dir(version))
+
+        # 先写临时文件再替换，读者要么看到旧版本号，要么看到新版本号
+        tmp_file = f"{self.current_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.current_file)
+
+        self._cleanup_old_versions(version)
+
+    def _cleanup_old_versions(self, current: str):
+        """
+        删除多余的旧版本目录，保留最近的 keep_versions 个版本供仍在读取的进程使用
+
+        上次没能删除的目录（如Windows上仍被内存映射的文件）同样超出保留数量，每次发布时重试；
+        在此之前 oldest_version 仍报告这些版本，它们引用的退役文档块不会被删除。
+        """
+        try:
+            versions = sorted(
+                (name for name in os.listdir(self.index_path)
+                 if name.startswith(VERSION_PREFIX) and name != VERSION_PREFIX + current),
+                reverse=True
+            )
+            leftover = [name for name in versions[self.keep_versions - 1:] if not self._remove_version_dir(name)]
+            if leftover:
+                print(f"{len(leftover)} 个旧索引版本目录未能删除，下次发布时重试: {', '.join(leftover)}")
+
+            # 旧格式的根目录索引已被新版本取代
+            for name in ("index.faiss", "index.pkl"):
+                legacy_file = os.path.join(self.index_path, name)
+                if os.path.exists(legacy_file):
+                    try:
+                        os.remove(legacy_file)
+                    except OSError as e:
+                        print(f"删除旧格式索引文件失败: {str(e)}")
+        except Exception as e:
+            print(f"清理旧索引版本失败: {str(e)}")
+
+    def _remove_version_dir(self, name: str) -> bool:
+        """删除一个版本目录，返回是否删除干净；删除失败的文件记录原因，不中断其他文件的删除"""
+        errors = []
+
+        def record(function, path, error):
+            errors.append((path, error[1] if isinstance(error, tuple) else error))
+
+        folder = os.path.join(self.index_path, name)
+        if sys.version_info >= (3, 12):
+            shutil.rmtree(folder, onexc=record)
+        else:
+            shutil.rmtree(folder, onerror=record)
+        if errors:
+            path, error = errors[0]
+            print(f"删除旧索引版本 {name} 失败，{len(errors)} 个文件或目录未删除（{os.path.basename(path)}: {error}）")
+        return not os.path.exists(folder)
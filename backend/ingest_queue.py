@@ -0,0 +1,335 @@
+# backend/ingest_queue.py
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Dict, List, Optional
+
+from .database import migrate_schema
+from .kb_shards import DEFAULT_NAMESPACE, KnowledgeBaseShards
+from .sqlite_pool import get_connection_manager
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+STATUS_LABELS = {
+    PENDING: "排队中",
+    RUNNING: "处理中",
+    SUCCEEDED: "已完成",
+    FAILED: "失败",
+    CANCELLED: "已取消",
+}
+
+
+# 领取任务的进程标识：主机名:进程号:启动标识，启动标识区分复用了同一进程号的新进程
+PROCESS_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _process_alive(pid: int) -> bool:
+    """本机上的进程是否仍在运行（无法确定时按仍在运行处理）"""
+    if os.name == "nt":
+        # Windows 上 os.kill(pid, 0) 会结束目标进程，改为查询进程退出码
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # 拒绝访问说明进程存在
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return True
+            return exit_code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def owner_is_dead(owner: Optional[str]) -> bool:
+    """领取任务的进程是否已经退出；只能判断本机的进程，其他主机或旧版本没有记录时返回False"""
+    if not owner:
+        return False
+    try:
+        host, pid, _ = owner.rsplit(":", 2)
+        pid = int(pid)
+    except ValueError:
+        return False
+    if host != socket.gethostname():
+        return False
+    if pid == os.getpid():
+        return owner != PROCESS_OWNER
+    return not _process_alive(pid)
+
+
+class JobCancelled(Exception):
+    """任务被取消时由进度回调抛出，中止正在进行的入库"""
+
+
+class IngestQueue:
+    """
+    知识库后台入库队列
+
+    任务保存在SQLite的 ingest_jobs 表中，上传只需登记任务即可返回；
+    后台工作线程依次领取任务，调用 KnowledgeBase.add_document 解析、嵌入并发布新版本，
+    完成后其他会话在下一次搜索时自动切换到新版本。
+    任务领取通过条件更新完成，多个进程共用同一数据库时也不会重复处理。
+    失败的任务按退避时间重试，超过最大次数后标记为失败；
+    排队中的任务可直接取消，处理中的任务在下一批写入后中止，已发布的索引不受影响。
+    """
+
+    def __init__(self, knowledge_base, db_path: str, database=None, workers: int = 1,
+                 max_attempts: int = 3, retry_delay: float = 5.0, stale_seconds: float = 600.0):
+        self.knowledge_base = knowledge_base  # KnowledgeBase，或按任务的分区写入的 KnowledgeBaseShards
+        self.db_path = str(db_path)
+        self.database = database  # 提供时，入库成功后登记到 knowledge_files
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay  # 第n次重试前等待 retry_delay * n 秒
+        self.stale_seconds = stale_seconds  # 无法确认执行进程时，超过该时间没有进度的处理中任务视为中断
+        self._pool = get_connection_manager(self.db_path)
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._threads_lock = threading.Lock()
+
+        migrate_schema(self.db_path)
+        self._requeue_stale_jobs()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        return self._pool.connection()
+
+    def start(self):
+        """启动工作线程（重复调用无副作用）"""
+        with self._threads_lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"kb-ingest-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, file_path: str, filename: Optional[str] = None, namespace: str = DEFAULT_NAMESPACE) -> int:
+        """登记入库任务并立即返回任务ID"""
+        filename = filename or os.path.basename(file_path)
+        conn = self._get_connection()
+        cursor = conn.execute('''
+            INSERT INTO ingest_jobs (filename, file_path, namespace, max_attempts, message, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (filename, file_path, namespace, self.max_attempts, "等待处理", time.time()))
+        conn.commit()
+        self.start()
+        self._wakeup.set()
+        print(f"已提交入库任务 {cursor.lastrowid}: {filename}")
+        return cursor.lastrowid
+
+    def cancel(self, job_id: int) -> bool:
+        """取消任务：排队中的任务直接取消，处理中的任务在下一批写入后中止"""
+        conn = self._get_connection()
+        cursor = conn.execute('''
+            UPDATE ingest_jobs SET status = ?, message = ?, finished_at = CURRENT_TIMESTAMP, updated_at = ?
+            WHERE id = ? AND status = ?
+        ''', (CANCELLED, "已取消", time.time(), job_id, PENDING))
+        if cursor.rowcount == 0:
+            cursor = conn.execute('''
+                UPDATE ingest_jobs SET cancel_requested = 1, message = ?
+                WHERE id = ? AND status = ?
+            ''', ("正在取消", job_id, RUNNING))
+        conn.commit()
+        return cursor.rowcount > 0
+
+    def retry(self, job_id: int) -> bool:
+        """重新排队失败或已取消的任务"""
+        conn = self._get_connection()
+        cursor = conn.execute('''
+            UPDATE ingest_jobs
+            SET status = ?, attempts = 0, cancel_requested = 0, progress = 0, error = NULL,
+                message = ?, available_at = 0, finished_at = NULL, updated_at = ?
+            WHERE id = ? AND status IN (?, ?)
+        ''', (PENDING, "等待处理", time.time(), job_id, FAILED, CANCELLED))
+        conn.commit()
+        if cursor.rowcount:
+            self.start()
+            self._wakeup.set()
+        return cursor.rowcount > 0
+
+    def get_job(self, job_id: int) -> Optional[Dict]:
+        row = self._get_connection().execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_jobs(self, limit: int = 50) -> List[Dict]:
+        """按提交时间倒序列出最近的任务"""
+        cursor = self._get_connection().execute(
+            "SELECT * FROM ingest_jobs ORDER BY id DESC LIMIT ?", (limit,)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    def has_active_jobs(self) -> bool:
+        row = self._get_connection().execute(
+            "SELECT COUNT(*) FROM ingest_jobs WHERE status IN (?, ?)", (PENDING, RUNNING)
+        ).fetchone()
+        return row[0] > 0
+
+    def unfinished_files(self, namespace: str = DEFAULT_NAMESPACE) -> set:
+        """
+        分区中最近一次入库任务没有成功完成（排队中、处理中、已取消、失败）的文件名
+
+        上传的文件直接保存在知识库目录中，目录同步跳过这些文件，
+        避免取消或失败的上传被监视线程入库，也避免与处理中的任务重复入库。
+        """
+        rows = self._get_connection().execute(
+            "SELECT filename, status FROM ingest_jobs WHERE namespace = ? ORDER BY id", (namespace,)
+        ).fetchall()
+        latest = {row["filename"]: row["status"] for row in rows}
+        return {filename for filename, status in latest.items() if status != SUCCEEDED}
+
+    def _requeue_stale_jobs(self):
+        """
+        进程异常退出时遗留的处理中任务重新排队
+
+        本机上执行进程已经退出的任务立即重新排队；其他主机或没有记录执行进程的任务
+        超过 stale_seconds 没有进度时才重新排队。
+        """
+        conn = self._get_connection()
+        rows = conn.execute(
+            "SELECT id, owner, updated_at FROM ingest_jobs WHERE status = ?", (RUNNING,)
+        ).fetchall()
+        deadline = time.time() - self.stale_seconds
+        requeued = 0
+        for row in rows:
+            if not owner_is_dead(row["owner"]) and (row["updated_at"] or 0) >= deadline:
+                continue
+            # 条件更新：任务在检查之后已被重新领取时不修改
+            cursor = conn.execute('''
+                UPDATE ingest_jobs SET status = ?, message = ?, owner = NULL
+                WHERE id = ? AND status = ? AND owner IS ?
+            ''', (PENDING, "处理中断，重新排队", row["id"], RUNNING, row["owner"]))
+            requeued += cursor.rowcount
+        conn.commit()
+        if requeued:
+            print(f"重新排队 {requeued} 个中断的入库任务")
+
+    def _claim_next(self) -> Optional[Dict]:
+        """领取下一个可执行的任务，返回任务记录；没有任务时返回None"""
+        conn = self._get_connection()
+        now = time.time()
+        row = conn.execute('''
+            SELECT id FROM ingest_jobs WHERE status = ? AND available_at <= ?
+            ORDER BY id LIMIT 1
+        ''', (PENDING, now)).fetchone()
+        if row is None:
+            return None
+        # 条件更新保证同一任务只会被一个工作线程（或进程）领取
+        cursor = conn.execute('''
+            UPDATE ingest_jobs
+            SET status = ?, attempts = attempts + 1, progress = 0, message = ?, owner = ?,
+                started_at = CURRENT_TIMESTAMP, updated_at = ?
+            WHERE id = ? AND status = ?
+        ''', (RUNNING, "正在解析和嵌入", PROCESS_OWNER, now, row["id"], PENDING))
+        conn.commit()
+        if cursor.rowcount == 0:
+            return self._claim_next()
+        return self.get_job(row["id"])
+
+    def _next_wait(self) -> float:
+        """距离下一个等待重试的任务可执行还有多久"""
+        row = self._get_connection().execute(
+            "SELECT MIN(available_at) FROM ingest_jobs WHERE status = ?", (PENDING,)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return 30.0
+        return min(max(row[0] - time.time(), 0.1), 30.0)
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self._claim_next()
+                if job is None:
+                    self._wakeup.wait(self._next_wait())
+                    self._wakeup.clear()
+                    continue
+                self._run_job(job)
+            except Exception as e:
+                print(f"入库工作线程出错: {str(e)}")
+                traceback.print_exc()
+                time.sleep(1)
+
+    def _knowledge_base_for(self, job: Dict):
+        """任务写入的知识库：分区知识库按任务的分区取对应的 KnowledgeBase"""
+        if isinstance(self.knowledge_base, KnowledgeBaseShards):
+            return self.knowledge_base.get(job.get("namespace") or DEFAULT_NAMESPACE)
+        return self.knowledge_base
+
+    def _run_job(self, job: Dict):
+        job_id = job["id"]
+        knowledge_base = self._knowledge_base_for(job)
+        conn = self._get_connection()
+        print(f"开始处理入库任务 {job_id}: {job['filename']}（第 {job['attempts']} 次）")
+
+        def on_progress(chunks: int):
+            row = conn.execute("SELECT cancel_requested FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+            if row and row[0]:
+                raise JobCancelled()
+            conn.execute(
+                "UPDATE ingest_jobs SET progress = ?, message = ?, updated_at = ? WHERE id = ?",
+                (chunks, f"已写入 {chunks} 个文档块", time.time(), job_id)
+            )
+            conn.commit()
+
+        # 本次入库的统计和失败原因由回调传回，不读取知识库实例上会被并发任务覆盖的 last_ingest_stats/last_error
+        result = {"stats": {}, "error": None}
+
+        def on_result(stats: Dict, error: Optional[str]):
+            result.update(stats=stats, error=error)
+
+        success = knowledge_base.add_document(job["file_path"], progress_callback=on_progress,
+                                              result_callback=on_result)
+        cancelled = conn.execute(
+            "SELECT cancel_requested FROM ingest_jobs WHERE id = ?", (job_id,)
+        ).fetchone()[0]
+
+        if success:
+            if self.database is not None:
+                self.database.add_knowledge_file(job["filename"], job["file_path"])
+            stats = result["stats"]
+            if stats.get("unchanged"):
+                message = f"内容未变化，已有 {stats.get('chunks', 0)} 个文档块"
+            else:
+                message = f"完成，共 {stats.get('chunks', job.get('progress', 0))} 个文档块"
+            self._finish(job_id, SUCCEEDED, message, stats=stats)
+        elif cancelled:
+            self._finish(job_id, CANCELLED, "已取消")
+        else:
+            error = result["error"] or "入库失败"
+            if job["attempts"] < job["max_attempts"]:
+                delay = self.retry_delay * job["attempts"]
+                conn.execute('''
+                    UPDATE ingest_jobs SET status = ?, error = ?, message = ?, owner = NULL, available_at = ?, updated_at = ?
+                    WHERE id = ?
+                ''', (PENDING, error, f"失败，{delay:.0f} 秒后重试", time.time() + delay, time.time(), job_id))
+                conn.commit()
+                print(f"入库任务 {job_id} 失败，将重试: {error}")
+            else:
+                self._finish(job_id, FAILED, "失败", error=error)
+                print(f"入库任务 {job_id} 失败: {error}")
+
+    def _finish(self, job_id: int, status: str, message: str, error: Optional[str] = None,
+                stats: Optional[Dict] = None):
+        conn = self._get_connection()
+        conn.execute('''
+            UPDATE ingest_jobs SET status = ?, message = ?, error = COALESCE(?, error), stats = ?,
+                finished_at = CURRENT_TIMESTAMP, updated_at = ?
+            WHERE id = ?
+        ''', (status, message, error, json.dumps(stats, ensure_ascii=False) if stats else None, time.time(), job_id))
+        conn.commit()
@@ -0,0 +1,622 @@
+# backend/kb_benchmark.py
+"""
+知识库基准测试
+
+切分方式对比：对同一批文件分别用不同的切分器建立临时知识库，
+统计文档块数量、索引大小、入库耗时、查询耗时和标注查询集上的 recall@k。
+
+查询集为JSON列表，每条查询给出答案中必须出现的文本片段（与切分方式无关）：
+    [{"query": "登录失败几次锁定账号", "answers": ["失败三次后锁定"], "source": "需求.docx"}]
+检索结果的前k个文档块中任意一个包含任一答案片段（且来源匹配，如果指定了source）即视为命中。
+
+检索性能：按指定规模（10³–10⁶个文档块）生成语料，对每种索引配置测量入库吞吐、索引发布和加载耗时、
+内存占用，以及 search / search_with_score 的p50/p95查询延迟和 recall@k。语料有两种：
+    synthetic  合成的测试领域文本，每个文档块带唯一的记录编号，查询由文档块中的词语打乱生成，
+               找回带该编号的文档块即为命中
+    sample     解析 data/knowledge_base/files 中的文件得到样本文档块，按需复制到目标规模，
+               查询取文档块中间的一段文字，找回包含该段文字的文档块即为命中
+--embedding hash 使用不加载模型的哈希编码器，只测量索引和检索本身的开销，适合10⁵以上的规模。
+结果写入JSON（包含当前提交号），compare 子命令对比两次结果，延迟或召回率退化时返回非零退出码。
+
+用法：
+    python -m backend.kb_benchmark chunking --files 需求.docx 用例.xlsx --queries queries.json \\
+        --chunkers recursive sentence heading token --k 5 --output chunking.json
+    python -m backend.kb_benchmark retrieval --corpus synthetic sample --scales 1000 10000 100000 \\
+        --metrics l2 cosine --modes vector hybrid --embedding hash --output retrieval.json
+    python -m backend.kb_benchmark compare baseline.json retrieval.json --latency-tolerance 0.2
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from .chunkers import CHUNKERS
+from .embedding_service import EmbeddingService
+from .knowledge_base import KnowledgeBase
+
+CORPORA = ("synthetic", "sample")
+DEFAULT_SAMPLE_DIR = os.path.join("data", "knowledge_base", "files")
+
+
+def load_queries(path: str) -> List[Dict]:
+    """读取标注查询集"""
+    with open(path, 'r', encoding='utf-8') as f:
+        queries = json.load(f)
+    for item in queries:
+        if isinstance(item.get("answers"), str):
+            item["answers"] = [item["answers"]]
+    return queries
+
+
+def _normalize(text: str) -> str:
+    # 不同切分方式对换行和空格的处理不同，比较前去掉空白
+    return "".join(text.split())
+
+
+def is_hit(content: str, metadata: Dict, item: Dict) -> bool:
+    """文档块是否包含查询的答案"""
+    if item.get("source") and metadata.get("source") != item["source"]:
+        return False
+    normalized = _normalize(content)
+    return any(_normalize(answer) in normalized for answer in item.get("answers", []))
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def evaluate_recall(kb: KnowledgeBase, queries: Sequence[Dict], k: int = 5, mode: str = "vector") -> Dict:
+    """在标注查询集上计算 recall@k、MRR 和查询耗时"""
+    hits = 0
+    reciprocal_ranks = []
+    latencies = []
+    for item in queries:
+        start_time = time.perf_counter()
+        results = kb.search_with_score(item["query"], k=k, mode=mode)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        rank = next((i + 1 for i, (content, metadata, _) in enumerate(results)
+                     if is_hit(content, metadata, item)), None)
+        if rank:
+            hits += 1
+            reciprocal_ranks.append(1.0 / rank)
+        else:
+            reciprocal_ranks.append(0.0)
+
+    count = len(queries) or 1
+    return {
+        f"recall@{k}": round(hits / count, 4),
+        "mrr": round(sum(reciprocal_ranks) / count, 4),
+        "query_ms_mean": round(statistics.mean(latencies), 2) if latencies else 0.0,
+    }
+
+
+def benchmark_chunking(files: Sequence[str], queries: Sequence[Dict], chunkers: Sequence[str] = None,
+                       k: int = 5, chunk_size: int = 500, chunk_overlap: int = 50, token_size: int = 256,
+                       token_overlap: int = 32, mode: str = "vector", metric: str = "cosine",
+                       work_dir: str = None) -> List[Dict]:
+    """
+    对比不同切分方式
+
+    每种切分方式使用独立的临时知识库目录（含独立的文档库），互不影响。
+    token 切分使用 token_size/token_overlap，其他切分方式使用 chunk_size/chunk_overlap（字符数）。
+    """
+    chunkers = list(chunkers or CHUNKERS)
+    results = []
+    base_dir = work_dir or tempfile.mkdtemp(prefix="kb_benchmark_")
+    try:
+        for name in chunkers:
+            kb_dir = os.path.join(base_dir, name)
+            shutil.rmtree(kb_dir, ignore_errors=True)
+            size, overlap = (token_size, token_overlap) if name == "token" else (chunk_size, chunk_overlap)
+            kb = KnowledgeBase(kb_dir=kb_dir, metric=metric, chunker=name,
+                               chunk_size=size, chunk_overlap=overlap)
+
+            start_time = time.perf_counter()
+            failed = [path for path in files if not kb.add_document(path)]
+            ingest_seconds = time.perf_counter() - start_time
+
+            chunk_count = len(kb._vectorstore.index_to_docstore_id) if kb._vectorstore else 0
+            result = {
+                "chunker": name,
+                "chunk_size": size,
+                "chunk_overlap": overlap,
+                "files": len(files) - len(failed),
+                "failed_files": [os.path.basename(path) for path in failed],
+                "chunks": chunk_count,
+                "index_bytes": _dir_size(kb._store.version_dir(kb._index_version or "")),
+                "docstore_bytes": os.path.getsize(kb.docstore_path) if os.path.exists(kb.docstore_path) else 0,
+                "ingest_seconds": round(ingest_seconds, 3),
+            }
+            result.update(evaluate_recall(kb, queries, k=k, mode=mode))
+            results.append(result)
+            print(f"[{name}] {result}")
+    finally:
+        if work_dir is None:
+            shutil.rmtree(base_dir, ignore_errors=True)
+    return results
+
+
+class HashingEncoder:
+    """
+    不加载模型的确定性编码器
+
+    单字和相邻字对哈希到固定维度后归一化，相同词语较多的文本向量相近。
+    语义能力远不如真实模型，只用于在大规模语料上测量索引和检索本身的开销。
+    """
+
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+
+    def encode(self, texts, batch_size: int = 32, convert_to_numpy: bool = True, show_progress_bar: bool = False):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = "".join(text.split())
+            grams = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+            for gram in grams:
+                vectors[row, zlib.crc32(gram.encode("utf-8")) % self.dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-6)
+
+
+def create_embedding_service(embedding: str = "model", dim: int = 768) -> Optional[EmbeddingService]:
+    """"model" 返回None（使用知识库默认的共享模型），"hash" 返回哈希编码器服务"""
+    if embedding == "model":
+        return None
+    if embedding == "hash":
+        return EmbeddingService(f"benchmark-hash-{dim}", model=HashingEncoder(dim))
+    raise ValueError(f"不支持的嵌入方式: {embedding}，可选: model, hash")
+
+
+# 合成语料的词表：模块、操作、对象、条件和结果
+_MODULES = ["登录", "注册", "支付", "订单", "购物车", "权限", "报表", "审批", "消息", "搜索",
+            "库存", "物流", "优惠券", "会员", "评论", "退款", "发票", "账户", "设置", "导出"]
+_ACTIONS = ["新增", "修改", "删除", "查询", "提交", "撤回", "审核", "导入", "同步", "校验",
+            "锁定", "解锁", "重置", "下载", "上传", "分享", "关注", "取消", "确认", "归档"]
+_OBJECTS = ["用户名", "密码", "验证码", "手机号", "邮箱", "金额", "数量", "地址", "状态", "备注",
+            "图片", "附件", "编号", "日期", "时间段", "角色", "部门", "标签", "等级", "积分"]
+_CONDITIONS = ["为空时", "超过最大长度时", "包含特殊字符时", "格式错误时", "重复提交时", "网络中断时",
+               "并发操作时", "权限不足时", "会话过期时", "数据量较大时", "首次使用时", "跨天时"]
+_RESULTS = ["提示错误信息", "操作成功", "按钮置灰", "跳转到首页", "记录操作日志", "发送通知",
+            "数据回滚", "弹出确认框", "自动重试", "显示加载状态", "保留已填写内容", "刷新列表"]
+
+
+def _record_tag(index: int) -> str:
+    return f"记录编号R{index:07d}"
+
+
+def _synthetic_words(rng: random.Random) -> List[str]:
+    module = rng.choice(_MODULES)
+    words = [f"{module}模块"]
+    for _ in range(rng.randint(2, 4)):
+        words.extend([rng.choice(_ACTIONS), rng.choice(_OBJECTS), rng.choice(_CONDITIONS), rng.choice(_RESULTS)])
+    return words
+
+
+def iter_synthetic_corpus(size: int, query_count: int = 100, batch_size: int = 1000,
+                          seed: int = 42) -> Tuple[List[Dict], Iterator[List[Document]]]:
+    """
+    生成合成语料，返回 (查询集, 文档块批次生成器)
+
+    文档块按批惰性生成，10⁶规模时不会一次性占用内存；查询集在生成到对应文档块时填充，
+    需要在批次全部消费后再使用。
+    """
+    rng = random.Random(seed)
+    targets = set(rng.sample(range(size), min(query_count, size)))
+    queries: List[Dict] = []
+
+    def batches():
+        doc_rng = random.Random(seed + 1)
+        batch = []
+        for index in range(size):
+            words = _synthetic_words(doc_rng)
+            text = "，".join(words[1:])
+            batch.append(Document(
+                page_content=f"{words[0]}：{text}。{_record_tag(index)}",
+                metadata={"source": f"synthetic_{index // 10000:03d}.txt", "chunk_index": index % 10000,
+                          "type": "text_chunk"}
+            ))
+            if index in targets:
+                # 查询取文档块的大部分词语并打乱顺序，不包含记录编号
+                picked = doc_rng.sample(words, max(3, len(words) * 2 // 3))
+                queries.append({"query": "".join(picked), "answers": [_record_tag(index)]})
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    return queries, batches()
+
+
+def load_sample_chunks(files_dir: str = DEFAULT_SAMPLE_DIR, **kb_kwargs) -> List[Document]:
+    """解析样本目录中的文件，返回按知识库规则切分的文档块"""
+    work_dir = tempfile.mkdtemp(prefix="kb_sample_")
+    try:
+        kb = KnowledgeBase(kb_dir=work_dir, **kb_kwargs)
+        chunks = []
+        for name in sorted(os.listdir(files_dir)):
+            path = os.path.join(files_dir, name)
+            if not os.path.isfile(path) or not name.lower().endswith(KnowledgeBase.SUPPORTED_EXTENSIONS):
+                continue
+            try:
+                for batch in kb._iter_document_batches(path):
+                    chunks.extend(batch)
+            except Exception as e:
+                print(f"解析样本文件失败 {name}: {str(e)}")
+        return chunks
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def iter_sample_corpus(chunks: Sequence[Document], size: int, query_count: int = 100, batch_size: int = 1000,
+                       seed: int = 42) -> Tuple[List[Dict], Iterator[List[Document]]]:
+    """把样本文档块循环复制到目标规模，返回 (查询集, 文档块批次生成器)"""
+    if not chunks:
+        raise ValueError("样本目录中没有可用的文档块")
+    rng = random.Random(seed)
+    queries = []
+    candidates = [i for i, doc in enumerate(chunks) if len("".join(doc.page_content.split())) >= 20]
+    for i in rng.sample(candidates, min(query_count, len(candidates))):
+        text = "".join(chunks[i].page_content.split())
+        start = rng.randint(0, max(len(text) - 30, 0))
+        snippet = text[start:start + 30]
+        queries.append({"query": snippet, "answers": [snippet]})
+
+    def batches():
+        batch = []
+        for index in range(size):
+            doc = chunks[index % len(chunks)]
+            copy_number = index // len(chunks)
+            metadata = dict(doc.metadata, copy=copy_number)
+            batch.append(Document(page_content=doc.page_content, metadata=metadata))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    return queries, batches()
+
+
+def _rss_mb() -> Optional[float]:
+    """当前进程常驻内存（MB），没有 psutil 时返回None"""
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / 1024 / 1024, 1)
+    except ImportError:
+        return None
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """进程峰值常驻内存（MB），Windows 上不可用时返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB，macOS 为字节
+    return round(peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _percentile(values: Sequence[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    return round(float(np.percentile(values, percent)), 3)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _ingest(kb: KnowledgeBase, batches: Iterator[List[Document]]) -> Dict:
+    """按 add_document 的流程写入文档块并发布一个版本，返回入库和发布耗时"""
+    with kb._write_transaction() as writer:
+        previous_docstore = writer._vectorstore.docstore if writer._vectorstore else None
+        start_time = time.perf_counter()
+        count = writer._ingest_batches(batches, rebuild=True)
+        ingest_seconds = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        writer._publish_vectorstore()
+        publish_seconds = time.perf_counter() - start_time
+        writer._prune_docstore(previous_docstore)
+    return {
+        "chunks": count,
+        "ingest_seconds": round(ingest_seconds, 3),
+        "chunks_per_sec": round(count / max(ingest_seconds, 1e-6), 1),
+        "publish_seconds": round(publish_seconds, 3),
+    }
+
+
+def _measure_queries(kb: KnowledgeBase, queries: Sequence[Dict], k: int, mode: str) -> Dict:
+    """查询向量已预先缓存，延迟只包含检索本身"""
+    latencies = {"search": [], "search_with_score": []}
+    hits = 0
+    reciprocal_ranks = []
+    for item in queries:
+        start_time = time.perf_counter()
+        results = kb.search_with_score(item["query"], k=k, mode=mode)
+        latencies["search_with_score"].append((time.perf_counter() - start_time) * 1000)
+        start_time = time.perf_counter()
+        kb.search(item["query"], k=k, mode=mode)
+        latencies["search"].append((time.perf_counter() - start_time) * 1000)
+
+        rank = next((i + 1 for i, (content, metadata, _) in enumerate(results)
+                     if is_hit(content, metadata, item)), None)
+        hits += 1 if rank else 0
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    count = len(queries) or 1
+    return {
+        f"recall@{k}": round(hits / count, 4),
+        "mrr": round(sum(reciprocal_ranks) / count, 4),
+        "search_p50_ms": _percentile(latencies["search"], 50),
+        "search_p95_ms": _percentile(latencies["search"], 95),
+        "score_p50_ms": _percentile(latencies["search_with_score"], 50),
+        "score_p95_ms": _percentile(latencies["search_with_score"], 95),
+    }
+
+
+def benchmark_retrieval(corpora: Sequence[str] = ("synthetic",), scales: Sequence[int] = (1000,),
+                        metrics: Sequence[str] = ("cosine",), modes: Sequence[str] = ("vector",),
+                        k: int = 5, query_count: int = 100, embedding: str = "model", dim: int = 768,
+                        files_dir: str = DEFAULT_SAMPLE_DIR, batch_size: int = 1000, mmap_index: bool = True,
+                        seed: int = 42, work_dir: str = None, chunker: str = "recursive", chunk_size: int = 500,
+                        chunk_overlap: int = 50) -> List[Dict]:
+    """
+    检索性能基准
+
+    每个 (语料, 规模, 度量) 组合使用独立的临时知识库目录：写入语料并发布版本后，
+    用新的知识库实例加载已发布的索引（与应用中其他会话的读取方式相同），再按各检索模式执行查询。
+    每种检索模式输出一行结果。
+    sample 语料用同一个嵌入服务和切分设置解析，哈希编码模式下不加载嵌入模型。
+    """
+    embedding_service = create_embedding_service(embedding, dim)
+    chunk_kwargs = dict(chunker=chunker, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    sample_chunks = load_sample_chunks(
+        files_dir, embedding_service=embedding_service, dedup=False, metric=metrics[0], **chunk_kwargs
+    ) if "sample" in corpora else []
+    results = []
+    base_dir = work_dir or tempfile.mkdtemp(prefix="kb_benchmark_")
+    try:
+        for corpus in corpora:
+            for scale in scales:
+                for metric in metrics:
+                    kb_dir = os.path.join(base_dir, f"{corpus}_{scale}_{metric}")
+                    shutil.rmtree(kb_dir, ignore_errors=True)
+                    kb_kwargs = dict(metric=metric, dedup=False, ingest_batch_size=batch_size,
+                                     mmap_index=mmap_index, embedding_service=embedding_service, **chunk_kwargs)
+                    if corpus == "synthetic":
+                        queries, batches = iter_synthetic_corpus(scale, query_count, batch_size, seed)
+                    else:
+                        queries, batches = iter_sample_corpus(sample_chunks, scale, query_count, batch_size, seed)
+
+                    rss_before = _rss_mb()
+                    writer_kb = KnowledgeBase(kb_dir=kb_dir, **kb_kwargs)
+                    ingest = _ingest(writer_kb, batches)
+                    del writer_kb
+
+                    start_time = time.perf_counter()
+                    kb = KnowledgeBase(kb_dir=kb_dir, **kb_kwargs)
+                    load_seconds = time.perf_counter() - start_time
+                    kb._query_cache.clear()
+                    start_time = time.perf_counter()
+                    for item in queries:
+                        kb._embed_query(item["query"])
+                    embed_ms = (time.perf_counter() - start_time) * 1000 / max(len(queries), 1)
+                    rss_after = _rss_mb()
+
+                    base = {
+                        "corpus": corpus,
+                        "scale": scale,
+                        "metric": metric,
+                        "embedding": embedding,
+                        **ingest,
+                        "load_seconds": round(load_seconds, 3),
+                        "index_bytes": _dir_size(kb._store.version_dir(kb._index_version or "")),
+                        "docstore_bytes": os.path.getsize(kb.docstore_path) if os.path.exists(kb.docstore_path) else 0,
+                        "rss_mb": rss_after,
+                        "rss_delta_mb": round(rss_after - rss_before, 1) if rss_after is not None and rss_before is not None else None,
+                        "peak_rss_mb": _peak_rss_mb(),
+                        "queries": len(queries),
+                        "query_embed_ms": round(embed_ms, 3),
+                    }
+                    for mode in modes:
+                        row = dict(base, mode=mode)
+                        row.update(_measure_queries(kb, queries, k, mode))
+                        results.append(row)
+                        print(f"[{corpus} {scale} {metric} {mode}] {row}")
+                    del kb
+                    if work_dir is None:
+                        shutil.rmtree(kb_dir, ignore_errors=True)
+    finally:
+        if work_dir is None:
+            shutil.rmtree(base_dir, ignore_errors=True)
+    return results
+
+
+def _row_key(row: Dict) -> Tuple:
+    return tuple(row.get(key) for key in ("corpus", "scale", "metric", "mode", "embedding"))
+
+
+def compare_results(baseline: Dict, current: Dict, latency_tolerance: float = 0.2,
+                    recall_tolerance: float = 0.01, min_latency_delta_ms: float = 0.5) -> Tuple[List[Dict], List[str]]:
+    """
+    对比两次检索基准结果，返回 (对比行, 退化说明)
+
+    p95延迟增加超过 latency_tolerance（比例）或 recall@k 下降超过 recall_tolerance（绝对值）视为退化；
+    亚毫秒级的延迟抖动较大，增加不足 min_latency_delta_ms 时忽略。
+    """
+    k = current.get("k", baseline.get("k"))
+    recall_key = f"recall@{k}"
+    baseline_rows = {_row_key(row): row for row in baseline.get("results", [])}
+    rows, regressions = [], []
+    for row in current.get("results", []):
+        old = baseline_rows.get(_row_key(row))
+        if old is None:
+            continue
+        name = " ".join(str(value) for value in _row_key(row)[:4])
+        compared = {"config": name}
+        for metric in ("search_p95_ms", "score_p95_ms", "chunks_per_sec", "load_seconds", recall_key):
+            before, after = old.get(metric), row.get(metric)
+            compared[f"{metric}_base"] = before
+            compared[metric] = after
+            if before is None or after is None:
+                continue
+            if (metric.endswith("_p95_ms") and after > before * (1 + latency_tolerance)
+                    and after - before >= min_latency_delta_ms):
+                regressions.append(f"{name}: {metric} {before} -> {round(after, 4)}")
+            if metric == recall_key and after < before - recall_tolerance:
+                regressions.append(f"{name}: {metric} {before} -> {round(after, 4)}")
+        rows.append(compared)
+    return rows, regressions
+
+
+def format_table(rows: List[Dict], columns: Sequence[str] = None) -> str:
+    """把结果格式化为对齐的文本表格"""
+    if not rows:
+        return ""
+    columns = list(columns or [key for key in rows[0] if not isinstance(rows[0][key], (list, dict))])
+    widths = {col: max(len(str(col)), *(len(str(row.get(col, ""))) for row in rows)) for col in columns}
+    lines = ["  ".join(str(col).ljust(widths[col]) for col in columns)]
+    lines.append("  ".join("-" * widths[col] for col in columns))
+    for row in rows:
+        lines.append("  ".join(str(row.get(col, "")).ljust(widths[col]) for col in columns))
+    return "\n".join(lines)
+
+
+def _write_output(path: str, payload: Dict):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到: {path}")
+
+
+def _load_json(path: str) -> Dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="知识库基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    chunking = subparsers.add_parser("chunking", help="对比不同切分方式")
+    chunking.add_argument("--files", nargs="+", required=True, help="参与测试的知识库文件")
+    chunking.add_argument("--queries", required=True, help="标注查询集JSON文件")
+    chunking.add_argument("--chunkers", nargs="+", default=list(CHUNKERS), choices=list(CHUNKERS))
+    chunking.add_argument("--k", type=int, default=5)
+    chunking.add_argument("--chunk-size", type=int, default=500)
+    chunking.add_argument("--chunk-overlap", type=int, default=50)
+    chunking.add_argument("--token-size", type=int, default=256)
+    chunking.add_argument("--token-overlap", type=int, default=32)
+    chunking.add_argument("--mode", default="vector", choices=list(KnowledgeBase.RETRIEVAL_MODES))
+    chunking.add_argument("--metric", default="cosine", choices=list(KnowledgeBase.METRICS))
+    chunking.add_argument("--output", help="结果JSON文件")
+
+    retrieval = subparsers.add_parser("retrieval", help="检索性能和召回率")
+    retrieval.add_argument("--corpus", nargs="+", default=["synthetic"], choices=list(CORPORA))
+    retrieval.add_argument("--scales", nargs="+", type=int, default=[1000, 10000], help="文档块数量，如 1000 100000 1000000")
+    retrieval.add_argument("--metrics", nargs="+", default=["l2", "cosine"], choices=list(KnowledgeBase.METRICS))
+    retrieval.add_argument("--modes", nargs="+", default=["vector"], choices=list(KnowledgeBase.RETRIEVAL_MODES))
+    retrieval.add_argument("--k", type=int, default=5)
+    retrieval.add_argument("--queries", type=int, default=100, help="每个配置的查询数量")
+    retrieval.add_argument("--embedding", default="model", choices=["model", "hash"])
+    retrieval.add_argument("--dim", type=int, default=768, help="哈希编码器的向量维度")
+    retrieval.add_argument("--files-dir", default=DEFAULT_SAMPLE_DIR, help="sample 语料的样本文件目录")
+    retrieval.add_argument("--batch-size", type=int, default=1000)
+    retrieval.add_argument("--chunker", default="recursive", choices=list(CHUNKERS), help="sample 语料的切分方式")
+    retrieval.add_argument("--chunk-size", type=int, default=500)
+    retrieval.add_argument("--chunk-overlap", type=int, default=50)
+    retrieval.add_argument("--no-mmap", action="store_true", help="读取索引时不使用内存映射")
+    retrieval.add_argument("--seed", type=int, default=42)
+    retrieval.add_argument("--work-dir", help="保留生成的知识库目录")
+    retrieval.add_argument("--label", help="结果标签，如分支名")
+    retrieval.add_argument("--output", help="结果JSON文件")
+
+    compare = subparsers.add_parser("compare", help="对比两次检索基准结果")
+    compare.add_argument("baseline", help="基准结果JSON")
+    compare.add_argument("current", help="当前结果JSON")
+    compare.add_argument("--latency-tolerance", type=float, default=0.2, help="允许的p95延迟增加比例")
+    compare.add_argument("--recall-tolerance", type=float, default=0.01, help="允许的召回率下降")
+    compare.add_argument("--min-latency-delta", type=float, default=0.5, help="忽略小于该值（毫秒）的延迟增加")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "chunking":
+        queries = load_queries(args.queries)
+        rows = benchmark_chunking(
+            args.files, queries, chunkers=args.chunkers, k=args.k,
+            chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+            token_size=args.token_size, token_overlap=args.token_overlap,
+            mode=args.mode, metric=args.metric
+        )
+        print(format_table(rows))
+        if args.output:
+            _write_output(args.output, {"benchmark": "chunking", "k": args.k, "results": rows})
+
+    elif args.command == "retrieval":
+        rows = benchmark_retrieval(
+            corpora=args.corpus, scales=args.scales, metrics=args.metrics, modes=args.modes, k=args.k,
+            query_count=args.queries, embedding=args.embedding, dim=args.dim, files_dir=args.files_dir,
+            batch_size=args.batch_size, mmap_index=not args.no_mmap, seed=args.seed, work_dir=args.work_dir,
+            chunker=args.chunker, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
+        )
+        print(format_table(rows, ["corpus", "scale", "metric", "mode", "chunks_per_sec", "publish_seconds",
+                                  "load_seconds", "rss_mb", f"recall@{args.k}", "search_p50_ms",
+                                  "search_p95_ms", "score_p50_ms", "score_p95_ms"]))
+        if args.output:
+            _write_output(args.output, {
+                "benchmark": "retrieval",
+                "commit": _git_commit(),
+                "label": args.label,
+                "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                                "faiss": getattr(faiss, "__version__", None)},
+                "k": args.k,
+                "settings": {key: value for key, value in vars(args).items() if key not in ("command", "output")},
+                "results": rows,
+            })
+
+    elif args.command == "compare":
+        baseline, current = _load_json(args.baseline), _load_json(args.current)
+        rows, regressions = compare_results(baseline, current, args.latency_tolerance,
+                                             args.recall_tolerance, args.min_latency_delta)
+        print(f"基准: {baseline.get('commit')}  当前: {current.get('commit')}")
+        print(format_table(rows))
+        if regressions:
+            print("检测到性能退化:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("未检测到性能退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# backend/kb_shards.py
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .knowledge_base import KnowledgeBase
+
+DEFAULT_NAMESPACE = "default"
+NAMESPACES_DIR = "namespaces"
+_NAMESPACE_PATTERN = re.compile(r'^[\w\-\u4e00-\u9fa5]{1,64}$')
+
+
+class KnowledgeBaseShards:
+    """
+    按命名空间（产品线）分区的知识库
+
+    目录结构：
+        kb_dir/                       默认分区（即原有的单一知识库，目录不变）
+        kb_dir/namespaces/<名称>/     其他分区，各自有 files/ 和 faiss_index/（独立的索引版本和清单）
+    所有分区共用同一个数据库，文档块按命名空间隔离。
+    写入只重写目标分区的索引；搜索可以限定分区，也可以并行查询多个分区后合并前k个结果。
+    不同分区可能使用不同的向量度量，合并时统一换算为相似度后排序。
+    """
+
+    def __init__(self, kb_dir="E:/sm-ai/data/knowledge_base", db_path=None, max_workers: int = 4, **kb_kwargs):
+        self.kb_dir = os.path.normpath(kb_dir)
+        self.db_path = db_path
+        self.kb_kwargs = kb_kwargs  # 创建各分区 KnowledgeBase 时使用的其他参数
+        self.max_workers = max(1, max_workers)
+        self._shards: Dict[str, KnowledgeBase] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        os.makedirs(os.path.join(self.kb_dir, NAMESPACES_DIR), exist_ok=True)
+
+    def namespace_dir(self, namespace: str) -> str:
+        if namespace == DEFAULT_NAMESPACE:
+            return self.kb_dir
+        return os.path.join(self.kb_dir, NAMESPACES_DIR, namespace)
+
+    @staticmethod
+    def _check_namespace(namespace: str):
+        if not namespace or not _NAMESPACE_PATTERN.match(namespace):
+            raise ValueError(f"无效的分区名称: {namespace}（只能包含中文、字母、数字、下划线和连字符）")
+
+    def namespaces(self) -> List[str]:
+        """列出所有分区，默认分区排在最前"""
+        names = [DEFAULT_NAMESPACE]
+        root = os.path.join(self.kb_dir, NAMESPACES_DIR)
+        if os.path.isdir(root):
+            names.extend(sorted(
+                name for name in os.listdir(root)
+                if os.path.isdir(os.path.join(root, name)) and _NAMESPACE_PATTERN.match(name)
+                and name != DEFAULT_NAMESPACE
+            ))
+        return names
+
+    def get(self, namespace: str = DEFAULT_NAMESPACE) -> KnowledgeBase:
+        """获取（必要时创建）分区对应的知识库"""
+        self._check_namespace(namespace)
+        shard = self._shards.get(namespace)
+        if shard is None:
+            with self._lock:
+                shard = self._shards.get(namespace)
+                if shard is None:
+                    shard = KnowledgeBase(kb_dir=self.namespace_dir(namespace), db_path=self.db_path,
+                                          namespace=namespace, **self.kb_kwargs)
+                    self._shards[namespace] = shard
+        return shard
+
+    def create_namespace(self, namespace: str) -> KnowledgeBase:
+        """创建新分区（已存在时直接返回）"""
+        return self.get(namespace)
+
+    def add_document(self, file_path: str, namespace: str = DEFAULT_NAMESPACE, progress_callback=None,
+                     result_callback=None) -> bool:
+        """把文件加入指定分区，只重写该分区的索引"""
+        return self.get(namespace).add_document(file_path, progress_callback=progress_callback,
+                                                result_callback=result_callback)
+
+    def rebuild_index(self, namespace: str = DEFAULT_NAMESPACE) -> bool:
+        return self.get(namespace).rebuild_index()
+
+    def sync_files(self, namespace: str = DEFAULT_NAMESPACE, settle_seconds: float = 2.0, skip_files=()) -> Dict:
+        """增量同步分区的文件目录，见 KnowledgeBase.sync_files"""
+        return self.get(namespace).sync_files(settle_seconds=settle_seconds, skip_files=skip_files)
+
+    def get_index_status(self, namespace: Optional[str] = None) -> Dict:
+        """指定分区时返回该分区状态，否则返回 {分区: 状态}"""
+        if namespace:
+            return self.get(namespace).get_index_status()
+        return {name: self.get(name).get_index_status() for name in self.namespaces()}
+
+    def _resolve(self, namespaces: Optional[Sequence[str]]) -> List[str]:
+        if namespaces is None:
+            return self.namespaces()
+        if isinstance(namespaces, str):
+            namespaces = [namespaces]
+        return list(dict.fromkeys(namespaces))
+
+    def _fan_out(self, namespaces: List[str], query: str, call) -> List[Tuple[str, List]]:
+        """在各分区上并行执行查询，返回 [(分区, 结果)]，单个分区失败不影响其他分区"""
+        shards = [(name, self.get(name)) for name in namespaces]
+        if not shards:
+            return []
+        # 查询向量只计算一次，各分区命中共享的查询向量缓存
+        shards[0][1]._embed_query(query)
+
+        def run(item):
+            name, shard = item
+            try:
+                return name, call(shard)
+            except Exception as e:
+                print(f"分区 {name} 搜索失败: {str(e)}")
+                return name, []
+
+        if len(shards) == 1:
+            return [run(shards[0])]
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix="kb-shard")
+        return list(self._executor.map(run, shards))
+
+    def search_with_score(self, query: str, k: int = 10, namespaces: Optional[Sequence[str]] = None,
+                          mode: str = "vector", metadata_filter: Dict = None) -> List[Tuple[str, Dict, float]]:
+        """
+        在多个分区中搜索并合并前k个结果
+
+        Returns:
+            [(内容, 元数据, 分区内的原始分数)]，元数据中附带 namespace 和换算后的 similarity(0-100)，
+            结果按 similarity 从高到低排列
+        """
+        merged = []
+        for name, results in self._fan_out(
+            self._resolve(namespaces), query,
+            lambda shard: [
+                (content, metadata, score, shard.get_similarity_percentage(score))
+                for content, metadata, score in shard.search_with_score(
+                    query, k=k, mode=mode, metadata_filter=metadata_filter
+                )
+            ]
+        ):
+            for content, metadata, score, similarity in results:
+                merged.append((content, dict(metadata, namespace=name, similarity=similarity), score))
+        merged.sort(key=lambda item: item[1]["similarity"], reverse=True)
+        return merged[:k]
+
+    def search(self, query: str, k: int = 5, namespaces: Optional[Sequence[str]] = None,
+               mode: str = "vector", metadata_filter: Dict = None) -> List[Tuple[str, Dict]]:
+        """与 KnowledgeBase.search 相同，结果来自所选分区合并后的前k个"""
+        return [(content, metadata) for content, metadata, _ in
+                self.search_with_score(query, k=k, namespaces=namespaces, mode=mode,
+                                       metadata_filter=metadata_filter)]
+
+    def search_by_threshold(self, query: str, min_similarity: float = 0.3, k: int = 10,
+                            namespaces: Optional[Sequence[str]] = None,
+                            metadata_filter: Dict = None) -> List[Tuple[str, Dict, float]]:
+        """各分区分别按阈值搜索，合并后返回相似度最高的k个 [(内容, 元数据, 相似度(0-1))]"""
+        merged = []
+        for name, results in self._fan_out(
+            self._resolve(namespaces), query,
+            lambda shard: shard.search_by_threshold(query, min_similarity=min_similarity, k=k,
+                                                    metadata_filter=metadata_filter)
+        ):
+            merged.extend((content, dict(metadata, namespace=name), similarity)
+                          for content, metadata, similarity in results)
+        merged.sort(key=lambda item: item[2], reverse=True)
+        return merged[:k]
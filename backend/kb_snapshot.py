@@ -0,0 +1,421 @@
+# backend/kb_snapshot.py
+"""
+知识库快照导出/导入
+
+快照是单个tar文件（可选gzip/xz压缩），按顺序包含：
+    snapshot.json           格式版本、命名空间、嵌入模型、度量、向量维度、文档块数量等
+    index/                  当前索引版本目录中的全部文件（向量、ID映射、清单、关键词倒排表等）
+    docstore/NNNNNN.jsonl   文档块（每行 [向量ID, 来源, 内容, 元数据JSON]），每个分片不超过5000行
+    files/                  知识库原始文件（可选）
+导出和导入都是流式的：向量文件和原始文件逐个写入/读出，文档块按分片读写，内存占用与知识库大小无关。
+导入时向量不需要重新计算：索引文件解压到新版本的临时目录，文档块写入数据库后原子发布，
+之后与正常发布的版本一样以内存映射方式加载，正在运行的应用在下一次搜索时自动切换。
+
+导入前检查快照的嵌入模型与目标知识库一致，不一致时拒绝导入（向量不可比较）。
+索引附加数据使用pickle保存，只导入可信来源的快照。
+
+用法：
+    python -m backend.kb_snapshot export kb.kbsnap --kb-dir data/knowledge_base --db data/testcase.db --compress gz
+    python -m backend.kb_snapshot import kb.kbsnap --kb-dir data/knowledge_base --db data/testcase.db
+    python -m backend.kb_snapshot info kb.kbsnap
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+import tarfile
+import time
+import uuid
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+import faiss
+
+from .docstore import SQLiteDocstore
+from .index_store import EXTRA_SUFFIX, MANIFEST_FILE, IndexStore, _mmap_flags
+from .kb_shards import DEFAULT_NAMESPACE, NAMESPACES_DIR
+from .knowledge_base import KnowledgeBase
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_INFO = "snapshot.json"
+COMPRESSIONS = ("", "gz", "xz")
+DOCSTORE_PART_ROWS = 5000
+INDEX_FILES = ("index.faiss", "index.pkl", MANIFEST_FILE)
+
+
+def _layout(kb_dir: str, db_path: Optional[str] = None) -> Tuple[str, str, str]:
+    """与 KnowledgeBase 相同的目录布局：(索引目录, 原始文件目录, 文档库路径)"""
+    kb_dir = os.path.normpath(kb_dir)
+    return (os.path.join(kb_dir, "faiss_index"), os.path.join(kb_dir, "files"),
+            db_path or os.path.join(kb_dir, "docstore.db"))
+
+
+def namespace_kb_dir(kb_dir: str, namespace: str = DEFAULT_NAMESPACE) -> str:
+    """分区知识库的目录，与 KnowledgeBaseShards.namespace_dir 一致"""
+    if namespace == DEFAULT_NAMESPACE:
+        return os.path.normpath(kb_dir)
+    return os.path.join(os.path.normpath(kb_dir), NAMESPACES_DIR, namespace)
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _iter_docstore_parts(docstore, index_to_docstore_id: Dict) -> Iterator[List]:
+    """按分片读出索引引用的文档块"""
+    if isinstance(docstore, SQLiteDocstore):
+        yield from docstore.iter_rows(DOCSTORE_PART_ROWS)
+        return
+    # 旧格式：文档块保存在pickle的InMemoryDocstore中
+    part = []
+    for docstore_id in index_to_docstore_id.values():
+        doc = docstore.search(docstore_id)
+        if isinstance(doc, str):
+            continue
+        part.append((docstore_id, doc.metadata.get("source"), doc.page_content,
+                     json.dumps(doc.metadata, ensure_ascii=False, default=str)))
+        if len(part) >= DOCSTORE_PART_ROWS:
+            yield part
+            part = []
+    if part:
+        yield part
+
+
+def export_snapshot(output: Union[str, BinaryIO], kb_dir: str, db_path: Optional[str] = None,
+                    namespace: str = DEFAULT_NAMESPACE, compression: str = "",
+                    include_files: bool = True) -> Dict:
+    """
+    把知识库当前发布的索引版本导出为单个快照文件
+
+    只读取已发布且不会再修改的版本目录，导出期间知识库可以继续读写。
+
+    Args:
+        output: 快照文件路径或可写的二进制文件对象
+        kb_dir: 知识库目录（分区知识库为分区目录）
+        db_path: 文档块所在的数据库，未指定时使用知识库目录下的 docstore.db
+        namespace: 文档块所属的命名空间
+        compression: ""（不压缩）、"gz" 或 "xz"
+        include_files: 是否包含原始文件
+
+    Returns:
+        快照信息（snapshot.json 的内容）
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"不支持的压缩方式: {compression}，可选: {', '.join(c or '(无)' for c in COMPRESSIONS)}")
+    index_path, files_dir, docstore_path = _layout(kb_dir, db_path)
+    store = IndexStore(index_path)
+    version = store.current_version()
+    if version is None:
+        raise ValueError(f"知识库还没有索引，无法导出: {kb_dir}")
+
+    start_time = time.time()
+    folder = store.version_dir(version)
+    index = faiss.read_index(os.path.join(folder, "index.faiss"), _mmap_flags())
+    with open(os.path.join(folder, "index.pkl"), 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    if isinstance(docstore, SQLiteDocstore):
+        docstore.bind(docstore_path)
+    manifest = {}
+    if os.path.exists(os.path.join(folder, MANIFEST_FILE)):
+        with open(os.path.join(folder, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    index_files = sorted(name for name in os.listdir(folder)
+                         if name in INDEX_FILES or name.endswith(EXTRA_SUFFIX))
+    files = []
+    if include_files and os.path.isdir(files_dir):
+        files = sorted(name for name in os.listdir(files_dir) if os.path.isfile(os.path.join(files_dir, name)))
+
+    info = {
+        "format": SNAPSHOT_FORMAT,
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "namespace": getattr(docstore, "namespace", namespace),
+        "build_id": getattr(docstore, "build_id", None),
+        "index_version": version,
+        "embedding_model": manifest.get("embedding_model", KnowledgeBase.EMBEDDING_MODEL),
+        "embedding_backend": manifest.get("embedding_backend"),
+        "metric": manifest.get("metric", "l2"),
+        "dimension": index.d,
+        "chunk_count": len(index_to_docstore_id),
+        "index_files": index_files,
+        "files": files,
+    }
+    del index
+
+    target = output
+    tmp_path = None
+    if isinstance(output, str):
+        tmp_path = f"{output}.{os.getpid()}.tmp"
+        target = open(tmp_path, 'wb')
+    try:
+        with tarfile.open(fileobj=target, mode="w|" + compression) as tar:
+            _add_bytes(tar, SNAPSHOT_INFO, json.dumps(info, ensure_ascii=False, indent=2).encode("utf-8"))
+            for name in index_files:
+                tar.add(os.path.join(folder, name), arcname=f"index/{name}")
+            rows = 0
+            for part_number, part in enumerate(_iter_docstore_parts(docstore, index_to_docstore_id)):
+                data = "\n".join(json.dumps(list(row), ensure_ascii=False) for row in part).encode("utf-8")
+                _add_bytes(tar, f"docstore/{part_number:06d}.jsonl", data)
+                rows += len(part)
+            for name in files:
+                tar.add(os.path.join(files_dir, name), arcname=f"files/{name}")
+        if tmp_path:
+            target.close()
+            os.replace(tmp_path, output)
+    except Exception:
+        if tmp_path:
+            target.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+
+    print(f"已导出知识库快照：{info['chunk_count']} 个向量、{rows} 个文档块、{len(files)} 个文件，"
+          f"耗时 {time.time() - start_time:.2f} 秒")
+    return info
+
+
+def read_snapshot_info(source: Union[str, BinaryIO]) -> Dict:
+    """只读取快照开头的 snapshot.json，不解压其余内容"""
+    fileobj = open(source, 'rb') if isinstance(source, str) else source
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+            for member in tar:
+                if member.name == SNAPSHOT_INFO:
+                    return json.load(tar.extractfile(member))
+                break
+    finally:
+        if isinstance(source, str):
+            fileobj.close()
+    raise ValueError("快照格式错误：缺少 snapshot.json")
+
+
+def _check_snapshot(info: Dict, expected_model: Optional[str]):
+    if info.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"不支持的快照格式版本: {info.get('format')}")
+    if expected_model and info.get("embedding_model") != expected_model:
+        raise ValueError(
+            f"快照的嵌入模型 {info.get('embedding_model')} 与目标知识库的 {expected_model} 不一致，"
+            f"向量不能直接使用，请在目标环境重建索引"
+        )
+
+
+def _safe_member_name(name: str) -> str:
+    """快照成员只取文件名，防止路径穿越"""
+    base = os.path.basename(name)
+    if not base or base in (".", ".."):
+        raise ValueError(f"快照中包含无效的文件名: {name}")
+    return base
+
+
+def import_snapshot(source: Union[str, BinaryIO], kb_dir: str, db_path: Optional[str] = None,
+                    namespace: str = DEFAULT_NAMESPACE, include_files: bool = True, database=None,
+                    expected_model: Optional[str] = KnowledgeBase.EMBEDDING_MODEL) -> Dict:
+    """
+    导入快照并发布为知识库的新版本，不重新计算向量
+
+    导入在索引写锁内进行，向量和附加数据解压到新版本的临时目录，文档块写入数据库，
+    全部完成后原子发布；中途失败时已发布的版本不受影响。
+    导入到与快照不同的命名空间时，文档块换用新的向量ID，关键词倒排表和重复内容指纹在首次使用时重新建立。
+
+    Args:
+        source: 快照文件路径或可读的二进制文件对象（可以是不可回退的流）
+        kb_dir: 目标知识库目录（分区知识库为分区目录）
+        db_path: 目标数据库，未指定时使用知识库目录下的 docstore.db
+        namespace: 目标命名空间
+        include_files: 是否恢复原始文件
+        database: 提供时把恢复的原始文件登记到 knowledge_files
+        expected_model: 目标知识库使用的嵌入模型，为None时不检查
+
+    Returns:
+        快照信息，附加导入的版本号 imported_version 和耗时 seconds
+    """
+    index_path, files_dir, docstore_path = _layout(kb_dir, db_path)
+    os.makedirs(files_dir, exist_ok=True)
+    store = IndexStore(index_path)
+    start_time = time.time()
+    fileobj = open(source, 'rb') if isinstance(source, str) else source
+
+    try:
+        with store.writer_lock(), tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+            version, staging_dir = store.create_staging_dir()
+            try:
+                info, rows, restored = _extract_snapshot(tar, version, staging_dir, docstore_path, files_dir,
+                                                         namespace, include_files, expected_model)
+                previous_build = _current_build_id(store)
+                store.publish(version, staging_dir)
+            except Exception:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise
+
+            # 与全量重建相同，保留上一次构建的文档块供仍在读取旧版本的进程使用
+            docstore = SQLiteDocstore(docstore_path, namespace=namespace, build_id=info["imported_build_id"])
+            removed = docstore.prune([previous_build] if previous_build else [])
+            if removed:
+                print(f"已清理 {removed} 个过期文档块")
+    finally:
+        if isinstance(source, str):
+            fileobj.close()
+
+    if database is not None:
+        for name in restored:
+            database.add_knowledge_file(name, os.path.join(files_dir, name))
+
+    elapsed = time.time() - start_time
+    print(f"已导入知识库快照：{info['chunk_count']} 个向量、{rows} 个文档块、{len(restored)} 个文件，"
+          f"发布为版本 {version}，耗时 {elapsed:.2f} 秒")
+    return dict(info, imported_version=version, seconds=round(elapsed, 3))
+
+
+def _current_build_id(store: IndexStore) -> Optional[str]:
+    """当前发布版本使用的文档库构建号"""
+    version = store.current_version()
+    if version is None:
+        return None
+    try:
+        with open(os.path.join(store.version_dir(version), "index.pkl"), 'rb') as f:
+            docstore, _ = pickle.load(f)
+        return getattr(docstore, "build_id", None)
+    except Exception:
+        return None
+
+
+def _extract_snapshot(tar: tarfile.TarFile, version: str, staging_dir: str, docstore_path: str, files_dir: str,
+                      namespace: str, include_files: bool, expected_model: Optional[str]):
+    """按顺序处理快照成员，返回 (快照信息, 文档块数量, 恢复的原始文件)"""
+    info = None
+    docstore = None
+    id_map = None  # 导入到其他命名空间时的 旧向量ID -> 新向量ID
+    manifest = {}
+    rows = 0
+    restored = []
+
+    for member in tar:
+        if not member.isfile():
+            continue
+        f = tar.extractfile(member)
+        if member.name == SNAPSHOT_INFO:
+            info = json.load(f)
+            _check_snapshot(info, expected_model)
+            remap = info.get("namespace") != namespace
+            id_map = {} if remap else None
+            build_id = info.get("build_id") if not remap and info.get("build_id") else uuid.uuid4().hex
+            info["imported_build_id"] = build_id
+            docstore = SQLiteDocstore(docstore_path, namespace=namespace, build_id=build_id)
+            continue
+        if info is None:
+            raise ValueError("快照格式错误：snapshot.json 必须是第一个成员")
+
+        folder, name = os.path.dirname(member.name), _safe_member_name(member.name)
+        if folder == "index":
+            if name == "index.pkl":
+                _write_index_pickle(f, staging_dir, docstore, id_map)
+            elif name == MANIFEST_FILE:
+                manifest = json.load(f)
+            elif name.endswith(EXTRA_SUFFIX) and id_map is not None:
+                # 附加数据按向量ID索引，换用新ID后不能直接使用
+                continue
+            else:
+                with open(os.path.join(staging_dir, name), 'wb') as out:
+                    shutil.copyfileobj(f, out, 1024 * 1024)
+        elif folder == "docstore":
+            part = [json.loads(line) for line in f.read().decode("utf-8").splitlines() if line.strip()]
+            if id_map is not None:
+                for row in part:
+                    row[0] = id_map.setdefault(row[0], str(uuid.uuid4()))
+            docstore.add_rows(part)
+            rows += len(part)
+        elif folder == "files" and include_files:
+            tmp_file = os.path.join(files_dir, f".{name}.{os.getpid()}.tmp")
+            with open(tmp_file, 'wb') as out:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+            os.replace(tmp_file, os.path.join(files_dir, name))
+            restored.append(name)
+
+    if info is None:
+        raise ValueError("快照格式错误：缺少 snapshot.json")
+    for name in ("index.faiss", "index.pkl"):
+        if not os.path.exists(os.path.join(staging_dir, name)):
+            raise ValueError(f"快照不完整：缺少 {name}")
+    if id_map is not None and len(id_map) < info.get("chunk_count", 0):
+        print(f"快照中有 {info['chunk_count'] - len(id_map)} 个向量没有对应的文档块")
+
+    manifest = dict(manifest, version=version, imported_from=info.get("index_version"),
+                    imported_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+    manifest.setdefault("embedding_model", info.get("embedding_model"))
+    manifest.setdefault("metric", info.get("metric", "l2"))
+    manifest.setdefault("chunk_count", info.get("chunk_count"))
+    with open(os.path.join(staging_dir, MANIFEST_FILE), 'w', encoding='utf-8') as out:
+        json.dump(manifest, out, ensure_ascii=False, indent=2)
+    return info, rows, restored
+
+
+def _write_index_pickle(f, staging_dir: str, docstore: SQLiteDocstore, id_map: Optional[Dict[str, str]]):
+    """重写ID映射，文档库指向目标命名空间和构建号；需要换ID时同时生成新ID"""
+    # 旧格式快照的pickle中可能带有完整的InMemoryDocstore，只保留ID映射
+    _, index_to_docstore_id = pickle.load(f)
+    if id_map is not None:
+        index_to_docstore_id = {
+            position: id_map.setdefault(docstore_id, str(uuid.uuid4()))
+            for position, docstore_id in index_to_docstore_id.items()
+        }
+    target = SQLiteDocstore(namespace=docstore.namespace, build_id=docstore.build_id)
+    with open(os.path.join(staging_dir, "index.pkl"), 'wb') as out:
+        pickle.dump((target, index_to_docstore_id), out, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="知识库快照导出/导入")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command, help_text in (("export", "导出快照"), ("import", "导入快照")):
+        sub = subparsers.add_parser(command, help=help_text)
+        sub.add_argument("snapshot", help="快照文件路径，- 表示标准输出/输入")
+        sub.add_argument("--kb-dir", default=os.path.join("data", "knowledge_base"), help="知识库根目录")
+        sub.add_argument("--db", help="数据库路径（应用使用 data/testcase.db）")
+        sub.add_argument("--namespace", default=DEFAULT_NAMESPACE, help="分区名称")
+        sub.add_argument("--no-files", action="store_true", help="不包含/不恢复原始文件")
+        if command == "export":
+            sub.add_argument("--compress", default="", choices=list(COMPRESSIONS))
+        else:
+            sub.add_argument("--skip-model-check", action="store_true", help="不检查嵌入模型是否一致")
+
+    info_parser = subparsers.add_parser("info", help="查看快照信息")
+    info_parser.add_argument("snapshot")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        print(json.dumps(read_snapshot_info(args.snapshot), ensure_ascii=False, indent=2))
+        return 0
+
+    kb_dir = namespace_kb_dir(args.kb_dir, args.namespace)
+    if args.command == "export":
+        if args.snapshot == "-":
+            # 快照写到标准输出时，进度信息改为输出到标准错误
+            output = sys.stdout.buffer
+            with contextlib.redirect_stdout(sys.stderr):
+                export_snapshot(output, kb_dir, db_path=args.db, namespace=args.namespace,
+                                compression=args.compress, include_files=not args.no_files)
+        else:
+            export_snapshot(args.snapshot, kb_dir, db_path=args.db, namespace=args.namespace,
+                            compression=args.compress, include_files=not args.no_files)
+    else:
+        source = sys.stdin.buffer if args.snapshot == "-" else args.snapshot
+        database = None
+        if args.db and not args.no_files:
+            from .database import Database
+            database = Database(args.db)
+        import_snapshot(source, kb_dir, db_path=args.db, namespace=args.namespace,
+                        include_files=not args.no_files, database=database,
+                        expected_model=None if args.skip_model_check else KnowledgeBase.EMBEDDING_MODEL)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# backend/kb_watcher.py
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Iterable, Optional
+
+from .kb_shards import KnowledgeBaseShards
+
+
+class KnowledgeBaseWatcher:
+    """
+    知识库文件目录的监视线程
+
+    定期调用 KnowledgeBase.sync_files 扫描文件目录（分区知识库逐个分区扫描），
+    新增、修改的文件重新解析入库，删除的文件从索引中移除，每个分区每轮最多发布一次新版本。
+    目录没有变化时只比较文件的修改时间和大小，不加写锁也不计算哈希。
+    skip_files 按分区返回本轮不同步的文件名，如入库任务还没有成功完成的上传文件（见 IngestQueue.unfinished_files）。
+    """
+
+    def __init__(self, knowledge_base, interval: float = 60.0, settle_seconds: float = 2.0,
+                 skip_files: Optional[Callable[[str], Iterable[str]]] = None):
+        self.knowledge_base = knowledge_base  # KnowledgeBase 或 KnowledgeBaseShards
+        self.interval = max(1.0, interval)
+        self.settle_seconds = settle_seconds  # 修改时间在该时间内的文件可能还在复制，留到下一轮
+        self.skip_files = skip_files
+        self.last_result: Dict[str, Dict] = {}  # {分区: 最近一次有变化的同步结果}
+        self.last_scan_at: Optional[float] = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._scan_lock = threading.Lock()
+
+    def start(self):
+        """启动监视线程（重复调用无副作用）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="kb-watcher", daemon=True)
+        self._thread.start()
+        print(f"知识库目录监视已启动，扫描间隔 {self.interval:.0f} 秒")
+
+    def stop(self, timeout: float = 10.0):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def trigger(self):
+        """立即执行一轮扫描"""
+        self._wakeup.set()
+
+    def scan_once(self) -> Dict[str, Dict]:
+        """扫描一轮，返回 {分区: 同步结果}"""
+        with self._scan_lock:
+            if isinstance(self.knowledge_base, KnowledgeBaseShards):
+                results = {name: self.knowledge_base.sync_files(name, settle_seconds=self.settle_seconds,
+                                                                skip_files=self._skipped(name))
+                           for name in self.knowledge_base.namespaces()}
+            else:
+                results = {"default": self.knowledge_base.sync_files(settle_seconds=self.settle_seconds,
+                                                                     skip_files=self._skipped("default"))}
+            self.last_scan_at = time.time()
+            for name, result in results.items():
+                if result.get("added") or result.get("changed") or result.get("removed") or result.get("failed"):
+                    self.last_result[name] = result
+            return results
+
+    def _skipped(self, namespace: str) -> Iterable[str]:
+        return self.skip_files(namespace) if self.skip_files is not None else ()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.scan_once()
+            except Exception as e:
+                print(f"扫描知识库目录出错: {str(e)}")
+                traceback.print_exc()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
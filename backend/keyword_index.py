@@ -0,0 +1,132 @@
+# backend/keyword_index.py
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Container, Dict, Iterable, List, Sequence, Tuple
+
+import jieba
+
+# 测试用例编号、字段名、错误码等标识符整体保留，例如 FP12、user_id、E-1001
+_IDENTIFIER_PATTERN = re.compile(r'[a-z][a-z0-9]*(?:[_\-][a-z0-9]+)+|[a-z]+\d+[a-z0-9]*|\d+[a-z]+[a-z0-9]*')
+_TOKEN_PATTERN = re.compile(r'[0-9a-z\u4e00-\u9fa5]')
+_STOPWORDS = {
+    "的", "了", "和", "是", "在", "与", "及", "或", "等", "对", "为", "中", "将", "把",
+    "被", "吗", "呢", "吧", "啊", "空值", "工作表", "行号"
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """中文用jieba搜索引擎模式分词，英文数字标识符整体保留并统一小写"""
+    if not text:
+        return []
+    lowered = text.lower()
+    tokens = [
+        token for token in jieba.lcut_for_search(lowered)
+        if token.strip() and _TOKEN_PATTERN.search(token) and token not in _STOPWORDS
+    ]
+    seen = set(tokens)
+    for identifier in _IDENTIFIER_PATTERN.findall(lowered):
+        if identifier not in seen:
+            tokens.append(identifier)
+            seen.add(identifier)
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """
+    倒数排名融合（RRF）
+
+    Args:
+        rankings: 多路检索结果的ID列表，每一路按相关度从高到低排列
+        k: 平滑常数，越大排名靠后的结果权重衰减越慢
+
+    Returns:
+        融合后按得分从高到低排列的ID列表
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda doc_id: scores[doc_id], reverse=True)
+
+
+class BM25Index:
+    """
+    基于倒排表的BM25关键词索引
+
+    倒排表在入库时增量构建，随向量索引一起按版本保存；查询时只遍历
+    查询词对应的倒排链，不需要额外的模型调用。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # 词 -> {文档ID: 词频}
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, Tuple[str, ...]] = {}  # 删除文档时使用
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id: str, text: str):
+        """添加单个文档，重复添加时先删除旧内容"""
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            self.postings[term][doc_id] = tf
+        self.doc_terms[doc_id] = tuple(counts)
+        self.doc_lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+
+    def add_documents(self, items: Iterable[Tuple[str, object]]):
+        """批量添加 (文档ID, Document) 对，跳过系统初始化文档"""
+        for doc_id, doc in items:
+            if doc.metadata.get("type") == "initialization":
+                continue
+            self.add(doc_id, doc.page_content)
+
+    def remove(self, doc_id: str):
+        """从倒排表中删除文档"""
+        if doc_id not in self.doc_lengths:
+            return
+        for term in self.doc_terms.pop(doc_id, ()):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query: str, k: int = 10, allowed_ids: Container[str] = None) -> List[Tuple[str, float]]:
+        """按BM25得分返回前k个 (文档ID, 得分)，指定 allowed_ids 时只在这些文档中计分"""
+        doc_count = len(self.doc_lengths)
+        if not doc_count:
+            return []
+
+        avg_length = self.total_length / doc_count or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                if allowed_ids is not None and doc_id not in allowed_ids:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["postings"] = dict(self.postings)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.postings = defaultdict(dict, state["postings"])
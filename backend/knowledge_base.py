@@ -3,119 +3,824 @@ import os
 import pandas as pd
 import numpy as np
 import traceback
+import copy
+import functools
+import hashlib
+import time
+import uuid
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+import faiss
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from typing import List, Tuple, Dict, Union
+from typing import List, Tuple, Dict, Union, Iterator, Iterable, Callable
 from .database import Database
+from .index_store import IndexStore
+from .docstore import SQLiteDocstore
+from .keyword_index import BM25Index, reciprocal_rank_fusion
+from .query_cache import get_query_cache
+from .embedding_service import get_embedding_service
+from .chunkers import get_chunker
+from .extractors import Extractor, get_extractor, supported_extensions
+from .dedup import SimHashIndex, content_digest, jaccard, normalize_text, shingles, simhash
 import re
 
+# Excel测试用例字段：(元数据键, 显示名称, 可识别的列名)，入库时按列名提取一次
+TEST_CASE_FIELDS = [
+    ("test_case_id", "用例ID", ("用例id", "用例编号", "用例序号", "编号")),
+    ("module", "所属模块", ("功能模块", "所属模块", "模块")),
+    ("test_case_title", "用例标题", ("测试用例名称", "测试用例标题", "用例名称", "用例标题", "标题")),
+    ("precondition", "前置条件", ("前置条件", "预置条件")),
+    ("test_steps", "测试步骤", ("测试步骤", "操作步骤", "步骤")),
+    ("test_data", "测试数据", ("测试数据",)),
+    ("expected_result", "预期结果", ("预期结果", "期望结果")),
+    ("priority", "优先级", ("优先级",)),
+]
+
+# 旧版本索引中的Excel文档块没有提取字段，查询时仍按原正则解析
+_LEGACY_TEST_CASE_PATTERNS = [
+    (re.compile(pattern), re.search(r'([^:：]+)[:：]', pattern).group(1))
+    for pattern in (
+        r'测试用例[名称|标题][:：]\s*(.+)',
+        r'用例[名称|标题][:：]\s*(.+)',
+        r'测试步骤[:：]\s*(.+)',
+        r'预期结果[:：]\s*(.+)'
+    )
+]
+
+
+def match_test_case_columns(columns) -> Dict[str, str]:
+    """把Excel列名匹配到测试用例字段，返回 {元数据键: 列名}，先精确匹配再包含匹配"""
+    normalized = {col: str(col).strip().lower().replace(" ", "") for col in columns}
+    matched: Dict[str, str] = {}
+    used = set()
+    for exact in (True, False):
+        for key, _, aliases in TEST_CASE_FIELDS:
+            if key in matched:
+                continue
+            for col, name in normalized.items():
+                if col in used:
+                    continue
+                if any(name == alias if exact else alias in name for alias in aliases):
+                    matched[key] = col
+                    used.add(col)
+                    break
+    return matched
+
+
+def matches_metadata_filter(metadata: Dict, metadata_filter: Dict) -> bool:
+    """
+    元数据过滤：值为列表时表示取值之一，否则要求相等（与langchain FAISS的filter一致）
+
+    合并了重复内容的文档块按 sources 中的任一来源匹配 source 条件。
+    """
+    for key, expected in metadata_filter.items():
+        values = (metadata.get("sources") or [metadata.get(key)]) if key == "source" else [metadata.get(key)]
+        if isinstance(expected, list):
+            if not any(value in expected for value in values):
+                return False
+        elif expected not in values:
+            return False
+    return True
+
+
+# 判重时忽略的位置信息行（Excel的工作表名和行号）
+_DEDUP_IGNORE_PATTERN = re.compile(r'^(?:工作表|行号): .*$', re.MULTILINE)
+
+
+class _IndexState:
+    """
+    一个索引版本的全部状态：向量库、BM25倒排表、重复内容指纹、文件状态以及按该版本计算的查询缓存
+
+    知识库实例只持有一个状态对象的引用，切换版本时整体替换引用，
+    正在查询的会话要么看到旧版本的全部状态，要么看到新版本的全部状态。
+    """
+    __slots__ = ("vectorstore", "index_version", "index_stamp", "writable", "keyword_index",
+                 "dedup_index", "file_state", "initialization_only", "index_metric",
+                 "id_to_position", "id_to_position_key", "filter_cache")
+
+    def __init__(self, index_metric: str):
+        self.vectorstore = None
+        self.index_version = None
+        self.index_stamp = 0.0
+        self.writable = False  # 向量库是否为所属实例独占的可写副本
+        self.keyword_index = None  # 与向量索引同版本的BM25倒排表
+        self.dedup_index = None  # 与向量索引同版本的重复内容指纹
+        self.file_state = None  # 已入库文件的状态 {文件名: {mtime, size, sha256, chunks}}，随索引版本保存
+        self.initialization_only = False  # 索引中是否只有初始化文档，随索引清单保存
+        self.index_metric = index_metric
+        self.id_to_position = {}
+        self.id_to_position_key = None
+        self.filter_cache = OrderedDict()  # 元数据过滤条件 -> 满足条件的索引位置，随向量库版本失效
+
+    def fork(self) -> "_IndexState":
+        """写入器使用的副本：共享只读的索引对象（写入前由 _ensure_writable 复制），查询缓存重新计算"""
+        state = _IndexState(self.index_metric)
+        for name in self.__slots__:
+            if name not in ("id_to_position", "id_to_position_key", "filter_cache"):
+                setattr(state, name, getattr(self, name))
+        return state
+
+
+def _state_field(name: str) -> property:
+    """把实例属性转发到当前索引状态对象的同名字段"""
+    return property(lambda self: getattr(self._state, name),
+                    lambda self, value: setattr(self._state, name, value))
+
+
+def _read_snapshot(method):
+    """读取方法先切换到最新发布的版本，再在固定当前状态的浅拷贝上执行，一次查询只读一个版本"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._refresh_if_stale()
+        return method(copy.copy(self), *args, **kwargs)
+    return wrapper
+
+
 class KnowledgeBase:
-    def __init__(self, kb_dir="E:/sm-ai/data/knowledge_base", db_path=None):
+    # 检索模式：纯向量、纯关键词（BM25）、两者倒数排名融合
+    RETRIEVAL_MODES = ("vector", "keyword", "hybrid")
+    SUPPORTED_EXTENSIONS = supported_extensions()  # 可入库的格式，见 extractors
+    # 向量度量："l2" 欧氏距离（越小越相似）；"cosine" 归一化内积，分数即余弦相似度（越大越相似）
+    METRICS = ("l2", "cosine")
+    EMBEDDING_MODEL = "shibing624/text2vec-base-chinese"  # 默认嵌入模型，索引清单和快照中记录该名称
+    FILTER_CACHE_SIZE = 64  # 缓存的元数据过滤条件数量
+
+    # 随索引版本变化的属性都保存在 _state 中，见 _IndexState
+    _vectorstore = _state_field("vectorstore")
+    _index_version = _state_field("index_version")
+    _index_stamp = _state_field("index_stamp")
+    _writable = _state_field("writable")
+    _keyword_index = _state_field("keyword_index")
+    _dedup_index = _state_field("dedup_index")
+    _file_state = _state_field("file_state")
+    _initialization_only = _state_field("initialization_only")
+    _index_metric = _state_field("index_metric")
+    _id_to_position = _state_field("id_to_position")
+    _id_to_position_key = _state_field("id_to_position_key")
+    _filter_cache = _state_field("filter_cache")
+    # 满足过滤条件的文档块不超过该数量时直接取出向量计算分数，否则用ID选择器在整个索引中搜索
+    DIRECT_SCORE_LIMIT = 4096
+    SEGMENT_BATCH_SIZE = 20  # 非表格文件每解析这么多段（如PDF页）写入一批文档块
+
+    def __init__(self, kb_dir="E:/sm-ai/data/knowledge_base", db_path=None, mmap_index=True,
+                 query_cache_size=1024, excel_rows_per_chunk=1, ingest_batch_size=1000, metric="l2",
+                 embedding_backend=None, chunker="recursive", chunk_size=500, chunk_overlap=50,
+                 dedup=True, dedup_similarity=0.9, dedup_min_length=50, namespace="default",
+                 embedding_service=None):
         self.kb_dir = os.path.normpath(kb_dir)
         self.KB_FILES_DIR = os.path.join(self.kb_dir, "files")
         self.index_path = os.path.join(self.kb_dir, "faiss_index")
         self.db_path = db_path  # 保存数据库路径
+        # 命名空间（分区）：多个知识库共用一个数据库时，文档块按命名空间隔离，重建时只清理本分区
+        self.namespace = namespace
+        # 文档块存放在数据库的 vector_documents 表中，未指定数据库时使用知识库目录下的独立文件
+        self.docstore_path = db_path or os.path.join(self.kb_dir, "docstore.db")
+        self.mmap_index = mmap_index  # 以只读内存映射方式加载共享索引
+        self.excel_rows_per_chunk = max(1, excel_rows_per_chunk)  # 每个文档块包含的Excel行数
+        self.ingest_batch_size = max(1, ingest_batch_size)  # 每批送入嵌入模型的行数
+        self.last_ingest_stats = {}  # 最近一次入库的吞吐统计
+        self.last_error = None  # 最近一次入库失败的原因
+        # 入库时合并重复文档块：内容完全相同（忽略工作表和行号）的总是合并；
+        # 长度不少于 dedup_min_length 的非结构化文本块，SimHash相近且n-gram相似度不低于
+        # dedup_similarity 时也合并。结构化的Excel测试用例只合并完全相同的行
+        self.dedup = dedup
+        self.dedup_similarity = dedup_similarity
+        self.dedup_min_length = dedup_min_length
+        # 文本切分方式：recursive（原有递归字符切分）、sentence、heading、token，也可传入切分器实例
+        # token 切分时 chunk_size/chunk_overlap 表示token数
+        if chunker == "token":
+            self.chunker = get_chunker(chunker, max_tokens=chunk_size, overlap_tokens=chunk_overlap)
+        else:
+            self.chunker = get_chunker(chunker, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        if metric not in self.METRICS:
+            raise ValueError(f"不支持的向量度量: {metric}，可选: {', '.join(self.METRICS)}")
+        self.metric = metric  # 新建索引使用的度量，已有索引沿用清单中记录的度量直到重建
+        self._state = _IndexState(metric)
         
         # 确保目录存在
         os.makedirs(self.KB_FILES_DIR, exist_ok=True)
         os.makedirs(self.kb_dir, exist_ok=True)
         os.makedirs(self.index_path, exist_ok=True)
         
-        self._embeddings = HuggingFaceEmbeddings(
-            model_name="shibing624/text2vec-base-chinese",
-           
-        )
-        self._vectorstore = None
+        self.embedding_model = self.EMBEDDING_MODEL
+        # 嵌入模型在进程内共享，所有会话共用一个模型实例，并发查询自动合并批处理
+        # 也可传入独立的 EmbeddingService（如基准测试使用的哈希编码器），模型名称以服务为准
+        if embedding_service is not None:
+            self._embeddings = embedding_service
+            self.embedding_model = embedding_service.model_name
+        else:
+            self._embeddings = get_embedding_service(self.embedding_model, backend=embedding_backend)
+        # 所有搜索方法共用的查询向量缓存（同一模型和后端在进程内共享）
+        self._query_cache = get_query_cache(self._embeddings.cache_key, maxsize=query_cache_size)
+        self._store = IndexStore(self.index_path)
+        self._retired_ids = []  # 写入器上被移除或替换、待发布后标记退役的文档块ID
+        self._written_ids = []  # 写入器上已写入文档存储、尚未随新版本发布的文档块ID
         self._init_vectorstore()
     
     def _init_vectorstore(self):
-        """修改初始化逻辑，避免空列表错误"""
+        """加载当前版本的共享只读索引，不存在时创建只含初始化文档的索引"""
         try:
-            index_file = os.path.join(self.index_path, "index.faiss")
-            if os.path.exists(index_file):
-                self._vectorstore = FAISS.load_local(
-                    self.index_path, 
-                    self._embeddings,
-                    allow_dangerous_deserialization=True
-                )
-                print(f"成功加载知识库索引，包含 {len(self._vectorstore.index_to_docstore_id)} 个文档块")
+            self._index_stamp = self._store.current_stamp()
+            version, parts = self._store.load_shared(mmap=self.mmap_index)
+            if parts is not None:
+                index, docstore, index_to_docstore_id, extras = parts
+                self._bind_docstore(docstore)
+                manifest = extras.get("manifest") or {}
+                self._index_metric = manifest.get("metric", "l2")
+                if self._index_metric != self.metric:
+                    print(f"当前索引使用 {self._index_metric} 度量，重建索引后切换为 {self.metric}")
+                self._vectorstore = self._wrap_vectorstore(index, docstore, index_to_docstore_id)
+                self._keyword_index = extras.get("bm25")
+                self._dedup_index = extras.get("dedup")
+                self._file_state = extras.get("files")
+                self._load_index_state(manifest)
+                self._index_version = version
+                self._writable = False
+                print(f"成功加载知识库索引，包含 {len(index_to_docstore_id)} 个文档块")
+                if isinstance(docstore, InMemoryDocstore):
+                    self._migrate_docstore()
             else:
-                # 创建一个虚拟文档来初始化索引，避免空列表错误
-                dummy_doc = Document(
-                    page_content="系统初始化文档",
-                    metadata={"source": "system", "type": "initialization"}
-                )
-                self._vectorstore = FAISS.from_documents([dummy_doc], self._embeddings)
-                self._vectorstore.save_local(self.index_path)
-                print("创建新的知识库索引（包含初始化文档）")
+                with self._store.writer_lock():
+                    if self._store.current_version() is None:
+                        # 创建一个虚拟文档来初始化索引，避免空列表错误
+                        self._build_vectorstore([])
+                        self._publish_vectorstore()
+                        print("创建新的知识库索引（包含初始化文档）")
+                        return
+                # 等待写锁期间其他会话已创建索引
+                self._init_vectorstore()
         except Exception as e:
             print(f"初始化向量库失败: {str(e)}")
             # 备用方案：使用虚拟文档创建
             try:
-                dummy_doc = Document(
-                    page_content="系统初始化文档",
-                    metadata={"source": "system", "type": "initialization"}
-                )
-                self._vectorstore = FAISS.from_documents([dummy_doc], self._embeddings)
+                self._build_vectorstore([])
+                self._writable = True
                 print("使用备用方案创建知识库索引")
             except Exception as e2:
                 print(f"备用方案也失败: {str(e2)}")
                 self._vectorstore = None
 
+    def _build_vectorstore(self, documents: List[Document]):
+        """用给定文档创建全新的向量库和关键词索引，没有文档时只包含初始化文档"""
+        if not documents:
+            # 创建一个虚拟文档来初始化索引，避免空列表错误
+            documents = [Document(
+                page_content="系统初始化文档",
+                metadata={"source": "system", "type": "initialization"}
+            )]
+            self._file_state = {}
+        elif self._file_state is None:
+            self._file_state = {}
+        ids = [doc.id or str(uuid.uuid4()) for doc in documents]
+        dedup_keys = [doc.metadata.pop("_dedup_key", None) for doc in documents]
+        self._index_metric = self.metric
+        self._written_ids = self._written_ids + ids
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self._vectorstore = FAISS.from_documents(
+                documents, self._embeddings, ids=ids, docstore=self._new_docstore(),
+                **self._metric_kwargs()
+            )
+        self._keyword_index = BM25Index()
+        self._keyword_index.add_documents(zip(ids, documents))
+        self._dedup_index = SimHashIndex()
+        for doc_id, dedup_key in zip(ids, dedup_keys):
+            if dedup_key:
+                self._dedup_index.add(doc_id, *dedup_key)
+        self._initialization_only = documents[0].metadata.get("type") == "initialization"
+        self._writable = True
+
+    def _add_to_vectorstore(self, documents: List[Document]):
+        """把文档追加到可写副本，同时更新关键词索引"""
+        self._ensure_writable()
+        keyword_index = self._get_keyword_index()
+        dedup_index = self._get_dedup_index()
+        dedup_keys = [doc.metadata.pop("_dedup_key", None) for doc in documents]
+        ids = [doc.id or str(uuid.uuid4()) for doc in documents]
+        self._written_ids = self._written_ids + ids
+        ids = self._vectorstore.add_documents(documents, ids=ids)
+        keyword_index.add_documents(zip(ids, documents))
+        for doc_id, dedup_key in zip(ids, dedup_keys):
+            if dedup_key:
+                dedup_index.add(doc_id, *dedup_key)
+        self._initialization_only = False
+
+    def _ingest_batches(self, batches: Iterable[List[Document]], rebuild: bool = False,
+                        progress_callback: Callable[[int], None] = None, stats: Dict = None) -> int:
+        """
+        逐批写入向量库，返回写入的文档块数量（不含合并掉的重复块）
+
+        Args:
+            batches: 文档块批次，可以是惰性生成器，读取、嵌入交替进行
+            rebuild: 为True时第一批创建全新的向量库，否则追加到当前向量库
+            progress_callback: 每批写入后以已写入的文档块数量调用，抛出异常即中止本次写入
+            stats: 统计字典，记录合并的重复块数量 duplicates
+        """
+        total = 0
+        for batch in batches:
+            batch = self._deduplicate(batch, fresh=rebuild and total == 0, stats=stats)
+            if not batch:
+                continue
+            if rebuild and total == 0:
+                self._build_vectorstore(batch)
+            else:
+                self._add_to_vectorstore(batch)
+            total += len(batch)
+            if progress_callback:
+                progress_callback(total)
+        return total
+
+    def _dedup_fingerprint(self, doc: Document) -> Tuple[str, Union[int, None], Union[set, None]]:
+        """返回 (内容摘要, SimHash指纹, n-gram集合)，不参与近似判重的文档块后两项为None"""
+        text = normalize_text(_DEDUP_IGNORE_PATTERN.sub("", doc.page_content))
+        if len(text) < self.dedup_min_length or doc.metadata.get("structured"):
+            return content_digest(text), None, None
+        grams = shingles(text)
+        return content_digest(text), simhash(grams), grams
+
+    def _deduplicate(self, documents: List[Document], fresh: bool = False, stats: Dict = None) -> List[Document]:
+        """
+        合并重复的文档块，返回需要写入的文档块
+
+        与已入库的文档块重复时只把来源记到已有文档块的元数据（sources、duplicate_count）中；
+        同一批内重复的保留第一个。保留的文档块预先分配ID，判重指纹临时放在元数据中，
+        写入向量库时登记到指纹索引。fresh 为True（全新构建）时不与旧索引比较。
+        """
+        if not self.dedup or not documents:
+            return documents
+
+        existing = None if fresh else self._get_dedup_index()
+        local = SimHashIndex()
+        local_docs = {}
+        kept = []
+        updates = {}  # 已入库的文档块ID -> 重复文档块的元数据列表
+        for doc in documents:
+            if doc.metadata.get("type") == "initialization":
+                kept.append(doc)
+                continue
+            digest, fingerprint, grams = self._dedup_fingerprint(doc)
+            duplicate_id = self._find_duplicate(digest, fingerprint, grams, local, local_docs, existing)
+            if duplicate_id is None:
+                doc.id = doc.id or str(uuid.uuid4())
+                doc.metadata["_dedup_key"] = (digest, fingerprint)
+                local.add(doc.id, digest, fingerprint)
+                local_docs[doc.id] = (doc, grams)
+                kept.append(doc)
+            elif duplicate_id in local_docs:
+                self._add_duplicate_source(local_docs[duplicate_id][0].metadata, doc.metadata)
+            else:
+                updates.setdefault(duplicate_id, []).append(doc.metadata)
+
+        if updates:
+            self._record_duplicate_sources(updates)
+        if stats is not None:
+            stats["duplicates"] = stats.get("duplicates", 0) + len(documents) - len(kept)
+        return kept
+
+    def _find_duplicate(self, digest: str, fingerprint, grams, local: SimHashIndex,
+                        local_docs: Dict, existing: SimHashIndex = None):
+        """先查完全重复，再查SimHash候选并用n-gram相似度确认"""
+        indexes = [index for index in (local, existing) if index is not None]
+        for index in indexes:
+            doc_id = index.find_exact(digest)
+            if doc_id:
+                return doc_id
+        if fingerprint is None:
+            return None
+
+        for index in indexes:
+            candidate_ids = [doc_id for doc_id, _ in index.candidates(fingerprint)]
+            if not candidate_ids:
+                continue
+            if index is local:
+                candidate_grams = {doc_id: local_docs[doc_id][1] for doc_id in candidate_ids}
+            else:
+                candidate_grams = {
+                    doc_id: self._dedup_fingerprint(doc)[2] or set()
+                    for doc_id, doc in self._fetch_documents(candidate_ids).items()
+                }
+            for doc_id in candidate_ids:
+                if doc_id in candidate_grams and jaccard(grams, candidate_grams[doc_id]) >= self.dedup_similarity:
+                    return doc_id
+        return None
+
+    @staticmethod
+    def _add_duplicate_source(metadata: Dict, duplicate_metadata: Dict):
+        """在保留的文档块上记录重复内容的来源"""
+        sources = metadata.setdefault("sources", [metadata.get("source")])
+        if duplicate_metadata.get("source") not in sources:
+            sources.append(duplicate_metadata.get("source"))
+        metadata["duplicate_count"] = metadata.get("duplicate_count", 0) + 1
+
+    def _record_duplicate_sources(self, updates: Dict[str, List[Dict]]):
+        """把重复来源写到已入库文档块的新版本上（见 _replace_chunks）"""
+        if not isinstance(self._vectorstore.docstore, SQLiteDocstore):
+            return
+        self._ensure_writable()
+        docs = self._fetch_documents(list(self._positions(list(updates))))
+        for doc_id, doc in docs.items():
+            for duplicate_metadata in updates[doc_id]:
+                self._add_duplicate_source(doc.metadata, duplicate_metadata)
+        self._replace_chunks(docs)
+
+    def _replace_chunks(self, docs: Dict[str, Document]):
+        """
+        以新的向量ID写入元数据变化的文档块，替换可写副本中的旧ID
+
+        已发布的版本仍按旧ID读取修改前的行，旧行在新版本发布后标记退役，
+        等引用它的版本目录清理后才删除（见 _release_retired_chunks）；向量和位置不变。
+        """
+        if not docs:
+            return
+        replaced = {doc_id: str(uuid.uuid4()) for doc_id in docs}
+        self._written_ids = self._written_ids + list(replaced.values())
+        self._vectorstore.docstore.add({
+            replaced[doc_id]: Document(page_content=doc.page_content, metadata=doc.metadata)
+            for doc_id, doc in docs.items()
+        })
+        positions = self._positions(list(docs))
+        index_to_docstore_id = dict(self._vectorstore.index_to_docstore_id)
+        for doc_id, position in positions.items():
+            index_to_docstore_id[position] = replaced[doc_id]
+        self._vectorstore.index_to_docstore_id = index_to_docstore_id
+
+        keyword_index = self._get_keyword_index()
+        dedup_index = self._get_dedup_index()
+        dedup_keys = {}
+        for doc_id, doc in docs.items():
+            digest, fingerprint, _ = self._dedup_fingerprint(doc)
+            if dedup_index.find_exact(digest) == doc_id or doc_id in dedup_index.fingerprints:
+                dedup_keys[replaced[doc_id]] = (digest, fingerprint)
+            if doc_id in keyword_index.doc_lengths:
+                keyword_index.remove(doc_id)
+                keyword_index.add(replaced[doc_id], doc.page_content)
+        dedup_index.remove_many(docs)
+        for doc_id, dedup_key in dedup_keys.items():
+            dedup_index.add(doc_id, *dedup_key)
+        self._retired_ids = self._retired_ids + list(docs)
+        self._id_to_position_key = None
+
+    def _get_dedup_index(self) -> SimHashIndex:
+        """获取重复内容指纹索引，旧版本索引没有保存时从文档存储补建"""
+        if self._dedup_index is None:
+            dedup_index = SimHashIndex()
+            ids = list(self._vectorstore.index_to_docstore_id.values())
+            for doc_id, doc in self._fetch_documents(ids).items():
+                if doc.metadata.get("type") != "initialization":
+                    digest, fingerprint, _ = self._dedup_fingerprint(doc)
+                    dedup_index.add(doc_id, digest, fingerprint)
+            self._dedup_index = dedup_index
+            print(f"已为 {len(dedup_index)} 个文档块补建重复内容指纹")
+        return self._dedup_index
+
+    @contextmanager
+    def _write_transaction(self):
+        """
+        写事务：持有索引写锁，在最新发布版本的独立写入器上修改，发布后切换
+
+        写入器是本实例的浅拷贝，持有索引状态的独立副本（查询缓存不与本实例共享），入库过程中的修改都发生在写入器上，
+        本实例继续用已发布的快照响应搜索，发布完成后整体替换为写入器的状态。
+        写入失败、被取消或没有发布时丢弃写入器，并删除它已写入文档存储的文档块，已发布的索引不受影响。
+        """
+        with self._store.writer_lock():
+            writer = copy.copy(self)
+            writer._state = self._state.fork()
+            writer._written_ids = []
+            writer._retired_ids = []
+            try:
+                # 在锁内基于最新发布的版本修改，不覆盖其他会话或进程刚发布的内容
+                if writer._writable or writer._store.current_version() != writer._index_version:
+                    writer._init_vectorstore()
+                yield writer
+            finally:
+                writer._discard_written_chunks()
+            if writer._index_version != self._index_version:
+                self._adopt(writer)
+
+    def _discard_written_chunks(self):
+        """删除已写入文档存储但没有发布的文档块（没有任何索引版本引用它们）"""
+        written, self._written_ids = self._written_ids, []
+        if not written:
+            return
+        try:
+            self._new_docstore().delete(written)
+            print(f"已删除 {len(written)} 个未发布的文档块")
+        except Exception as e:
+            print(f"删除未发布的文档块失败: {str(e)}")
+
+    def _adopt(self, writer: "KnowledgeBase"):
+        """切换到写入器发布的版本：整体替换状态引用，不修改旧快照"""
+        self._state = writer._state
+        self.last_ingest_stats = writer.last_ingest_stats
+
+    def _metric_kwargs(self) -> Dict:
+        """当前索引度量对应的FAISS参数，余弦度量使用归一化向量的内积索引"""
+        if self._index_metric == "cosine":
+            return {"normalize_L2": True, "distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT}
+        return {}
+
+    def _wrap_vectorstore(self, index, docstore, index_to_docstore_id) -> FAISS:
+        """按当前索引度量包装FAISS向量库"""
+        with warnings.catch_warnings():
+            # langchain对内积索引+归一化会给出提示，这里正是余弦相似度所需的组合
+            warnings.simplefilter("ignore")
+            return FAISS(self._embeddings, index, docstore, index_to_docstore_id, **self._metric_kwargs())
+
+    def _load_index_state(self, manifest: Dict = None):
+        """从索引清单读取索引状态，旧版本索引没有清单时只检查唯一的文档块"""
+        if manifest and "initialization_only" in manifest:
+            self._initialization_only = bool(manifest["initialization_only"])
+            return
+        self._initialization_only = False
+        index_to_docstore_id = self._vectorstore.index_to_docstore_id
+        if len(index_to_docstore_id) == 1:
+            doc = self._vectorstore.docstore.search(next(iter(index_to_docstore_id.values())))
+            self._initialization_only = isinstance(doc, Document) and self._is_initialization_doc(doc)
+
+    def _index_manifest(self) -> Dict:
+        """随索引版本保存的元数据"""
+        return {
+            "chunk_count": len(self._vectorstore.index_to_docstore_id),
+            "initialization_only": self._initialization_only,
+            "embedding_model": self.embedding_model,
+            "embedding_backend": self._embeddings.requested_backend,
+            "metric": self._index_metric,
+            "chunker": getattr(self.chunker, "name", type(self.chunker).__name__),
+            "parent_version": self._index_version,
+            "retired_chunks": len(self._retired_ids)
+        }
+
+    def _new_docstore(self) -> SQLiteDocstore:
+        """为一次新的索引构建创建SQLite文档存储"""
+        return SQLiteDocstore(self.docstore_path, namespace=self.namespace)
+
+    def _bind_docstore(self, docstore):
+        """反序列化得到的SQLite文档存储需要绑定到本知识库的数据库"""
+        if isinstance(docstore, SQLiteDocstore):
+            docstore.bind(self.docstore_path)
+
+    def _migrate_docstore(self):
+        """把旧版pickle中的InMemoryDocstore迁移到SQLite，并发布不含文档内容的新版本"""
+        try:
+            with self._store.writer_lock():
+                if self._store.current_version() != self._index_version:
+                    # 其他写入方已经发布了新版本
+                    self._init_vectorstore()
+                    return
+                vs = self._vectorstore
+                docstore = self._new_docstore()
+                docstore.add(dict(vs.docstore._dict))
+                self._vectorstore = self._wrap_vectorstore(vs.index, docstore, dict(vs.index_to_docstore_id))
+                self._publish_vectorstore()
+                print(f"已将 {len(vs.index_to_docstore_id)} 个文档块迁移到SQLite文档存储")
+        except Exception as e:
+            print(f"迁移文档存储失败，继续使用旧格式: {str(e)}")
+
+    def _prune_docstore(self, previous_docstore):
+        """全量重建发布后，删除比上一次构建更早的文档块"""
+        docstore = self._vectorstore.docstore if self._vectorstore else None
+        if not isinstance(docstore, SQLiteDocstore):
+            return
+        keep = [previous_docstore.build_id] if isinstance(previous_docstore, SQLiteDocstore) else []
+        try:
+            removed = docstore.prune(keep)
+            if removed:
+                print(f"已清理 {removed} 个过期文档块")
+        except Exception as e:
+            print(f"清理过期文档块失败: {str(e)}")
+
+    def _refresh_if_stale(self):
+        """其他会话或进程发布了新版本时切换到新的共享索引"""
+        if self._writable:
+            return
+        stamp = self._store.current_stamp()
+        if stamp != self._index_stamp and self._store.current_version() != self._index_version:
+            print("检测到知识库索引已更新，切换到新版本")
+            # 在加载器上读取新版本，完成后再整体替换，读取过程中其他查询仍使用旧版本
+            loader = copy.copy(self)
+            loader._state = _IndexState(self.metric)
+            loader._init_vectorstore()
+            self._state = loader._state
+        else:
+            self._index_stamp = stamp
+
+    def _ensure_writable(self):
+        """写入前把共享的只读索引换成本实例独占的可写副本"""
+        if self._writable or self._vectorstore is None:
+            return
+        if self._index_version is not None:
+            # 内存映射的索引不能原地修改，从磁盘完整读取一份
+            index, docstore, index_to_docstore_id, extras = self._store.read_version(self._index_version, mmap=False)
+            self._bind_docstore(docstore)
+            self._keyword_index = extras.get("bm25")
+            self._dedup_index = extras.get("dedup")
+            self._file_state = extras.get("files")
+        else:
+            index = faiss.deserialize_index(faiss.serialize_index(self._vectorstore.index))
+            docstore = self._vectorstore.docstore
+            index_to_docstore_id = self._vectorstore.index_to_docstore_id
+            self._keyword_index = copy.deepcopy(self._keyword_index)
+            self._dedup_index = copy.deepcopy(self._dedup_index)
+            self._file_state = copy.deepcopy(self._file_state)
+        if isinstance(docstore, InMemoryDocstore):
+            docstore = InMemoryDocstore(dict(docstore._dict))
+        self._vectorstore = self._wrap_vectorstore(index, docstore, dict(index_to_docstore_id))
+        self._writable = True
+
+    def _publish_vectorstore(self):
+        """把当前向量库发布为新版本，并作为共享只读索引提供给其他会话"""
+        extras = {"bm25": self._keyword_index, "dedup": self._dedup_index, "files": self._file_state,
+                  "manifest": self._index_manifest()}
+        version = self._store.save_version(self._vectorstore, extras=extras)
+        vs = self._vectorstore
+        self._store.share(version, (vs.index, vs.docstore, vs.index_to_docstore_id, extras))
+        self._index_version = version
+        self._index_stamp = self._store.current_stamp()
+        self._writable = False
+        self._written_ids = []
+        self._release_retired_chunks(version)
+        return version
+
+    def _release_retired_chunks(self, version: str):
+        """
+        把本次发布移除或替换的文档块标记为在该版本退役，并删除已没有任何保留版本引用的文档块
+
+        在版本V退役的文档块只被V之前的版本引用，磁盘上最早保留的版本不早于V时才删除，
+        未切换到新版本的会话在此之前仍能读到它们。
+        """
+        retired, self._retired_ids = self._retired_ids, []
+        docstore = self._vectorstore.docstore
+        if not isinstance(docstore, SQLiteDocstore):
+            return
+        try:
+            if retired:
+                docstore.retire(retired, version)
+            oldest = self._store.oldest_version()
+            removed = docstore.purge_retired(oldest) if oldest else 0
+            if removed:
+                print(f"已删除 {removed} 个不再被任何索引版本引用的文档块")
+        except Exception as e:
+            print(f"清理已移除的文档块失败: {str(e)}")
+
     def _excel_to_documents(self, file_path: str) -> List[Document]:
         """将Excel文件转换为文档列表"""
         try:
             documents = []
-            
-            # 读取Excel文件
-            excel_data = pd.read_excel(file_path, sheet_name=None)
-            
-            for sheet_name, df in excel_data.items():
-                # 跳过空表
-                if df.empty:
-                    continue
-                
-                # 处理每个工作表
-                for index, row in df.iterrows():
-                    # 构建文档内容
-                    content = f"工作表: {sheet_name}\n行号: {index+1}\n"
-                    
-                    # 添加列数据
-                    for col_name, value in row.items():
-                        if pd.isna(value):
-                            value = "空值"
-                        content += f"{col_name}: {value}\n"
-                    
-                    # 添加元数据
-                    metadata = {
-                        "source": os.path.basename(file_path),
-                        "sheet": sheet_name,
-                        "row": index + 1,
-                        "type": "excel_data"
-                    }
-                    
-                    documents.append(Document(page_content=content, metadata=metadata))
-            
+            for batch in self._iter_excel_batches(file_path):
+                documents.extend(batch)
             return documents
             
         except Exception as e:
             print(f"处理Excel文件失败: {str(e)}")
             return []
 
-    def _text_to_documents(self, text: str, filename: str) -> List[Document]:
-        """将文本分割为适当大小的块"""
+    def _iter_excel_batches(self, file_path: str, stats: Dict = None,
+                            extractor: Extractor = None) -> Iterator[List[Document]]:
+        """
+        流式读取Excel并逐批产出文档块
+
+        每批读取约 ingest_batch_size 行，整批向量化地生成文本和元数据；
+        excel_rows_per_chunk 大于1时每 N 行合并为一个文档块。
+        测试用例相关的列（用例标题、测试步骤、预期结果等）在入库时提取到元数据中，
+        并排在文档内容最前面，查询时无需再解析。
+        """
+        source = os.path.basename(file_path)
+        rows_per_chunk = self.excel_rows_per_chunk
+        # 批大小取每块行数的整数倍，合并的行不会跨批
+        batch_rows = max(self.ingest_batch_size // rows_per_chunk, 1) * rows_per_chunk
+        if stats is not None:
+            stats.setdefault("rows", 0)
+
+        extractor = extractor or get_extractor(file_path)
+        for sheet_name, columns, rows in extractor.iter_sheets(file_path):
+            width = len(columns)
+            field_columns = match_test_case_columns(columns)
+            key_columns = list(field_columns.values())
+            ordered_columns = key_columns + [col for col in columns if col not in key_columns]
+
+            row_number = 0
+            exhausted = False
+            while not exhausted:
+                batch, row_numbers = [], []
+                while len(batch) < batch_rows:
+                    row = next(rows, None)
+                    if row is None:
+                        exhausted = True
+                        break
+                    row_number += 1
+                    # 跳过空行
+                    if all(value is None or (isinstance(value, float) and np.isnan(value)) for value in row):
+                        continue
+                    row = tuple(row[:width])
+                    batch.append(row + (None,) * (width - len(row)))
+                    row_numbers.append(row_number)
+                if not batch:
+                    break
+
+                df = pd.DataFrame(batch, columns=columns)
+                documents = self._format_excel_batch(
+                    df, row_numbers, sheet_name, source, field_columns, ordered_columns
+                )
+                if stats is not None:
+                    stats["rows"] += len(batch)
+                yield documents
+
+    def _format_excel_batch(self, df: pd.DataFrame, row_numbers: List[int], sheet_name: str, source: str,
+                            field_columns: Dict[str, str], ordered_columns: List[str]) -> List[Document]:
+        """向量化地把一批Excel行格式化为文档块"""
+        cells = df[ordered_columns].astype(object)
+        values = cells.where(cells.notna(), "空值").astype(str)
+        prefix = pd.Series([f"工作表: {sheet_name}\n行号: {n}" for n in row_numbers], index=df.index)
+        texts = (prefix.str.cat([f"{col}: " + values[col] for col in ordered_columns], sep="\n") + "\n").tolist()
+
+        field_values = {
+            key: cells[col].where(cells[col].notna(), "").astype(str).str.strip().tolist()
+            for key, col in field_columns.items()
+        }
+
+        documents = []
+        step = self.excel_rows_per_chunk
+        for start in range(0, len(texts), step):
+            end = min(start + step, len(texts))
+            metadata = {
+                "source": source,
+                "sheet": sheet_name,
+                "row": row_numbers[start],
+                "type": "excel_data",
+                "structured": bool(field_columns)
+            }
+            if step > 1:
+                metadata["row_end"] = row_numbers[end - 1]
+            # 合并多行时只保留各行取值相同的字段（如所属模块、优先级）
+            for key, column_values in field_values.items():
+                group_values = set(column_values[start:end])
+                if len(group_values) == 1:
+                    value = group_values.pop()
+                    if value:
+                        metadata[key] = value
+            documents.append(Document(page_content="".join(texts[start:end]), metadata=metadata))
+        return documents
+
+    def _iter_document_batches(self, file_path: str, stats: Dict = None) -> Iterator[List[Document]]:
+        """按文件类型选择解析器逐批产出文档块，Excel按行流式读取，其他格式逐段切分"""
+        extractor = get_extractor(file_path)
+        if extractor is None:
+            raise ValueError(f"不支持的文件类型: {os.path.splitext(file_path)[1].lower()}")
+        if extractor.structured:
+            yield from self._iter_excel_batches(file_path, stats=stats, extractor=extractor)
+        else:
+            yield from self._iter_segment_batches(extractor, file_path, stats=stats)
+
+    def _iter_segment_batches(self, extractor: Extractor, file_path: str,
+                              stats: Dict = None) -> Iterator[List[Document]]:
+        """
+        逐段切分解析器产出的文本，段的元数据（如PDF页码）附加到文档块
+
+        每 SEGMENT_BATCH_SIZE 段或累计 ingest_batch_size 个文档块产出一批
+        """
+        filename = os.path.basename(file_path)
+        batch = []
+        segments = 0
+        for text, metadata in extractor.iter_segments(file_path):
+            batch.extend(self._text_to_documents(text, filename, metadata or None))
+            segments += 1
+            if stats is not None:
+                stats["segments"] = segments
+            if batch and (segments % self.SEGMENT_BATCH_SIZE == 0 or len(batch) >= self.ingest_batch_size):
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _record_ingest_stats(self, filename: str, chunks: int, stats: Dict, start_time: float) -> Dict:
+        """记录、打印并返回入库吞吐（行/秒、块/秒）"""
+        elapsed = max(time.time() - start_time, 1e-6)
+        rows = stats.get("rows", 0)
+        self.last_ingest_stats = {
+            "file": filename,
+            "rows": rows,
+            "chunks": chunks,
+            "duplicates": stats.get("duplicates", 0),
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(rows / elapsed, 1),
+            "chunks_per_sec": round(chunks / elapsed, 1)
+        }
+        if rows:
+            print(f"入库吞吐: {filename} 共 {rows} 行，{chunks} 个文档块，耗时 {elapsed:.2f} 秒，{rows / elapsed:.0f} 行/秒")
+        if stats.get("duplicates"):
+            print(f"合并重复文档块: {filename} 共 {stats['duplicates']} 个")
+        return self.last_ingest_stats
+
+    def _text_to_documents(self, text: str, filename: str, extra_metadata: Dict = None) -> List[Document]:
+        """用配置的切分器将文本分割为适当大小的块，extra_metadata 附加到每个块（如PDF页码）"""
         if not text or text.strip() == "":
             return []
             
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50,
-            length_function=len
-        )
-        
-        chunks = splitter.split_text(text)
+        chunks = [(chunk, extra) for chunk, extra in self.chunker.split(text) if chunk.strip() != ""]
         return [
             Document(
                 page_content=chunk,
@@ -123,84 +828,557 @@ class KnowledgeBase:
                     "source": filename,
                     "chunk_index": i,
                     "total_chunks": len(chunks),
-                    "type": "text_chunk"
+                    "type": "text_chunk",
+                    **(extra_metadata or {}),
+                    **extra
                 }
             )
-            for i, chunk in enumerate(chunks) if chunk.strip() != ""
+            for i, (chunk, extra) in enumerate(chunks)
         ]
 
-    def add_document(self, file_path: str) -> bool:
-        """添加文档到知识库"""
+    def add_document(self, file_path: str, progress_callback: Callable[[int], None] = None,
+                     result_callback: Callable[[Dict, str], None] = None) -> bool:
+        """
+        添加文档到知识库，文档块按批读取、嵌入并写入，全部完成后发布一次新版本
+
+        Args:
+            file_path: 文件路径
+            progress_callback: 每批写入后以已写入的文档块数量调用，抛出异常可取消本次入库
+            result_callback: 结束时以本次入库的统计和失败原因（成功时为None）调用；
+                  last_ingest_stats/last_error 会被同一实例上并发的入库覆盖，需要本次结果时使用该回调
+
+        Returns:
+            是否成功，失败原因记录在 last_error 中
+        """
+        stats, error = {}, None
         try:
-            filename = os.path.basename(file_path)
-            ext = os.path.splitext(filename)[1].lower()
-            
-            documents = []
-            
-            # 根据文件类型处理
-            if ext in ['.xlsx', '.xls']:
-                # Excel文件处理
-                documents = self._excel_to_documents(file_path)
-            elif ext in ['.txt', '.csv']:
-                # 文本文件处理
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text = f.read()
-                documents = self._text_to_documents(text, filename)
-            elif ext in ['.docx', '.pdf']:
-                # Word/PDF文件处理
-                from .document_processor import DocumentProcessor
-                if ext == '.docx':
-                    text = DocumentProcessor.read_word(file_path)
-                else:
-                    text = DocumentProcessor.read_pdf(file_path)
-                documents = self._text_to_documents(text, filename)
-            else:
-                print(f"不支持的文件类型: {ext}")
-                return False
-            
-            if not documents:
+            stats, error = self._ingest_file(file_path, progress_callback)
+        except Exception as e:
+            print(f"添加文档到知识库失败: {str(e)}")
+            traceback.print_exc()
+            error = str(e) or type(e).__name__
+        self.last_error = error
+        if error is None:
+            self.last_ingest_stats = stats
+        if result_callback is not None:
+            result_callback(stats, error)
+        return error is None
+
+    def _ingest_file(self, file_path: str, progress_callback: Callable[[int], None] = None) -> Tuple[Dict, str]:
+        """入库一个文件，返回 (本次入库的统计, 失败原因)，成功时失败原因为None"""
+        filename = os.path.basename(file_path)
+        ext = os.path.splitext(filename)[1].lower()
+
+        if get_extractor(file_path) is None:
+            print(f"不支持的文件类型: {ext}")
+            return {}, f"不支持的文件类型: {ext}"
+
+        # 写入在独立的写入器上进行，期间搜索继续使用已发布的快照
+        with self._write_transaction() as writer:
+            signature = self._file_signature(file_path)
+            state = writer._get_file_state()
+            if filename in state and state[filename].get("sha256") == signature["sha256"]:
+                # 监视器或之前的任务已经入库了相同内容，只更新记录的修改时间
+                entry = dict(state[filename], mtime=signature["mtime"], size=signature["size"])
+                state[filename] = entry
+                if self._file_state is not None:
+                    self._file_state[filename] = entry
+                print(f"文件内容未变化，无需重新入库: {filename}")
+                return {"file": filename, "chunks": entry.get("chunks", 0), "unchanged": True}, None
+            # 同名文件已入库时替换旧内容
+            if filename in state:
+                writer._remove_file_chunks(filename)
+            previous_docstore = writer._vectorstore.docstore if writer._vectorstore else None
+            # 如果只有初始化文档，重新创建索引；否则追加到共享索引的可写副本
+            # 新文档块直接增量写入SQLite，索引文件中只保存向量和ID映射
+            rebuild = writer._index_is_empty()
+
+            start_time = time.time()
+            stats = {}
+            count = writer._ingest_batches(writer._iter_document_batches(file_path, stats), rebuild=rebuild,
+                                           progress_callback=progress_callback, stats=stats)
+
+            if not count:
                 print(f"未从文件 {filename} 中提取到内容")
-                return False
-            
-            # 检查当前索引是否只有初始化文档
-            current_docs_count = len(self._vectorstore.index_to_docstore_id) if self._vectorstore else 0
-            
-            # 添加到向量存储
-            if current_docs_count == 1 and self._is_initialization_doc_only():
-                # 如果只有初始化文档，重新创建索引
-                self._vectorstore = FAISS.from_documents(documents, self._embeddings)
+                return {}, f"未从文件 {filename} 中提取到内容"
+
+            writer._file_state = dict(state, **{filename: dict(signature, chunks=count)})
+            writer._publish_vectorstore()
+            if rebuild:
+                writer._prune_docstore(previous_docstore)
+            result = writer._record_ingest_stats(filename, count, stats, start_time)
+
+        print(f"成功添加 {count} 个文档块到知识库: {filename}")
+        return result, None
+
+    @staticmethod
+    def _file_signature(file_path: str) -> Dict:
+        """文件的修改时间、大小和内容哈希"""
+        stat = os.stat(file_path)
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(block)
+        return {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha256.hexdigest()}
+
+    def _list_kb_files(self) -> Dict[str, os.stat_result]:
+        """知识库目录中支持的文件（跳过隐藏文件和Office临时文件）"""
+        files = {}
+        for name in os.listdir(self.KB_FILES_DIR):
+            if name.startswith(('.', '~$')) or get_extractor(name) is None:
+                continue
+            path = os.path.join(self.KB_FILES_DIR, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                files[name] = stat
+        return files
+
+    def _get_file_state(self) -> Dict[str, Dict]:
+        """
+        已入库文件的状态，旧版本索引没有保存时按索引中出现的来源补建
+
+        补建的记录没有内容哈希：文件的修改时间或大小变化后才会重新入库，
+        同名文件再次上传时总是替换。
+        """
+        if self._file_state is None:
+            state = {}
+            docstore = self._vectorstore.docstore if self._vectorstore else None
+            if isinstance(docstore, SQLiteDocstore):
+                indexed = set(docstore.list_sources())
             else:
-                # 正常添加文档
-                self._vectorstore.add_documents(documents)
-            
-            self._vectorstore.save_local(self.index_path)
-            
-            print(f"成功添加 {len(documents)} 个文档块到知识库: {filename}")
-            return True
-            
+                ids = list(self._vectorstore.index_to_docstore_id.values()) if self._vectorstore else []
+                indexed = set()
+                for doc in self._fetch_documents(ids).values():
+                    indexed.update(doc.metadata.get("sources") or [doc.metadata.get("source")])
+            for name, stat in self._list_kb_files().items():
+                if name in indexed:
+                    state[name] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": None, "chunks": None}
+            self._file_state = state
+            print(f"已根据索引内容补建 {len(state)} 个文件的入库状态")
+        return self._file_state
+
+    def _index_is_empty(self) -> bool:
+        """向量库中没有任何文件的文档块（只有初始化文档或全部被移除）"""
+        return (not self._vectorstore or not self._vectorstore.index_to_docstore_id
+                or self._is_initialization_doc_only())
+
+    def _remove_file_chunks(self, filename: str):
+        """
+        从可写副本中移除来源为该文件的文档块
+
+        合并了其他文件重复内容的文档块只去掉该来源，内容和向量保留，以新的向量ID写入更新后的元数据。
+        已发布的旧版本仍引用被移除和被替换的文档块，这些行在新版本发布后标记退役，
+        等引用它们的版本目录清理后才删除（见 _release_retired_chunks）。
+        """
+        if self._index_is_empty():
+            return
+        self._ensure_writable()
+        source_filter = {"source": filename}
+        docstore = self._vectorstore.docstore
+        doc_ids = docstore.filter_ids(source_filter) if isinstance(docstore, SQLiteDocstore) else None
+        if doc_ids is None:
+            doc_ids = list(self._vectorstore.index_to_docstore_id.values())
+        docs = self._fetch_documents(list(self._positions(doc_ids)))
+
+        removed, updates = [], {}
+        for doc_id, doc in docs.items():
+            metadata = doc.metadata
+            if not matches_metadata_filter(metadata, source_filter):
+                continue
+            sources = [source for source in metadata.get("sources") or [] if source != filename]
+            if not sources:
+                removed.append(doc_id)
+                continue
+            metadata = dict(metadata, sources=sources, duplicate_count=len(sources) - 1)
+            if metadata.get("source") == filename:
+                metadata["source"] = sources[0]
+            updates[doc_id] = Document(page_content=doc.page_content, metadata=metadata)
+
+        if removed:
+            keyword_index = self._get_keyword_index()
+            dedup_index = self._get_dedup_index()
+            index_to_docstore_id = self._vectorstore.index_to_docstore_id
+            drop = set(self._positions(removed).values())
+            self._vectorstore.index.remove_ids(np.array(sorted(drop), dtype=np.int64))
+            # FAISS删除后其余向量依次前移，ID映射按原顺序重新编号
+            remaining = [doc_id for position, doc_id in sorted(index_to_docstore_id.items()) if position not in drop]
+            self._vectorstore.index_to_docstore_id = dict(enumerate(remaining))
+            for doc_id in removed:
+                keyword_index.remove(doc_id)
+            dedup_index.remove_many(removed)
+            self._retired_ids = self._retired_ids + removed
+        if updates and isinstance(docstore, SQLiteDocstore):
+            self._replace_chunks(updates)
+        print(f"从索引中移除 {filename}：删除 {len(removed)} 个文档块，更新 {len(updates)} 个合并文档块的来源")
+
+    def sync_files(self, settle_seconds: float = 2.0, skip_files: Iterable[str] = ()) -> Dict:
+        """
+        增量同步知识库目录：只重新解析和嵌入新增、修改的文件，移除已删除文件的文档块，完成后发布一次新版本
+
+        先只比较文件的修改时间和大小，没有变化时不加写锁、不计算哈希，适合定期调用；
+        修改时间变化但内容哈希相同的文件只更新记录。修改时间在 settle_seconds 内的文件可能还在复制，留到下次处理。
+        skip_files 中仍在目录里的文件既不入库也不移除（如入库任务排队中、处理中、已取消或失败的上传文件）。
+
+        Returns:
+            {"added": [...], "changed": [...], "removed": [...], "failed": {文件名: 原因}, "chunks": 写入的文档块数}
+        """
+        result = {"added": [], "changed": [], "removed": [], "failed": {}, "chunks": 0}
+        self._refresh_if_stale()
+        if self._vectorstore is None:
+            return result
+        skip_files = set(skip_files)
+        if self._file_state is not None and not self._files_changed(self._file_state, settle_seconds, skip_files):
+            return result
+
+        try:
+            with self._write_transaction() as writer:
+                touched = writer._sync_files_locked(result, settle_seconds, skip_files)
+            # 只有修改时间变化的文件不发布新版本，直接更新本实例的记录
+            if touched and self._file_state is not None:
+                self._file_state.update(touched)
         except Exception as e:
-            print(f"添加文档到知识库失败: {str(e)}")
+            print(f"同步知识库文件失败: {str(e)}")
             traceback.print_exc()
-            return False
+            result["error"] = str(e)
+        return result
+
+    def _files_changed(self, state: Dict[str, Dict], settle_seconds: float, skip_files: set = frozenset()) -> bool:
+        """按修改时间和大小快速判断目录是否可能有变化，跳过的文件只在从目录删除后才算变化"""
+        files = self._list_kb_files()
+        skipped = skip_files & set(files)
+        if set(files) - skipped != set(state) - skipped:
+            return True
+        return any(
+            (stat.st_mtime, stat.st_size) != (state[name].get("mtime"), state[name].get("size"))
+            and time.time() - stat.st_mtime >= settle_seconds
+            for name, stat in files.items() if name not in skipped
+        )
+
+    def _sync_files_locked(self, result: Dict, settle_seconds: float,
+                           skip_files: set = frozenset()) -> Dict[str, Dict]:
+        """在写事务中执行增量同步（由写入器调用），返回只有修改时间变化的文件的新记录"""
+        start_time = time.time()
+        state = dict(self._get_file_state())
+        files = self._list_kb_files()
+        touched = {}
+
+        pending = []  # [(文件名, 签名, 是否已入库)]
+        for name, stat in sorted(files.items()):
+            if name in skip_files or time.time() - stat.st_mtime < settle_seconds:
+                continue
+            known = state.get(name)
+            if known and (stat.st_mtime, stat.st_size) == (known.get("mtime"), known.get("size")):
+                continue
+            signature = self._file_signature(os.path.join(self.KB_FILES_DIR, name))
+            if known and known.get("sha256") == signature["sha256"]:
+                state[name] = touched[name] = dict(known, mtime=signature["mtime"], size=signature["size"])
+                continue
+            pending.append((name, signature, known is not None))
+        removed_files = [name for name in state if name not in files]
+
+        if not pending and not removed_files:
+            return touched
+
+        previous_docstore = self._vectorstore.docstore
+
+        for name in removed_files:
+            self._remove_file_chunks(name)
+            state.pop(name, None)
+            result["removed"].append(name)
+
+        for name, signature, known in pending:
+            if known:
+                self._remove_file_chunks(name)
+                state.pop(name, None)
+            rebuild = self._index_is_empty()
+            file_start = time.time()
+            stats = {}
+            try:
+                count = self._ingest_batches(
+                    self._iter_document_batches(os.path.join(self.KB_FILES_DIR, name), stats), rebuild=rebuild, stats=stats
+                )
+            except Exception as e:
+                print(f"处理文件 {name} 失败: {str(e)}")
+                result["failed"][name] = str(e) or type(e).__name__
+                # 丢弃已写入的部分文档块，下次扫描重新处理
+                if not self._index_is_empty():
+                    self._remove_file_chunks(name)
+                continue
+            state[name] = dict(signature, chunks=count)
+            result["changed" if known else "added"].append(name)
+            result["chunks"] += count
+            self._record_ingest_stats(name, count, stats, file_start)
+
+        if self._index_is_empty() and not (self._vectorstore and self._vectorstore.index_to_docstore_id):
+            # 所有文件都被删除
+            self._build_vectorstore([])
+        self._file_state = state
+        self._publish_vectorstore()
+        # 重建过向量库时旧文档块属于上一次构建，随构建一起清理；移除的文档块在发布时已标记退役
+        rebuilt = getattr(self._vectorstore.docstore, "build_id", None) != getattr(previous_docstore, "build_id", None)
+        if rebuilt:
+            self._prune_docstore(previous_docstore)
+        print(f"知识库文件同步完成：新增 {len(result['added'])}，修改 {len(result['changed'])}，"
+              f"删除 {len(result['removed'])}，失败 {len(result['failed'])}，"
+              f"写入 {result['chunks']} 个文档块，耗时 {time.time() - start_time:.2f} 秒")
+        return touched
 
     def _is_initialization_doc_only(self) -> bool:
-        """检查是否只有初始化文档"""
+        """检查是否只有初始化文档（读取索引状态，不做搜索）"""
         if not self._vectorstore:
             return False
-        
+        return self._initialization_only
+
+    def _embed_query(self, query: str) -> List[float]:
+        """计算查询向量，重复的查询直接使用缓存"""
+        return self._query_cache.get_or_compute(query, self._embeddings.embed_query)
+
+    def get_cache_stats(self) -> Dict:
+        """查询向量缓存的命中率统计"""
+        return self._query_cache.stats()
+
+    @staticmethod
+    def _is_initialization_doc(doc: Document) -> bool:
+        return doc.page_content == "系统初始化文档" and doc.metadata.get("source") == "system"
+
+    def _get_keyword_index(self) -> BM25Index:
+        """获取关键词索引，旧版本索引没有保存倒排表时从文档存储补建"""
+        if self._keyword_index is None:
+            ids = list(self._vectorstore.index_to_docstore_id.values())
+            keyword_index = BM25Index()
+            keyword_index.add_documents(self._fetch_documents(ids).items())
+            self._keyword_index = keyword_index
+            print(f"已为 {len(keyword_index)} 个文档块补建关键词索引")
+        return self._keyword_index
+
+    def _fetch_documents(self, doc_ids: List[str]) -> Dict[str, Document]:
+        """按向量ID读取文档块"""
+        docstore = self._vectorstore.docstore
+        if isinstance(docstore, SQLiteDocstore):
+            return docstore.search_many(doc_ids)
+        docs = {}
+        for doc_id in doc_ids:
+            doc = docstore.search(doc_id)
+            if isinstance(doc, Document):
+                docs[doc_id] = doc
+        return docs
+
+    def _positions(self, doc_ids: List[str]) -> Dict[str, int]:
+        """向量ID到索引位置的映射，向量库变化后重新计算"""
+        index_to_docstore_id = self._vectorstore.index_to_docstore_id
+        key = (id(index_to_docstore_id), len(index_to_docstore_id))
+        if key != self._id_to_position_key:
+            self._id_to_position = {doc_id: pos for pos, doc_id in index_to_docstore_id.items()}
+            self._id_to_position_key = key
+        return {doc_id: self._id_to_position[doc_id] for doc_id in doc_ids if doc_id in self._id_to_position}
+
+    def _query_vector(self, embedding: List[float]) -> np.ndarray:
+        """转换为FAISS查询向量，余弦度量下先归一化"""
+        vector = np.array([embedding], dtype=np.float32)
+        if self._index_metric == "cosine":
+            faiss.normalize_L2(vector)
+        return vector
+
+    def _vector_scores(self, embedding: List[float], doc_ids: List[str]) -> Dict[str, float]:
+        """计算查询向量与指定文档块的分数，与向量搜索返回的分数口径一致"""
+        query_vector = self._query_vector(embedding)[0]
+        scores = {}
+        for doc_id, position in self._positions(doc_ids).items():
+            vector = self._vectorstore.index.reconstruct(int(position))
+            if self._index_metric == "cosine":
+                scores[doc_id] = float(np.dot(query_vector, vector))
+            else:
+                scores[doc_id] = float(np.sum((query_vector - vector) ** 2))
+        return scores
+
+    @staticmethod
+    def _filter_key(metadata_filter: Dict) -> tuple:
+        return tuple(sorted(
+            (str(key), tuple(value) if isinstance(value, list) else value)
+            for key, value in metadata_filter.items()
+        ))
+
+    def _filter_positions(self, metadata_filter: Dict) -> Union[np.ndarray, None]:
+        """
+        满足元数据过滤条件的索引位置（升序），条件在文档存储中求值并按向量库版本缓存
+
+        文档存储不是SQLite或条件无法在SQL中表达时返回None，调用方退回多取再逐条过滤。
+        """
+        docstore = self._vectorstore.docstore
+        if not isinstance(docstore, SQLiteDocstore):
+            return None
+        index_to_docstore_id = self._vectorstore.index_to_docstore_id
         try:
-            # 获取所有文档
-            all_docs = self._vectorstore.similarity_search("", k=10)
-            if len(all_docs) == 1:
-                doc = all_docs[0]
-                return (doc.page_content == "系统初始化文档" and 
-                        doc.metadata.get("source") == "system")
-            return False
-        except:
-            return False
+            cache_key = (id(index_to_docstore_id), len(index_to_docstore_id), self._filter_key(metadata_filter))
+            hash(cache_key)
+        except TypeError:
+            return None
+        positions = self._filter_cache.get(cache_key)
+        if positions is not None:
+            return positions
+
+        doc_ids = docstore.filter_ids(metadata_filter)
+        if doc_ids is None:
+            return None
+        positions = np.array(sorted(self._positions(doc_ids).values()), dtype=np.int64)
+        self._filter_cache[cache_key] = positions
+        while len(self._filter_cache) > self.FILTER_CACHE_SIZE:
+            self._filter_cache.popitem(last=False)
+        return positions
+
+    def _subset_scores(self, query_vector: np.ndarray, positions: np.ndarray) -> np.ndarray:
+        """直接取出指定位置的向量计算分数，口径与向量搜索一致"""
+        vectors = self._vectorstore.index.reconstruct_batch(positions)
+        if self._index_metric == "cosine":
+            return vectors @ query_vector[0]
+        return ((vectors - query_vector[0]) ** 2).sum(axis=1)
+
+    def _search_positions(self, embedding: List[float], k: int,
+                          positions: np.ndarray) -> List[Tuple[Document, float]]:
+        """
+        只在指定索引位置中做向量搜索，返回前k个 (文档, 分数)
+
+        候选较少时直接计算分数；较多时把位置作为ID选择器传入FAISS，
+        在索引内部跳过不满足条件的向量，不需要多取再过滤就能返回完整的前k个。
+        """
+        if k <= 0 or len(positions) == 0:
+            return []
+        query_vector = self._query_vector(embedding)
+        k = min(k, len(positions))
+        if len(positions) <= self.DIRECT_SCORE_LIMIT:
+            scores = self._subset_scores(query_vector, positions)
+            order = np.argsort(-scores if self._index_metric == "cosine" else scores, kind="stable")[:k]
+            hits = [(int(positions[i]), float(scores[i])) for i in order]
+        else:
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(positions))
+            scores, labels = self._vectorstore.index.search(query_vector, k, params=params)
+            hits = [(int(label), float(score)) for score, label in zip(scores[0], labels[0]) if label >= 0]
+
+        index_to_docstore_id = self._vectorstore.index_to_docstore_id
+        doc_ids = [index_to_docstore_id[position] for position, _ in hits]
+        docs = self._fetch_documents(doc_ids)
+        return [(docs[doc_id], score) for doc_id, (_, score) in zip(doc_ids, hits)
+                if doc_id in docs and not self._is_initialization_doc(docs[doc_id])]
+
+    def _search_positions_by_threshold(self, query_vector: np.ndarray, min_similarity: float,
+                                       positions: np.ndarray) -> List[Tuple[float, int]]:
+        """余弦索引中只在指定位置内做范围搜索，返回 [(相似度, 位置)]"""
+        if len(positions) == 0:
+            return []
+        if len(positions) <= self.DIRECT_SCORE_LIMIT:
+            scores = self._subset_scores(query_vector, positions)
+            keep = np.nonzero(scores >= min_similarity)[0]
+            return [(float(scores[i]), int(positions[i])) for i in keep]
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(positions))
+        lims, similarities, labels = self._vectorstore.index.range_search(
+            query_vector, float(min_similarity), params=params
+        )
+        return list(zip(similarities[lims[0]:lims[1]].tolist(), labels[lims[0]:lims[1]].tolist()))
+
+    def _check_mode(self, mode: str):
+        if mode not in self.RETRIEVAL_MODES:
+            raise ValueError(f"不支持的检索模式: {mode}，可选: {', '.join(self.RETRIEVAL_MODES)}")
+
+    def _retrieve(self, query: str, k: int, mode: str = "vector",
+                  metadata_filter: Dict = None) -> List[Tuple[Document, float]]:
+        """
+        按检索模式返回前k个 (文档, 向量距离)，已过滤初始化文档
+
+        关键词模式和混合模式中只被BM25召回的文档，也会补算向量距离，
+        保证 search_with_score 的分数在各模式下含义一致。
+        有过滤条件时向量检索和BM25都只在满足条件的文档块中进行，直接得到完整的前k个。
+        """
+        embedding = self._embed_query(query)
+        # 过滤条件能在文档存储中求值时，只在满足条件的索引位置中搜索
+        positions = self._filter_positions(metadata_filter) if metadata_filter else None
+        fetch_k = max(k * 4, 20) if metadata_filter else k
+        # 退回逐条过滤时与关键词检索使用同一套过滤规则（合并的重复文档块按任一来源匹配）
+        vector_filter = (lambda metadata: matches_metadata_filter(metadata, metadata_filter)) if metadata_filter else None
+        if mode == "vector":
+            if positions is not None:
+                return self._search_positions(embedding, k, positions)
+            docs_with_scores = self._vectorstore.similarity_search_with_score_by_vector(
+                embedding, k=k, filter=vector_filter, fetch_k=fetch_k
+            )
+            return [(doc, score) for doc, score in docs_with_scores if not self._is_initialization_doc(doc)]
 
-    def search(self, query: str, k: int = 5) -> List[Tuple[str, Dict]]:
-        """搜索知识库"""
+        keyword_k = k * 2 if mode == "hybrid" else k
+        docs = {}
+        if positions is not None:
+            index_to_docstore_id = self._vectorstore.index_to_docstore_id
+            allowed_ids = {index_to_docstore_id[int(position)] for position in positions}
+            keyword_ids = [doc_id for doc_id, _ in
+                           self._get_keyword_index().search(query, k=keyword_k, allowed_ids=allowed_ids)]
+        else:
+            keyword_ids = [doc_id for doc_id, _ in self._get_keyword_index().search(query, k=fetch_k * 2 if metadata_filter else keyword_k)]
+            if metadata_filter:
+                docs = self._fetch_documents(keyword_ids)
+                keyword_ids = [
+                    doc_id for doc_id in keyword_ids
+                    if doc_id in docs and matches_metadata_filter(docs[doc_id].metadata, metadata_filter)
+                ][:keyword_k]
+
+        hits = {}
+        if mode == "hybrid":
+            if positions is not None:
+                vector_results = self._search_positions(embedding, keyword_k, positions)
+            else:
+                vector_results = self._vectorstore.similarity_search_with_score_by_vector(
+                    embedding, k=keyword_k, filter=vector_filter, fetch_k=fetch_k * 2
+                )
+            for doc, score in vector_results:
+                if not self._is_initialization_doc(doc):
+                    hits[doc.id] = (doc, score)
+            ranked_ids = reciprocal_rank_fusion([list(hits), keyword_ids])[:k]
+        else:
+            ranked_ids = keyword_ids[:k]
+
+        missing_ids = [doc_id for doc_id in ranked_ids if doc_id not in hits]
+        if missing_ids:
+            docs.update(self._fetch_documents([doc_id for doc_id in missing_ids if doc_id not in docs]))
+            scores = self._vector_scores(embedding, missing_ids)
+            for doc_id in missing_ids:
+                if doc_id in docs and doc_id in scores:
+                    hits[doc_id] = (docs[doc_id], scores[doc_id])
+
+        return [hits[doc_id] for doc_id in ranked_ids if doc_id in hits]
+
+    def _format_content(self, doc: Document) -> str:
+        """格式化搜索结果内容，旧版本的Excel文档块尝试提取更结构化的信息"""
+        content = doc.page_content
+        # 入库时已提取字段的文档块，关键字段已排在内容最前面，直接返回
+        if doc.metadata.get('type') != 'excel_data' or 'structured' in doc.metadata:
+            return content
+        
+        extracted_info = {}
+        for pattern, key in _LEGACY_TEST_CASE_PATTERNS:
+            matches = pattern.findall(content)
+            if matches:
+                extracted_info[key] = matches[0]
+        
+        if extracted_info:
+            content = f"提取的测试信息:\n" + "\n".join([f"{k}: {v}" for k, v in extracted_info.items()]) + f"\n\n原始内容:\n{content}"
+        return content
+
+    @_read_snapshot
+    def search(self, query: str, k: int = 5, mode: str = "vector",
+               metadata_filter: Dict = None) -> List[Tuple[str, Dict]]:
+        """
+        搜索知识库
+
+        Args:
+            query: 查询文本
+            k: 返回结果数量
+            mode: 检索模式，"vector" 向量检索，"keyword" BM25关键词检索，
+                  "hybrid" 两者倒数排名融合（适合FP12、字段名、错误码等精确标识符）
+            metadata_filter: 元数据过滤条件，如 {"source": "用例库.xlsx", "type": "excel_data", "priority": ["P0", "P1"]}，
+                  可按来源文件、工作表（sheet）、文档块类型（type）以及Excel测试用例入库时提取的字段
+                  （test_case_title、module、priority等）过滤；条件在索引搜索内部生效，不会因过滤而少于k个结果
+        """
+        self._check_mode(mode)
         if not self._vectorstore:
             return []
         
@@ -209,41 +1387,10 @@ class KnowledgeBase:
             if self._is_initialization_doc_only() and query.strip():
                 return []
             
-            # 执行相似度搜索
-            docs = self._vectorstore.similarity_search(query, k=k)
-            
-            # 过滤掉初始化文档
-            filtered_docs = []
-            for doc in docs:
-                if not (doc.page_content == "系统初始化文档" and doc.metadata.get("source") == "system"):
-                    filtered_docs.append(doc)
-            
             # 格式化结果
             results = []
-            for doc in filtered_docs:
-                content = doc.page_content
-                metadata = doc.metadata
-                
-                # 如果是Excel数据，尝试提取更结构化的信息
-                if metadata.get('type') == 'excel_data':
-                    test_case_patterns = [
-                        r'测试用例[名称|标题][:：]\s*(.+)',
-                        r'用例[名称|标题][:：]\s*(.+)',
-                        r'测试步骤[:：]\s*(.+)',
-                        r'预期结果[:：]\s*(.+)'
-                    ]
-                    
-                    extracted_info = {}
-                    for pattern in test_case_patterns:
-                        matches = re.findall(pattern, content)
-                        if matches:
-                            key = re.search(r'([^:：]+)[:：]', pattern).group(1)
-                            extracted_info[key] = matches[0]
-                    
-                    if extracted_info:
-                        content = f"提取的测试信息:\n" + "\n".join([f"{k}: {v}" for k, v in extracted_info.items()]) + f"\n\n原始内容:\n{content}"
-                
-                results.append((content, metadata))
+            for doc, _ in self._retrieve(query, k, mode, metadata_filter):
+                results.append((self._format_content(doc), doc.metadata))
             
             return results
             
@@ -254,83 +1401,75 @@ class KnowledgeBase:
     def rebuild_index(self):
         """完全重建知识库索引 - 修复版本"""
         try:
-            # 删除现有索引文件
-            index_files = [os.path.join(self.index_path, f) for f in os.listdir(self.index_path) 
-                          if f.startswith("index.")]
-            for file_path in index_files:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    print(f"已删除索引文件: {file_path}")
+            # 新索引在写入器上构建并写入新版本目录，完成后原子切换，重建期间旧索引仍可搜索
+            with self._write_transaction() as writer:
+                return writer._rebuild_index_locked()
+        except Exception as e:
+            print(f"重建索引失败: {str(e)}")
+            traceback.print_exc()
+            return False
+
+    def _rebuild_index_locked(self) -> bool:
+        """在写事务中重建索引（由写入器调用）"""
+        previous_docstore = self._vectorstore.docstore if self._vectorstore else None
+        # 重新添加所有文件
+        kb_files = [f for f in os.listdir(self.KB_FILES_DIR) 
+                   if not f.startswith('.') and os.path.isfile(os.path.join(self.KB_FILES_DIR, f))]
+        
+        if not kb_files:
+            print("知识库中没有文件，创建空索引")
+            # 使用虚拟文档创建索引
+            self._build_vectorstore([])
+            self._publish_vectorstore()
+            self._prune_docstore(previous_docstore)
+            print("已创建空知识库索引")
+            return True
+        
+        success_count = 0
+        total_count = 0
+        file_state = {}
+        
+        # 逐个文件流式读取并写入新索引
+        for filename in kb_files:
+            file_path = os.path.join(self.KB_FILES_DIR, filename)
+            print(f"处理文件: {filename}")
             
-            # 重新添加所有文件
-            kb_files = [f for f in os.listdir(self.KB_FILES_DIR) 
-                       if not f.startswith('.') and os.path.isfile(os.path.join(self.KB_FILES_DIR, f))]
+            if get_extractor(filename) is None:
+                print(f"无法从 {filename} 提取内容")
+                continue
             
-            if not kb_files:
-                print("知识库中没有文件，创建空索引")
-                # 使用虚拟文档创建索引
-                dummy_doc = Document(
-                    page_content="系统初始化文档",
-                    metadata={"source": "system", "type": "initialization"}
+            start_time = time.time()
+            stats = {}
+            try:
+                file_count = self._ingest_batches(
+                    self._iter_document_batches(file_path, stats), rebuild=total_count == 0, stats=stats
                 )
-                self._vectorstore = FAISS.from_documents([dummy_doc], self._embeddings)
-                self._vectorstore.save_local(self.index_path)
-                print("已创建空知识库索引")
-                return True
-            
-            success_count = 0
-            documents = []
-            
-            # 首先收集所有文档
-            for filename in kb_files:
-                file_path = os.path.join(self.KB_FILES_DIR, filename)
-                print(f"处理文件: {filename}")
-                
-                ext = os.path.splitext(filename)[1].lower()
-                file_documents = []
-                
-                # 根据文件类型处理
-                if ext in ['.xlsx', '.xls']:
-                    file_documents = self._excel_to_documents(file_path)
-                elif ext in ['.txt', '.csv']:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        text = f.read()
-                    file_documents = self._text_to_documents(text, filename)
-                elif ext in ['.docx', '.pdf']:
-                    from .document_processor import DocumentProcessor
-                    if ext == '.docx':
-                        text = DocumentProcessor.read_word(file_path)
-                    else:
-                        text = DocumentProcessor.read_pdf(file_path)
-                    file_documents = self._text_to_documents(text, filename)
-                
-                if file_documents:
-                    documents.extend(file_documents)
-                    success_count += 1
-                    print(f"成功处理 {filename}，添加 {len(file_documents)} 个文档块")
-                else:
-                    print(f"无法从 {filename} 提取内容")
+            except Exception as e:
+                print(f"处理文件 {filename} 失败: {str(e)}")
+                file_count = 0
             
-            if documents:
-                # 使用所有文档创建新索引
-                self._vectorstore = FAISS.from_documents(documents, self._embeddings)
-                self._vectorstore.save_local(self.index_path)
-                print(f"知识库索引重建完成，成功添加 {success_count}/{len(kb_files)} 个文件，共 {len(documents)} 个文档块")
+            if file_count:
+                total_count += file_count
+                success_count += 1
+                file_state[filename] = dict(self._file_signature(file_path), chunks=file_count)
+                self._record_ingest_stats(filename, file_count, stats, start_time)
+                print(f"成功处理 {filename}，添加 {file_count} 个文档块")
             else:
-                print("没有可用的文档内容，创建空索引")
-                dummy_doc = Document(
-                    page_content="系统初始化文档",
-                    metadata={"source": "system", "type": "initialization"}
-                )
-                self._vectorstore = FAISS.from_documents([dummy_doc], self._embeddings)
-                self._vectorstore.save_local(self.index_path)
-            
-            return True
-            
-        except Exception as e:
-            print(f"重建索引失败: {str(e)}")
-            traceback.print_exc()
-            return False
+                print(f"无法从 {filename} 提取内容")
+        
+        if total_count:
+            # 使用所有文档创建新索引
+            self._file_state = file_state
+            self._publish_vectorstore()
+            self._prune_docstore(previous_docstore)
+            print(f"知识库索引重建完成，成功添加 {success_count}/{len(kb_files)} 个文件，共 {total_count} 个文档块")
+        else:
+            print("没有可用的文档内容，创建空索引")
+            self._build_vectorstore([])
+            self._publish_vectorstore()
+            self._prune_docstore(previous_docstore)
+        
+        return True
 
     def get_all_documents(self) -> List[Dict]:
         """获取知识库中的所有文档内容 - 修复版本"""
@@ -358,9 +1497,15 @@ class KnowledgeBase:
     
         try:
             # 检查索引文件是否存在
-            index_files = [f for f in os.listdir(self.index_path) 
-                          if f.startswith("index.")]
-            status["index_exists"] = len(index_files) > 0
+            self._refresh_if_stale()
+            status["index_exists"] = self._store.current_version() is not None
+            status["index_version"] = self._index_version
+            status["namespace"] = self.namespace
+            status["query_cache"] = self.get_cache_stats()
+            status["embedding_service"] = self._embeddings.get_stats()
+            docstore = self._vectorstore.docstore if self._vectorstore else None
+            if isinstance(docstore, SQLiteDocstore) and docstore._pool is not None:
+                status["sqlite"] = docstore._pool.stats()
             
             # 获取文档数量
             if self._vectorstore:
@@ -410,8 +1555,16 @@ class KnowledgeBase:
                 print(f"删除物理文件失败: {str(e)}")
         
         return True
-    def search_with_score(self, query: str, k: int = 10) -> List[Tuple[str, Dict, float]]:
-        """搜索知识库并返回相似度分数（距离分数）"""
+    @_read_snapshot
+    def search_with_score(self, query: str, k: int = 10, mode: str = "vector",
+                          metadata_filter: Dict = None) -> List[Tuple[str, Dict, float]]:
+        """
+        搜索知识库并返回分数，mode 和 metadata_filter 含义同 search
+
+        L2索引返回距离分数（越小越相似），余弦索引返回余弦相似度（越大越相似），
+        需要百分比时使用 get_similarity_percentage 转换。
+        """
+        self._check_mode(mode)
         if not self._vectorstore:
             return []
         
@@ -420,40 +1573,11 @@ class KnowledgeBase:
             if self._is_initialization_doc_only() and query.strip():
                 return []
             
-            # 使用带分数的方法搜索
-            docs_with_scores = self._vectorstore.similarity_search_with_score(query, k=k)
-            
             results = []
-            for doc, score in docs_with_scores:
-                # 过滤掉初始化文档
-                if doc.page_content == "系统初始化文档" and doc.metadata.get("source") == "system":
-                    continue
-                
-                content = doc.page_content
-                metadata = doc.metadata
-                
-                # 处理Excel数据
-                if metadata.get('type') == 'excel_data':
-                    test_case_patterns = [
-                        r'测试用例[名称|标题][:：]\s*(.+)',
-                        r'用例[名称|标题][:：]\s*(.+)',
-                        r'测试步骤[:：]\s*(.+)',
-                        r'预期结果[:：]\s*(.+)'
-                    ]
-                    
-                    extracted_info = {}
-                    for pattern in test_case_patterns:
-                        matches = re.findall(pattern, content)
-                        if matches:
-                            key = re.search(r'([^:：]+)[:：]', pattern).group(1)
-                            extracted_info[key] = matches[0]
-                    
-                    if extracted_info:
-                        content = f"提取的测试信息:\n" + "\n".join([f"{k}: {v}" for k, v in extracted_info.items()]) + f"\n\n原始内容:\n{content}"
-                
-                # 注意：FAISS的score是距离分数，越小越相似
-                # 对于余弦相似度，需要转换
-                results.append((content, metadata, float(score)))
+            for doc, score in self._retrieve(query, k, mode, metadata_filter):
+                # 注意：L2索引的score是距离分数，越小越相似
+                # 余弦索引的score是余弦相似度，越大越相似，统一用 get_similarity_percentage 转换
+                results.append((self._format_content(doc), doc.metadata, float(score)))
             
             return results
             
@@ -462,10 +1586,76 @@ class KnowledgeBase:
             traceback.print_exc()
             return []
 
+    @_read_snapshot
+    def search_by_threshold(self, query: str, min_similarity: float = 0.3, k: int = 10,
+                            metadata_filter: Dict = None) -> List[Tuple[str, Dict, float]]:
+        """
+        返回相似度不低于阈值的结果（最多k个），按相似度从高到低排列
+
+        余弦索引直接在FAISS内做范围搜索，只返回超过阈值的向量，不需要多取再过滤；
+        L2索引没有校准的相似度，退回到取k个结果后按 get_similarity_percentage 过滤。
+
+        Args:
+            query: 查询文本
+            min_similarity: 相似度阈值(0-1)
+            k: 最多返回的结果数量
+            metadata_filter: 元数据过滤条件，含义同 search
+
+        Returns:
+            [(内容, 元数据, 相似度(0-1))]
+        """
+        if not self._vectorstore:
+            return []
+        
+        try:
+            if self._is_initialization_doc_only() and query.strip():
+                return []
+            
+            if self._index_metric != "cosine":
+                results = self.search_with_score(query, k=k, metadata_filter=metadata_filter)
+                results = [(content, metadata, self.get_similarity_percentage(score) / 100.0)
+                           for content, metadata, score in results]
+                return [result for result in results if result[2] >= min_similarity]
+            
+            query_vector = self._query_vector(self._embed_query(query))
+            positions = self._filter_positions(metadata_filter) if metadata_filter else None
+            if positions is not None:
+                # 范围搜索只覆盖满足过滤条件的向量
+                hits = self._search_positions_by_threshold(query_vector, min_similarity, positions)
+                metadata_filter = None
+            else:
+                lims, similarities, labels = self._vectorstore.index.range_search(query_vector, float(min_similarity))
+                hits = zip(similarities[lims[0]:lims[1]], labels[lims[0]:lims[1]])
+            hits = sorted(hits, key=lambda hit: -hit[0])
+            
+            index_to_docstore_id = self._vectorstore.index_to_docstore_id
+            results = []
+            # 按相似度顺序分段读取文档块，凑够k个即停止
+            for start in range(0, len(hits), max(k, 1) * 2):
+                segment = hits[start:start + max(k, 1) * 2]
+                doc_ids = [index_to_docstore_id[int(label)] for _, label in segment]
+                docs = self._fetch_documents(doc_ids)
+                for (similarity, _), doc_id in zip(segment, doc_ids):
+                    doc = docs.get(doc_id)
+                    if doc is None or self._is_initialization_doc(doc):
+                        continue
+                    if metadata_filter and not matches_metadata_filter(doc.metadata, metadata_filter):
+                        continue
+                    results.append((self._format_content(doc), doc.metadata, float(similarity)))
+                    if len(results) >= k:
+                        return results
+            return results
+            
+        except Exception as e:
+            print(f"知识库阈值搜索失败: {str(e)}")
+            traceback.print_exc()
+            return []
+
     def get_similarity_percentage(self, distance: float) -> float:
         """
-        将距离分数转换为相似度百分比
-        映射规则：
+        将 search_with_score 返回的分数转换为相似度百分比
+        余弦索引的分数本身就是余弦相似度，直接换算为百分比；
+        L2索引的距离分数按以下规则映射：
         - 0-200分 → 100%-80%
         - 201-400分 → 79%-60%
         - 401-600分 → 59%-40%
@@ -478,6 +1668,9 @@ class KnowledgeBase:
         Returns:
             相似度百分比(0-100)
         """
+        if self._index_metric == "cosine":
+            return round(max(0.0, min(1.0, float(distance))) * 100.0, 2)
+        
         try:
             # 分数越小越相似，所以需要反转映射
             if distance <= 0:
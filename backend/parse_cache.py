@@ -0,0 +1,269 @@
+# backend/parse_cache.py
+import gzip
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+DEFAULT_CACHE_DIR = "E:/sm-ai/data/parse_cache"
+# 解析器版本：解析逻辑变化时递增，旧版本的缓存自动失效
+PARSER_VERSIONS = {
+    "pdf": 2,   # 逐页文本列表，每行一页（ListWriter 格式）
+    "docx": 3,  # 标题、段落和表格块的列表，每行一块（ListWriter 格式，docx_reader.iter_docx_blocks）
+}
+
+
+class ParseCache:
+    """
+    按文件内容哈希缓存的文档解析结果
+
+    缓存键为 (解析器, 解析器版本, 文件内容的sha256)，与文件名和路径无关，
+    同一内容的文件改名或复制到知识库目录后仍然命中。解析结果（文本、逐页或逐段列表）
+    以gzip压缩的JSON保存在 cache_dir/<解析器>/ 下，多个进程共用同一目录。
+    文件的哈希按 (路径, 修改时间, 大小) 在进程内缓存，未变化的文件不重复读取。
+    缓存总大小超过 max_bytes 时按最近使用时间淘汰。
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._hashes: Dict[Tuple[str, float, int], str] = {}
+        self._lock = threading.Lock()
+        self._size = None  # 缓存目录的总大小，首次写入时统计
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def file_hash(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_mtime, stat.st_size)
+        digest = self._hashes.get(key)
+        if digest is None:
+            sha256 = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    sha256.update(block)
+            digest = sha256.hexdigest()
+            with self._lock:
+                if len(self._hashes) > 10000:
+                    self._hashes.clear()
+                self._hashes[key] = digest
+        return digest
+
+    def _entry_path(self, file_path: str, parser: str) -> str:
+        version = PARSER_VERSIONS.get(parser, 1)
+        return os.path.join(self.cache_dir, parser, f"{self.file_hash(file_path)}.v{version}.json.gz")
+
+    def get(self, file_path: str, parser: str) -> Optional[Any]:
+        """读取缓存的解析结果，没有缓存或缓存损坏时返回None"""
+        path = self._entry_path(file_path, parser)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                value = json.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            print(f"解析缓存损坏，重新解析: {str(e)}")
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # 记录最近使用时间，淘汰时保留常用的条目
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, file_path: str, parser: str, value: Any):
+        """保存解析结果（先写临时文件再替换，并发写入同一条目也不会读到不完整的内容）"""
+        path = self._entry_path(file_path, parser)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._track_size(os.path.getsize(path))
+        except Exception as e:
+            print(f"保存解析缓存失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def list_writer(self, file_path: str, parser: str) -> "ListWriter":
+        """逐项写入列表类型的解析结果，全部写完后调用 commit() 生效"""
+        return ListWriter(self, self._entry_path(file_path, parser))
+
+    def iter_list(self, file_path: str, parser: str) -> Optional[Iterator[Any]]:
+        """
+        逐项读取 list_writer 写入的缓存，没有缓存时返回None
+
+        每次只解码一项，不把整个列表读入内存；缓存文件损坏时在读到损坏处抛出异常。
+        """
+        path = self._entry_path(file_path, parser)
+        try:
+            f = gzip.open(path, 'rt', encoding='utf-8')
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return self._iter_lines(f)
+
+    @staticmethod
+    def _iter_lines(f) -> Iterator[Any]:
+        with f:
+            for line in f:
+                line = line.strip().rstrip(",")
+                if line in ("[", "]", ""):
+                    continue
+                yield json.loads(line)
+
+    def get_or_parse(self, file_path: str, parser: str, parse: Callable[[], Any]) -> Any:
+        """命中缓存时直接返回，否则调用 parse() 解析并保存结果"""
+        value = self.get(file_path, parser)
+        if value is None:
+            value = parse()
+            self.put(file_path, parser, value)
+        return value
+
+    def _entries(self):
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".json.gz"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat
+
+    def _track_size(self, added: int):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(stat.st_size for _, stat in self._entries())
+            else:
+                self._size += added
+            if self._size <= self.max_bytes:
+                return
+            # 淘汰到上限的80%，避免每次写入都扫描目录
+            entries = sorted(self._entries(), key=lambda item: item[1].st_mtime)
+            size = sum(stat.st_size for _, stat in entries)
+            removed = 0
+            for path, stat in entries:
+                if size <= self.max_bytes * 0.8:
+                    break
+                try:
+                    os.remove(path)
+                    size -= stat.st_size
+                    removed += 1
+                except OSError:
+                    pass
+            self._size = size
+            print(f"解析缓存超过上限，已淘汰 {removed} 个条目")
+
+    def clear(self):
+        for path, _ in list(self._entries()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._size = 0
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+class ListWriter:
+    """
+    增量写入的列表缓存条目
+
+    每项单独编码成一行写入gzip临时文件，整个文件仍是合法的JSON数组（get() 可以直接读取）；
+    commit() 时替换为正式条目，discard() 或写入出错时删除临时文件，不会留下不完整的缓存。
+    """
+
+    def __init__(self, cache: ParseCache, path: str):
+        self.cache = cache
+        self.path = path
+        self.tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self.count = 0
+        self._file = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = gzip.open(self.tmp_path, 'wt', encoding='utf-8', compresslevel=6)
+            self._file.write("[")
+        except Exception as e:
+            print(f"保存解析缓存失败: {str(e)}")
+            self.discard()
+
+    def append(self, item: Any):
+        if self._file is None:
+            return
+        try:
+            self._file.write(("\n" if not self.count else ",\n") + json.dumps(item, ensure_ascii=False))
+            self.count += 1
+        except Exception as e:
+            print(f"保存解析缓存失败: {str(e)}")
+            self.discard()
+
+    def commit(self):
+        if self._file is None:
+            return
+        try:
+            self._file.write("\n]")
+            self._file.close()
+            self._file = None
+            os.replace(self.tmp_path, self.path)
+            self.cache._track_size(os.path.getsize(self.path))
+        except Exception as e:
+            print(f"保存解析缓存失败: {str(e)}")
+            self.discard()
+
+    def discard(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+        if os.path.exists(self.tmp_path):
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+
+
+_default_cache: Optional[ParseCache] = None
+_default_lock = threading.Lock()
+
+
+def get_parse_cache() -> Optional[ParseCache]:
+    """进程内共享的解析缓存，缓存目录不可用时返回None（直接解析）"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                try:
+                    _default_cache = ParseCache(os.environ.get("PARSE_CACHE_DIR", DEFAULT_CACHE_DIR))
+                except OSError as e:
+                    print(f"解析缓存目录不可用，不使用缓存: {str(e)}")
+                    return None
+    return _default_cache
+
+
+def configure_parse_cache(cache_dir: str, **kwargs) -> ParseCache:
+    """指定共享解析缓存的目录（应用启动时调用）"""
+    global _default_cache
+    with _default_lock:
+        _default_cache = ParseCache(cache_dir, **kwargs)
+    return _default_cache
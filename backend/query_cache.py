@@ -0,0 +1,68 @@
+# backend/query_cache.py
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+# 进程内按嵌入模型共享的查询向量缓存
+_caches_lock = threading.Lock()
+_caches: Dict[str, "QueryEmbeddingCache"] = {}
+
+
+class QueryEmbeddingCache:
+    """有界LRU查询向量缓存，重复的问题不再重新计算嵌入"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, text: str, compute: Callable[[str], List[float]]) -> List[float]:
+        """命中时直接返回缓存的向量，否则调用 compute 计算并缓存"""
+        with self._lock:
+            vector = self._data.get(text)
+            if vector is not None:
+                self._data.move_to_end(text)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        # 计算嵌入较慢，不持有锁
+        vector = compute(text)
+
+        if self.maxsize > 0:
+            with self._lock:
+                self._data[text] = vector
+                self._data.move_to_end(text)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        """命中率统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+def get_query_cache(model_name: str, maxsize: int = 1024) -> QueryEmbeddingCache:
+    """获取指定嵌入模型的共享查询向量缓存"""
+    with _caches_lock:
+        cache = _caches.get(model_name)
+        if cache is None:
+            cache = QueryEmbeddingCache(maxsize=maxsize)
+            _caches[model_name] = cache
+        return cache
@@ -0,0 +1,256 @@
+# backend/sqlite_pool.py
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+BUSY_TIMEOUT = 5.0  # 每次尝试等待锁的秒数（PRAGMA busy_timeout）
+MAX_RETRIES = 5  # 等待超时后重试的次数，第n次重试前再休眠 RETRY_DELAY * n 秒
+RETRY_DELAY = 0.05
+SYNCHRONOUS = "NORMAL"  # WAL模式下 NORMAL 只在检查点时同步磁盘，断电最多丢失最近的事务
+CACHE_SIZE_KB = 16 * 1024  # 每个连接的页缓存
+MMAP_SIZE = 256 * 1024 * 1024  # 内存映射读取数据库文件的上限
+
+
+def _is_lock_error(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+class _ManagedCursor(sqlite3.Cursor):
+    """遇到 database is locked 时按连接管理器的设置重试的游标（连接已在事务中时不重试，见 ConnectionManager.retry）"""
+
+    def execute(self, sql, parameters=()):
+        return self.connection.manager.retry(lambda: sqlite3.Cursor.execute(self, sql, parameters), self.connection)
+
+    def executemany(self, sql, seq_of_parameters):
+        # 参数可能是生成器，重试前先取出
+        seq_of_parameters = list(seq_of_parameters)
+        return self.connection.manager.retry(lambda: sqlite3.Cursor.executemany(self, sql, seq_of_parameters),
+                                             self.connection)
+
+    def executescript(self, sql_script):
+        return self.connection.manager.retry(lambda: sqlite3.Cursor.executescript(self, sql_script), self.connection)
+
+
+class _ManagedConnection(sqlite3.Connection):
+    """连接及其游标上的语句和提交都会在锁等待超时后重试"""
+
+    manager: "ConnectionManager" = None
+
+    def cursor(self, factory=_ManagedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        # 提交遇到锁时事务仍然有效，可以直接重试提交
+        return self.manager.retry(lambda: sqlite3.Connection.commit(self))
+
+
+class ConnectionManager:
+    """
+    单个SQLite数据库文件的连接管理器
+
+    每个线程复用一个连接（sqlite3连接不能在线程间并发使用），不同数据库文件的连接互不共享。
+    连接打开时设置WAL日志（读写互不阻塞）、synchronous、页缓存、内存映射和 busy_timeout；
+    等待写锁超过 busy_timeout 仍失败的语句会退避重试，等待次数和耗时计入统计。
+    """
+
+    def __init__(self, db_path: str, busy_timeout: float = BUSY_TIMEOUT, max_retries: int = MAX_RETRIES,
+                 retry_delay: float = RETRY_DELAY, synchronous: str = SYNCHRONOUS,
+                 cache_size_kb: int = CACHE_SIZE_KB, mmap_size: int = MMAP_SIZE):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.max_retries = max(0, max_retries)
+        self.retry_delay = retry_delay
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.journal_mode = None  # 实际生效的日志模式（内存数据库或网络盘上可能不是WAL）
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 各线程的连接，线程结束后在下次打开连接时关闭
+        self._connections: List[Tuple[weakref.ref, sqlite3.Connection]] = []
+        self.stats_data = {
+            "opened": 0,
+            "closed": 0,
+            "lock_waits": 0,  # 至少等待超时一次的语句数
+            "retries": 0,
+            "lock_failures": 0,  # 重试后仍未获得锁的语句数
+            "lock_wait_seconds": 0.0,
+            "max_lock_wait_seconds": 0.0,
+        }
+
+    def connection(self) -> sqlite3.Connection:
+        """当前线程的连接（首次使用时打开）"""
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = self._open()
+            self._local.connection = conn
+        return conn
+
+    def _open(self) -> sqlite3.Connection:
+        conn = self._connect()
+        with self._lock:
+            self._close_orphans()
+            self._connections.append((weakref.ref(threading.current_thread()), conn))
+            self.stats_data["opened"] += 1
+        return conn
+
+    @contextmanager
+    def dedicated_connection(self):
+        """与线程连接设置相同的临时连接，用完即关闭；用于不能混入调用方事务的操作（如结构迁移）"""
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, factory=_ManagedConnection,
+                               check_same_thread=False)
+        conn.manager = self
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute("PRAGMA journal_mode=WAL").fetchone()
+            self.journal_mode = row[0] if row else None
+        except sqlite3.OperationalError as e:
+            print(f"SQLite无法切换到WAL模式，继续使用默认日志: {str(e)}")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA cache_size = {-int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def _close_orphans(self):
+        """关闭已结束线程留下的连接（调用方持有 _lock）"""
+        alive = []
+        for thread_ref, conn in self._connections:
+            thread = thread_ref()
+            if thread is not None and thread.is_alive():
+                alive.append((thread_ref, conn))
+                continue
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            self.stats_data["closed"] += 1
+        self._connections = alive
+
+    def retry(self, operation: Callable, connection: Optional[sqlite3.Connection] = None):
+        """
+        执行数据库操作，锁等待超时后退避重试
+
+        传入执行语句的连接时，连接已在事务中则不重试、直接抛出：事务读取的快照可能已经过期，
+        重试单条语句无法拿到写锁，也可能在过期的数据上写入，应由调用方回滚后重做整个事务。
+        语句本身隐式开启的事务（还没有执行任何语句）在重试前回滚。
+        """
+        if connection is not None and connection.in_transaction:
+            return operation()
+        started = time.time()
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if not _is_lock_error(e):
+                raise
+            error = e
+        try:
+            for attempt in range(1, self.max_retries + 1):
+                if connection is not None and connection.in_transaction:
+                    sqlite3.Connection.rollback(connection)
+                time.sleep(self.retry_delay * attempt)
+                with self._lock:
+                    self.stats_data["retries"] += 1
+                try:
+                    return operation()
+                except sqlite3.OperationalError as e:
+                    if not _is_lock_error(e):
+                        raise
+                    error = e
+            with self._lock:
+                self.stats_data["lock_failures"] += 1
+            print(f"SQLite数据库锁等待超时（{self.db_path}），已重试 {self.max_retries} 次: {str(error)}")
+            raise error
+        finally:
+            waited = time.time() - started
+            with self._lock:
+                self.stats_data["lock_waits"] += 1
+                self.stats_data["lock_wait_seconds"] += waited
+                self.stats_data["max_lock_wait_seconds"] = max(self.stats_data["max_lock_wait_seconds"], waited)
+
+    def close_all(self):
+        """关闭所有线程的连接（进程退出或数据库文件被替换时调用）"""
+        with self._lock:
+            for _, conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                self.stats_data["closed"] += 1
+            self._connections = []
+        self._local = threading.local()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats_data)
+            stats["connections"] = len(self._connections)
+        stats["db_path"] = self.db_path
+        stats["journal_mode"] = self.journal_mode
+        stats["lock_wait_seconds"] = round(stats["lock_wait_seconds"], 3)
+        stats["max_lock_wait_seconds"] = round(stats["max_lock_wait_seconds"], 3)
+        return stats
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def _path_key(db_path) -> str:
+    db_path = str(db_path)
+    if db_path == ":memory:":
+        return db_path
+    return os.path.normcase(os.path.abspath(db_path))
+
+
+def get_connection_manager(db_path, **kwargs) -> ConnectionManager:
+    """
+    进程内共享的连接管理器，按数据库文件的绝对路径区分
+
+    同一文件的 Database、SQLiteDocstore 和 IngestQueue 在同一线程中共用一个连接；
+    kwargs 只在首次创建该文件的管理器时生效。
+    """
+    key = _path_key(db_path)
+    manager = _managers.get(key)
+    if manager is None:
+        with _managers_lock:
+            manager = _managers.get(key)
+            if manager is None:
+                manager = ConnectionManager(key, **kwargs)
+                _managers[key] = manager
+    return manager
+
+
+def pool_stats() -> Dict[str, Dict]:
+    """所有数据库文件的连接和锁等待统计 {路径: 统计}"""
+    return {key: manager.stats() for key, manager in list(_managers.items())}
+
+
+def close_all_connections(db_path: Optional[str] = None):
+    """关闭指定数据库文件（未指定时为全部）的连接"""
+    keys = [_path_key(db_path)] if db_path is not None else list(_managers)
+    for key in keys:
+        manager = _managers.get(key)
+        if manager is not None:
+            manager.close_all()
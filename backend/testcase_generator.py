@@ -1,7 +1,66 @@
 import pandas as pd
 from datetime import datetime
 import os
-from typing import Dict
+import re
+from typing import Dict, List, Tuple
+
+# 测试用例表的默认列，模块并行生成时合并表在最后增加所属模块列
+TEST_CASE_COLUMNS = ["用例ID", "用例标题", "前置条件", "测试步骤", "测试数据", "预期结果", "优先级"]
+MODULE_COLUMN = "所属模块"
+_SEPARATOR_CELL = re.compile(r'^:?-{3,}:?$')
+
+
+def split_table_row(line: str) -> List[str]:
+    """拆分markdown表格行，保留空单元格的位置"""
+    return [cell.strip() for cell in line.strip().strip('|').split('|')]
+
+
+def parse_markdown_table(text: str) -> Tuple[List[str], List[List[str]]]:
+    """
+    解析文本中的markdown表格，返回 (表头, 数据行)
+
+    分隔行（|---|）前的一行是表头，第一张表的表头作为结果；分隔行和重复出现的表头不计入数据行。
+    没有分隔行时表头为空列表，所有表格行都是数据行。
+    """
+    lines = [line for line in text.split('\n') if line.strip() and '|' in line]
+    header, header_lines, rows = [], set(), []
+    for i, line in enumerate(lines):
+        if i + 1 < len(lines) and all(_SEPARATOR_CELL.match(cell) for cell in split_table_row(lines[i + 1])):
+            header_lines.add(i)
+            header = header or split_table_row(line)
+    for i, line in enumerate(lines):
+        cells = split_table_row(line)
+        if i in header_lines or all(_SEPARATOR_CELL.match(cell) for cell in cells):
+            continue
+        rows.append(cells)
+    return header, rows
+
+
+def merge_module_tables(modules: List[Tuple[str, str]]) -> str:
+    """
+    把各模块的测试用例表合并为一张表：只保留一行表头，模块名放在最后的"所属模块"列
+
+    没有表格行的模块（模型没有按表格输出或处理失败）按"# 模块：名称"标题附在表格之后；
+    所有模块都没有表格行时按模块标题依次拼接原文。
+    """
+    header, rows, others = [], [], []
+    for title, text in modules:
+        module_header, module_rows = parse_markdown_table(text)
+        if module_rows:
+            header = header or module_header
+            rows.extend((title, cells) for cells in module_rows)
+        else:
+            others.append(f"# 模块：{title}\n\n{text}")
+    if not rows:
+        return "\n\n".join(others)
+    header = header or TEST_CASE_COLUMNS
+    table = ["| " + " | ".join(header + [MODULE_COLUMN]) + " |",
+             "|" + "---|" * (len(header) + 1)]
+    for title, cells in rows:
+        cells = (cells + [""] * len(header))[:len(header)]
+        table.append("| " + " | ".join(cells + [title]) + " |")
+    return "\n\n".join(["\n".join(table)] + others)
+
 
 class TestCaseGenerator:
     def __init__(self, output_dir="E:/sm-ai/data/outputs"):
@@ -13,21 +72,25 @@ class TestCaseGenerator:
         # 解析 AI 生成的测试用例文本为 DataFrame
         # 这里假设测试用例是以特定格式返回的，可能需要根据实际情况调整
             test_case_list = []
-            for line in test_cases.split('\n'):
-                if line.strip() and '|' in line:
-                    parts = [p.strip() for p in line.split('|') if p.strip()]
+            header, rows = parse_markdown_table(test_cases)
+            module_index = header.index(MODULE_COLUMN) if MODULE_COLUMN in header else None
+            for cells in rows:
+                parts = [cell for i, cell in enumerate(cells) if i != module_index]
                 # 确保有足够的数据列
-                    if len(parts) >= 3:
-                        test_case_list.append({
-                            "用例ID": parts[0],
-                            "用例标题": parts[1] if len(parts) > 1 else "",
-                            "前置条件": parts[2] if len(parts) > 2 else "",
-                            "测试步骤": parts[3] if len(parts) > 3 else "",
-                            "测试数据": parts[4] if len(parts) > 4 else "",
-                            "预期结果": parts[5] if len(parts) > 5 else "",
-                            "优先级": parts[6] if len(parts) > 6 else "中",
-                            "状态": "未执行"
-                        })
+                if len([part for part in parts if part]) >= 3:
+                    test_case = {
+                        "用例ID": parts[0],
+                        "用例标题": parts[1] if len(parts) > 1 else "",
+                        "前置条件": parts[2] if len(parts) > 2 else "",
+                        "测试步骤": parts[3] if len(parts) > 3 else "",
+                        "测试数据": parts[4] if len(parts) > 4 else "",
+                        "预期结果": parts[5] if len(parts) > 5 else "",
+                        "优先级": (parts[6] if len(parts) > 6 else "") or "中",
+                        "状态": "未执行"
+                    }
+                    if module_index is not None:
+                        test_case[MODULE_COLUMN] = cells[module_index] if module_index < len(cells) else ""
+                    test_case_list.append(test_case)
             
             df = pd.DataFrame(test_case_list)
             
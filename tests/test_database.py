@@ -0,0 +1,87 @@
+# tests/test_database.py
+import os
+import shutil
+import sqlite3
+
+from backend.database import SCHEMA_VERSION, Database
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 早期版本 Database 创建的表结构（data/testcase.db 中的表）
+LEGACY_SCHEMA = '''
+    CREATE TABLE records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        original_filename TEXT NOT NULL,
+        file_path TEXT NOT NULL,
+        output_filename TEXT NOT NULL,
+        output_path TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE knowledge_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        file_path TEXT NOT NULL UNIQUE,
+        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE vector_documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        metadata TEXT NOT NULL,
+        FOREIGN KEY(file_id) REFERENCES knowledge_files(id)
+    );
+'''
+
+
+def _columns(db_path, table):
+    with sqlite3.connect(db_path) as conn:
+        return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def test_migrates_legacy_vector_documents(tmp_path):
+    db_path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+        conn.execute("INSERT INTO knowledge_files (filename, file_path) VALUES ('a.txt', '/files/a.txt')")
+        conn.execute("INSERT INTO vector_documents (file_id, content, metadata) VALUES (1, '登录', '{}')")
+        conn.execute("INSERT INTO records (original_filename, file_path, output_filename, output_path) "
+                     "VALUES ('r.docx', '/r.docx', 'r.xlsx', '/r.xlsx')")
+
+    db = Database(db_path)
+
+    assert db.schema_version == SCHEMA_VERSION
+    assert {"docstore_id", "namespace", "build_id", "source"} <= _columns(db_path, "vector_documents")
+    assert "summary" in _columns(db_path, "records")
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute("SELECT docstore_id, file_id, source, content FROM vector_documents").fetchall()
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert rows == [("legacy-1", 1, "a.txt", "登录")]
+    assert "vector_documents_legacy" not in tables
+    assert len(db.get_records()) == 1
+
+
+def test_migrates_shipped_database(tmp_path):
+    db_path = str(tmp_path / "testcase.db")
+    shutil.copy(os.path.join(REPO_DIR, "data", "testcase.db"), db_path)
+
+    db = Database(db_path)
+
+    assert db.schema_version == SCHEMA_VERSION
+    assert "docstore_id" in _columns(db_path, "vector_documents")
+    # 再次打开时已是最新版本，不重复迁移
+    assert Database(db_path).schema_version == SCHEMA_VERSION
+
+
+def test_runs_only_pending_migrations(tmp_path):
+    db_path = str(tmp_path / "v1.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+        # 版本1只升级了记录、知识库文件和任务表，文档块表仍是旧结构
+        conn.execute("PRAGMA user_version = 1")
+
+    db = Database(db_path)
+
+    assert db.schema_version == SCHEMA_VERSION
+    assert {"docstore_id", "retired_version"} <= _columns(db_path, "vector_documents")
+    # 版本1的迁移没有重新执行
+    assert "summary" not in _columns(db_path, "records")
@@ -0,0 +1,88 @@
+# tests/test_document_processor.py
+import glob
+import os
+
+import docx
+import pytest
+
+from backend import parse_cache
+from backend.document_processor import DocumentProcessor
+from backend.extractors import get_extractor
+
+
+def _make_pdf(path, pages):
+    """每页一行文本的最小PDF"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(1, pages + 1):
+        text = b"BT /F1 12 Tf 40 800 Td (Page %d requirement) Tj ET" % page
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(text), text))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    previous = parse_cache._default_cache
+    yield parse_cache.configure_parse_cache(str(tmp_path / "parse_cache"))
+    parse_cache._default_cache = previous
+
+
+def _entries(cache, parser):
+    return glob.glob(os.path.join(cache.cache_dir, parser, "*.json.gz"))
+
+
+def test_pdf_pages_cached_only_after_full_read(cache, tmp_path):
+    path = _make_pdf(tmp_path / "spec.pdf", 5)
+
+    pages = DocumentProcessor.iter_pdf_pages(path, workers=1)
+    assert next(pages)[0] == 1
+    pages.close()
+    # 中途停止读取不留下不完整的缓存
+    assert _entries(cache, "pdf") == []
+    assert not glob.glob(os.path.join(cache.cache_dir, "pdf", "*.tmp"))
+
+    extracted = list(DocumentProcessor.iter_pdf_pages(path, workers=1))
+    assert [number for number, _ in extracted] == [1, 2, 3, 4, 5]
+    assert "Page 3" in extracted[2][1]
+    assert len(_entries(cache, "pdf")) == 1
+    hits = cache.hits
+    assert list(DocumentProcessor.iter_pdf_pages(path, workers=1)) == extracted
+    assert cache.hits == hits + 1
+
+
+def test_docx_segments_stream_by_section(cache, tmp_path):
+    document = docx.Document()
+    document.add_paragraph("本文档描述电商系统需求。")
+    document.add_heading("1 用户管理", level=1)
+    document.add_heading("1.1 登录", level=2)
+    document.add_paragraph("登录需要验证用户名和密码。")
+    document.add_heading("2 订单", level=1)
+    document.add_paragraph("订单提交后需要校验库存。")
+    path = str(tmp_path / "spec.docx")
+    document.save(path)
+
+    segments = [text for text, _ in get_extractor(path).iter_segments(path)]
+    # 每个有正文的章节一段，正文前带完整的标题路径；只有标题的章节不单独产出
+    assert segments == [
+        "本文档描述电商系统需求。",
+        "# 1 用户管理\n## 1.1 登录\n登录需要验证用户名和密码。",
+        "# 2 订单\n订单提交后需要校验库存。",
+    ]
+    assert len(_entries(cache, "docx")) == 1
+    hits = cache.hits
+    assert DocumentProcessor.read_word_blocks(path)[1] == {"type": "heading", "text": "1 用户管理", "level": 1}
+    assert cache.hits == hits + 1
@@ -0,0 +1,92 @@
+# tests/test_ingest_queue.py
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from backend.ingest_queue import PENDING, PROCESS_OWNER, RUNNING, SUCCEEDED, IngestQueue
+from backend.kb_benchmark import create_embedding_service
+from backend.knowledge_base import KnowledgeBase
+
+
+@pytest.fixture
+def kb(tmp_path):
+    os.makedirs(tmp_path / "kb" / "files")
+    return KnowledgeBase(kb_dir=str(tmp_path / "kb"), db_path=str(tmp_path / "kb.db"), mmap_index=False,
+                         chunk_size=50, chunk_overlap=0, embedding_service=create_embedding_service("hash", 64))
+
+
+def _insert_job(queue, file_path, status=PENDING, owner=None):
+    """直接登记任务，不启动工作线程"""
+    conn = queue._get_connection()
+    cursor = conn.execute('''
+        INSERT INTO ingest_jobs (filename, file_path, status, owner, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (os.path.basename(file_path), file_path, status, owner, time.time()))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def test_job_stores_its_own_stats(kb, tmp_path):
+    path = os.path.join(kb.KB_FILES_DIR, "a.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("登录功能需要验证用户名和密码，失败三次后锁定账号。")
+    queue = IngestQueue(kb, str(tmp_path / "jobs.db"))
+
+    _insert_job(queue, path)
+    first = queue._claim_next()
+    queue._run_job(first)
+    # 其他任务改写了知识库实例上共享的统计，不影响任务记录
+    kb.last_ingest_stats = {"chunks": 999}
+    job = queue.get_job(first["id"])
+    assert job["status"] == SUCCEEDED
+    assert json.loads(job["stats"])["chunks"] == job["progress"] > 0
+
+    # 内容未变化的文件记录本次的结果，而不是上一次入库的统计
+    _insert_job(queue, path)
+    second = queue._claim_next()
+    queue._run_job(second)
+    job = queue.get_job(second["id"])
+    assert job["status"] == SUCCEEDED
+    assert json.loads(job["stats"])["unchanged"] is True
+    assert "未变化" in job["message"]
+
+
+def test_requeues_running_jobs_of_dead_owner(kb, tmp_path):
+    queue = IngestQueue(kb, str(tmp_path / "jobs.db"))
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    dead = _insert_job(queue, "a.txt", RUNNING, f"{socket.gethostname()}:{process.pid}:deadbeef")
+    alive = _insert_job(queue, "a.txt", RUNNING, PROCESS_OWNER)
+    remote = _insert_job(queue, "a.txt", RUNNING, "other-host:1:deadbeef")
+
+    # 队列启动时不等 stale_seconds，立即重新排队执行进程已退出的任务
+    IngestQueue(kb, str(tmp_path / "jobs.db"))
+    assert queue.get_job(dead)["status"] == PENDING
+    assert queue.get_job(alive)["status"] == RUNNING
+    assert queue.get_job(remote)["status"] == RUNNING
+
+
+def test_sync_skips_uploads_whose_job_did_not_succeed(kb, tmp_path):
+    queue = IngestQueue(kb, str(tmp_path / "jobs.db"))
+    path = os.path.join(kb.KB_FILES_DIR, "a.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("登录功能需要验证用户名和密码。")
+    job_id = _insert_job(queue, path)
+    assert queue.cancel(job_id)
+
+    result = kb.sync_files(settle_seconds=0, skip_files=queue.unfinished_files())
+    assert result["added"] == []
+    assert "a.txt" not in kb._vectorstore.docstore.list_sources()
+
+    # 重新提交并成功后文件已入库，目录同步不再跳过，也不会重复入库
+    job_id = _insert_job(queue, path)
+    queue._run_job(queue._claim_next())
+    assert queue.get_job(job_id)["status"] == SUCCEEDED
+    assert queue.unfinished_files() == set()
+    assert kb.sync_files(settle_seconds=0, skip_files=queue.unfinished_files())["added"] == []
+    assert "a.txt" in kb._vectorstore.docstore.list_sources()
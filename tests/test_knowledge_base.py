@@ -0,0 +1,116 @@
+# tests/test_knowledge_base.py
+import os
+import sqlite3
+
+import pytest
+
+from backend.ingest_queue import JobCancelled
+from backend.kb_benchmark import create_embedding_service
+from backend.knowledge_base import KnowledgeBase
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return str(path)
+
+
+def _rows(db_path, where="1 = 1"):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(f"SELECT docstore_id, source, retired_version FROM vector_documents WHERE {where}").fetchall()
+
+
+@pytest.fixture
+def kb(tmp_path):
+    """使用哈希编码器（不加载嵌入模型）的知识库，每批写入一个文档块"""
+    os.makedirs(tmp_path / "kb" / "files")
+    return KnowledgeBase(kb_dir=str(tmp_path / "kb"), db_path=str(tmp_path / "kb.db"), mmap_index=False,
+                         ingest_batch_size=1, chunk_size=50, chunk_overlap=0,
+                         embedding_service=create_embedding_service("hash", 64))
+
+
+def test_cancelled_ingest_leaves_no_rows(kb):
+    path = _write(os.path.join(kb.KB_FILES_DIR, "a.txt"),
+                  "\n\n".join(f"第{i}段：登录功能需要验证用户名和密码，失败{i}次后锁定账号。" for i in range(30)))
+    calls = []
+
+    def cancel_after_first_batch(chunks):
+        calls.append(chunks)
+        raise JobCancelled()
+
+    rows_before = _rows(kb.db_path)
+    assert not kb.add_document(path, progress_callback=cancel_after_first_batch)
+    assert calls
+    assert _rows(kb.db_path) == rows_before
+    assert "a.txt" not in kb._vectorstore.docstore.list_sources()
+
+    # 取消后重新入库不受影响
+    assert kb.add_document(path)
+    assert "a.txt" in kb._vectorstore.docstore.list_sources()
+    assert len(_rows(kb.db_path, "source = 'a.txt'")) == len(kb._vectorstore.index_to_docstore_id)
+
+
+def test_publish_swaps_index_state_without_touching_old_snapshot(kb):
+    first = _write(os.path.join(kb.KB_FILES_DIR, "a.txt"), "登录功能需要验证用户名和密码。")
+    assert kb.add_document(first)
+    assert kb.search("登录", k=5, metadata_filter={"source": "a.txt"})
+    old_state = kb._state
+    old_mapping = dict(old_state.vectorstore.index_to_docstore_id)
+    old_filters = dict(old_state.filter_cache)
+    assert old_filters
+
+    second = _write(os.path.join(kb.KB_FILES_DIR, "b.txt"), "支付功能需要校验订单金额。")
+    assert kb.add_document(second)
+
+    # 新版本整体替换旧状态，写入器没有修改旧快照和它的查询缓存
+    assert kb._state is not old_state
+    assert kb._state.filter_cache is not old_state.filter_cache
+    assert old_state.vectorstore.index_to_docstore_id == old_mapping
+    assert dict(old_state.filter_cache) == old_filters
+    assert [meta["source"] for _, meta in kb.search("支付", k=5, metadata_filter={"source": "b.txt"})] == ["b.txt"]
+
+
+def test_retired_rows_kept_until_no_retained_version_uses_them(kb):
+    path = _write(os.path.join(kb.KB_FILES_DIR, "a.txt"), "登录功能需要验证用户名和密码。")
+    assert kb.add_document(path)
+    first_ids = {row[0] for row in _rows(kb.db_path, "source = 'a.txt'")}
+
+    # 替换文件内容：旧文档块在新版本退役，但上一版本仍保留在磁盘上并引用它们
+    _write(path, "登录功能需要校验验证码，连续失败五次后锁定账号。")
+    assert kb.add_document(path)
+    second_version = kb._index_version
+    retired = {row[0]: row[2] for row in _rows(kb.db_path) if row[0] in first_ids}
+    assert retired and set(retired.values()) == {second_version}
+
+    # 再发布一个版本后，引用旧文档块的版本目录被清理，退役的行随之删除
+    assert kb.add_document(_write(os.path.join(kb.KB_FILES_DIR, "b.txt"), "支付功能需要校验订单金额。"))
+    assert kb._store.oldest_version() == second_version
+    rows = _rows(kb.db_path)
+    assert not first_ids & {row[0] for row in rows}
+    assert {row[1] for row in rows} == {"a.txt", "b.txt"}
+    assert all(row[2] is None for row in rows)
+
+
+def test_old_version_dirs_that_fail_to_delete_are_retried(kb, monkeypatch, capsys):
+    versions = []
+    for name in ("a", "b"):
+        assert kb.add_document(_write(os.path.join(kb.KB_FILES_DIR, f"{name}.txt"), f"{name}功能需要验证用户名和密码。"))
+        versions.append(kb._index_version)
+
+    # 模拟Windows上仍被内存映射、无法删除的索引文件
+    unlink = os.unlink
+
+    def locked_unlink(path, *args, **kwargs):
+        if os.path.basename(os.fsdecode(path)) == "index.faiss":
+            raise PermissionError(13, "文件正在使用", path)
+        return unlink(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "unlink", locked_unlink)
+    assert kb.add_document(_write(os.path.join(kb.KB_FILES_DIR, "c.txt"), "支付功能需要校验订单金额。"))
+    assert kb._store.oldest_version() == versions[0]
+    assert "下次发布时重试" in capsys.readouterr().out
+
+    monkeypatch.setattr(os, "unlink", unlink)
+    assert kb.add_document(_write(os.path.join(kb.KB_FILES_DIR, "d.txt"), "退款功能需要原路返回。"))
+    remaining = sorted(name for name in os.listdir(kb.index_path) if name.startswith("v_"))
+    assert len(remaining) == 2 and versions[0] not in "".join(remaining)
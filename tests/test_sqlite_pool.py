@@ -0,0 +1,55 @@
+# tests/test_sqlite_pool.py
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from backend.sqlite_pool import ConnectionManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = ConnectionManager(str(tmp_path / "pool.db"), busy_timeout=0.05, max_retries=5, retry_delay=0.05)
+    manager.connection().execute("CREATE TABLE items (name TEXT)")
+    manager.connection().commit()
+    yield manager
+    manager.close_all()
+
+
+def _hold_write_lock(db_path, seconds):
+    """另一个连接持有写锁 seconds 秒"""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("BEGIN IMMEDIATE")
+
+    def release():
+        time.sleep(seconds)
+        conn.rollback()
+        conn.close()
+
+    thread = threading.Thread(target=release)
+    thread.start()
+    return thread
+
+
+def test_retries_statement_outside_transaction(manager):
+    holder = _hold_write_lock(manager.db_path, 0.2)
+    conn = manager.connection()
+    conn.execute("INSERT INTO items VALUES ('a')")
+    conn.commit()
+    holder.join()
+    assert manager.stats()["retries"] > 0
+    assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 1
+
+
+def test_does_not_retry_inside_transaction(manager):
+    conn = manager.connection()
+    conn.execute("BEGIN")
+    conn.execute("SELECT COUNT(*) FROM items").fetchone()
+    holder = _hold_write_lock(manager.db_path, 0.5)
+    # 事务中的语句拿不到锁时立即抛出，由调用方回滚后重做整个事务
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("INSERT INTO items VALUES ('a')")
+    assert manager.stats()["retries"] == 0
+    conn.rollback()
+    holder.join()
@@ -0,0 +1,29 @@
+# tests/test_testcase_generator.py
+import pandas as pd
+
+from backend.testcase_generator import MODULE_COLUMN, TestCaseGenerator, merge_module_tables, parse_markdown_table
+
+HEADER = "| 用例ID | 用例标题 | 前置条件 | 测试步骤 | 测试数据 | 预期结果 | 优先级 |\n|---|---|---|---|---|---|---|\n"
+
+
+def test_merged_sections_have_a_single_header(tmp_path):
+    merged = merge_module_tables([
+        ("登录", HEADER + "| TC_001 | 正确密码登录 | 已注册 | 输入密码 | 123456 | 登录成功 | P0 |\n"
+                          "| TC_002 | 错误密码登录 | 已注册 | 输入错误密码 | 000000 | 提示错误 | P1 |"),
+        ("支付", HEADER + "| TC_003 | 余额支付 | 已登录 |  | 100元 | 支付成功 | P0 |"),
+        ("报表", "（处理失败：超时）"),
+    ])
+
+    header, rows = parse_markdown_table(merged)
+    assert merged.count("| 用例ID |") == 1
+    assert sum(line.startswith("|---") for line in merged.split("\n")) == 1
+    assert header[-1] == MODULE_COLUMN
+    assert [(row[0], row[-1]) for row in rows] == [("TC_001", "登录"), ("TC_002", "登录"), ("TC_003", "支付")]
+    # 空单元格保留位置，后面的列不前移
+    assert rows[2][3] == "" and rows[2][6] == "P0"
+    assert "# 模块：报表" in merged
+
+    output = TestCaseGenerator(output_dir=str(tmp_path)).generate_excel(merged, "需求.docx")
+    df = pd.read_excel(output)
+    assert list(df["用例ID"]) == ["TC_001", "TC_002", "TC_003"]
+    assert list(df[MODULE_COLUMN]) == ["登录", "登录", "支付"]